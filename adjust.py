@@ -0,0 +1,244 @@
+"""NumPy による色調整エンジン
+
+鮮やかさ・明るさ・コントラスト・ガンマの調整を、画像を1回走査するだけで
+まとめて適用する。画素の値ごとに独立な明るさ・コントラスト・ガンマは
+0-255 の変換表（LUT）に合成し、チャンネルをまたぐ鮮やかさだけを NumPy で
+計算する。画像は一定の行数ごとの帯に分けて処理するため、作業用のメモリは
+画像の大きさによらず一定に収まる。
+
+計算方法は Pillow の ImageEnhance と同じにしてあり、NumPy がない場合や
+RGB/RGBA 以外の画像は ImageEnhance で処理する。NumPy は起動を速くするため、
+最初に色調整をする時に読み込む。
+
+ベンチマーク:
+    uv run adjust.py
+"""
+
+import time
+
+from PIL import Image, ImageEnhance, ImageStat
+
+# 読み込んだ NumPy（load_numpy() が設定する）
+np = None
+_numpy_loaded = False
+
+# 調整操作の種類
+ADJUSTMENTS = ("saturation", "brightness", "contrast", "gamma")
+
+# 一度に処理する行数
+STRIP_ROWS = 256
+
+
+def is_adjustment(operation):
+    """色調整の操作かどうか"""
+    return operation["op"] in ADJUSTMENTS
+
+
+def channel_lut(op, value, mean=None):
+    """明るさ・コントラスト・ガンマを 0-255 の変換表にする"""
+    lut = []
+    for v in range(256):
+        if op == "brightness":
+            result = int(v * value)
+        elif op == "contrast":
+            result = int(mean + value * (v - mean))
+        else:
+            result = int(255 * (v / 255) ** (1 / value) + 0.5)
+        lut.append(min(max(result, 0), 255))
+    return lut
+
+
+def compile_stages(image, operations):
+    """操作の列を、変換表（"lut"）と鮮やかさ（"saturation"）の段階に変換
+
+    連続する変換表は1つに合成する。コントラストの基準値は、直前までの
+    変換表を適用した画像から求める（鮮やかさの後のコントラストは
+    apply_adjustments が区切って処理する）。
+    """
+    stages = []
+    for operation in operations:
+        op = operation["op"]
+        value = float(operation["value"])
+        if op == "saturation":
+            if value != 1.0:
+                stages.append(("saturation", value))
+            continue
+        if op == "gamma" and value <= 0:
+            raise ValueError("ガンマには正の値を指定してください")
+
+        previous = stages[-1][1] if stages and stages[-1][0] == "lut" else None
+        mean = luminance_mean(image, previous) if op == "contrast" else None
+        lut = channel_lut(op, value, mean)
+        if previous is not None:
+            stages[-1] = ("lut", [lut[v] for v in previous])
+        else:
+            stages.append(("lut", lut))
+    return stages
+
+
+def luminance_mean(image, lut=None):
+    """lut を適用した画像の輝度の平均（コントラストの基準値）"""
+    if lut is not None:
+        image = image.point(lut * 3 + list(range(256)) * (len(image.getbands()) - 3))
+    return int(ImageStat.Stat(image.convert("L")).mean[0] + 0.5)
+
+
+def split_points(operations):
+    """鮮やかさの後のコントラストの位置を返す
+
+    コントラストの基準値はそこまでの結果の輝度から求めるため、
+    鮮やかさを適用した画像を一度作ってから続きを処理する。
+    """
+    points = []
+    saturated = False
+    for i, operation in enumerate(operations):
+        if operation["op"] == "saturation" and float(operation["value"]) != 1.0:
+            saturated = True
+        elif operation["op"] == "contrast" and saturated:
+            points.append(i)
+            saturated = False
+    return points
+
+
+def load_numpy():
+    """NumPy を初めて使う時に読み込んで返す（ない場合は None）"""
+    global np, _LUMA, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        else:
+            # 輝度の計算に使う、各チャンネルの値に重みを掛けた表
+            _LUMA = (
+                numpy.arange(256, dtype=numpy.int32) * 19595,
+                numpy.arange(256, dtype=numpy.int32) * 38470,
+                numpy.arange(256, dtype=numpy.int32) * 7471 + 0x8000,
+            )
+        np = numpy
+        _numpy_loaded = True
+    return np
+
+
+def saturate(rgb, value):
+    """輝度との差を value 倍する（ImageEnhance.Color と同じ計算）"""
+    # Pillow の RGB から L への変換と同じ式で輝度を求める
+    gray = (_LUMA[0][rgb[..., 0]] + _LUMA[1][rgb[..., 1]] + _LUMA[2][rgb[..., 2]]) >> 16
+    gray = gray.astype(np.float32)[..., None]
+    result = rgb.astype(np.float32)
+    result -= gray
+    result *= np.float32(value)
+    result += gray
+    np.clip(result, 0, 255, out=result)
+    return result.astype(np.uint8)
+
+
+def run_stages(strip, stages):
+    """1つの帯に全段階を適用（アルファチャンネルはそのまま）"""
+    rgb = strip[..., :3]
+    for kind, value in stages:
+        if kind == "lut":
+            rgb = np.asarray(value, dtype=np.uint8)[rgb]
+        else:
+            rgb = saturate(rgb, value)
+    if strip.shape[-1] == 4:
+        return np.concatenate([rgb, strip[..., 3:]], axis=-1)
+    return rgb
+
+
+def apply_stages(image, operations):
+    """操作の列を1回の走査で適用（何も変わらない場合は image を返す）"""
+    stages = compile_stages(image, operations)
+    if not stages:
+        return image
+
+    # 1段階だけであれば合成の利点がないので、Pillow の処理をそのまま使う
+    if len(stages) == 1:
+        kind, value = stages[0]
+        if kind == "saturation":
+            return ImageEnhance.Color(image).enhance(value)
+        lut = value * 3
+        if image.mode == "RGBA":
+            lut += list(range(256))
+        return image.point(lut)
+
+    output = Image.new(image.mode, image.size)
+    for top in range(0, image.height, STRIP_ROWS):
+        box = (0, top, image.width, min(top + STRIP_ROWS, image.height))
+        strip = np.asarray(image.crop(box))
+        output.paste(Image.fromarray(run_stages(strip, stages)), (0, top))
+    return output
+
+
+def apply_adjustments(image, operations):
+    """色調整の操作の列をまとめて適用した画像を返す
+
+    何も変わらない場合は image をそのまま返す。
+    """
+    if load_numpy() is None or image.mode not in ("RGB", "RGBA"):
+        return apply_with_pillow(image, operations)
+
+    start = 0
+    for end in split_points(operations) + [len(operations)]:
+        image = apply_stages(image, operations[start:end])
+        start = end
+    return image
+
+
+def apply_with_pillow(image, operations):
+    """ImageEnhance で色調整の操作を1つずつ適用"""
+    for operation in operations:
+        op = operation["op"]
+        value = float(operation["value"])
+        if op == "gamma":
+            if value != 1.0:
+                lut = channel_lut(op, value)
+                image = image.point(lut * len(image.getbands()))
+            continue
+        if value == 1.0:
+            continue
+        enhancer = {
+            "saturation": ImageEnhance.Color,
+            "brightness": ImageEnhance.Brightness,
+            "contrast": ImageEnhance.Contrast,
+        }[op]
+        image = enhancer(image).enhance(value)
+    return image
+
+
+def benchmark(size=(4000, 3000), repeat=3):
+    """Pillow と NumPy の処理時間を比較して表示"""
+    image = Image.effect_noise(size, 64).convert("RGB")
+    cases = {
+        "鮮やかさ": [{"op": "saturation", "value": 1.8}],
+        "明るさ+コントラスト+ガンマ": [
+            {"op": "brightness", "value": 1.1},
+            {"op": "contrast", "value": 1.2},
+            {"op": "gamma", "value": 0.9},
+        ],
+        "すべて": [
+            {"op": "saturation", "value": 1.8},
+            {"op": "brightness", "value": 1.1},
+            {"op": "contrast", "value": 1.2},
+            {"op": "gamma", "value": 0.9},
+        ],
+    }
+    megapixels = size[0] * size[1] / 1_000_000
+    print(f"{size[0]}x{size[1]} ({megapixels:.0f}MP), {repeat}回の最短時間")
+    for name, operations in cases.items():
+        timings = []
+        for function in (apply_with_pillow, apply_adjustments):
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function(image, operations)
+                best = min(best, time.perf_counter() - start)
+            timings.append(best)
+        print(
+            f"{name}: Pillow {timings[0]:.3f}秒, NumPy {timings[1]:.3f}秒"
+            f" ({timings[0] / timings[1]:.1f}倍)"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
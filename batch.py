@@ -0,0 +1,227 @@
+"""フォルダ単位のバッチ処理
+
+GUIと同じ編集操作（operations.py）を、レシピに従ってフォルダ内の画像に
+まとめて適用する。処理はCPU数に応じたプロセスプールで並列に行い、
+ファイルごとの処理時間と結果をマニフェスト（JSON Lines）に追記する。
+マニフェストで成功が記録されているファイルは、再実行時にスキップする。
+画素数が --max-pixels を超える画像は、一時ファイル上で帯ごとに処理する。
+
+使い方:
+    uv run batch.py 入力フォルダ 出力フォルダ --recipe recipe.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from adjust import ADJUSTMENTS
+from loader import open_image
+from operations import apply_operations
+from outofcore import DEFAULT_MAX_PIXELS, is_large, map_image
+from saver import save_atomic
+
+# 航空写真のような大きな画像も開けるよう、Pillow の画素数の上限を外す
+Image.MAX_IMAGE_PIXELS = None
+
+# 拡張子ごとの保存形式
+FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".heic": "HEIF"}
+
+# レシピで全ファイルに適用する操作のキー
+DEFAULT_KEY = "*"
+
+
+def load_recipe(path):
+    """レシピを読み込み、{ファイル名: 操作の一覧} を返す
+
+    JSON の場合は {"*": [操作, ...], "IMG_0001.heic": [操作, ...]} の形式。
+    CSV の場合は file,op,args,color の列を持ち、args は空白区切りの数値
+    （fill は x1 y1 x2 y2 ...、crop は left top right bottom、
+    saturation・brightness・contrast・gamma は値）。
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            return parse_csv_recipe(f)
+        return validate_recipe(json.load(f))
+
+
+def validate_recipe(recipe):
+    """レシピが {ファイル名: [操作, ...]} の形式であることを確かめて返す"""
+    if not isinstance(recipe, dict):
+        raise ValueError("レシピは {ファイル名: [操作, ...]} の形式で指定してください")
+    for name, operations in recipe.items():
+        if not isinstance(operations, list) or not all(
+            isinstance(operation, dict) and "op" in operation
+            for operation in operations
+        ):
+            raise ValueError(f"レシピの {name} の操作の一覧が正しくありません")
+    return recipe
+
+
+def parse_csv_recipe(f):
+    """CSV形式のレシピを読み込む"""
+    recipe = {}
+    for row in csv.DictReader(f):
+        values = [float(v) for v in row["args"].split()]
+        op = row["op"]
+        if op == "fill":
+            points = [
+                [int(values[i]), int(values[i + 1])] for i in range(0, len(values), 2)
+            ]
+            operation = {"op": "fill", "points": points}
+            operation["color"] = row.get("color") or "white"
+        elif op == "crop":
+            operation = {"op": "crop", "box": [int(v) for v in values]}
+        elif op in ADJUSTMENTS:
+            operation = {"op": op, "value": values[0]}
+        else:
+            raise ValueError(f"未知の操作です: {op}")
+        recipe.setdefault(row["file"], []).append(operation)
+    return recipe
+
+
+def operations_for(recipe, name):
+    """ファイルに適用する操作の一覧を返す"""
+    return recipe.get(name, recipe.get(DEFAULT_KEY, []))
+
+
+def process_file(
+    input_path, output_path, operations, format, params, max_pixels=DEFAULT_MAX_PIXELS
+):
+    """1ファイルを処理して結果を返す（ワーカープロセスで実行）"""
+    start = time.perf_counter()
+    record = {"file": os.path.basename(input_path), "output": output_path}
+    try:
+        with open_image(input_path) as image:
+            # 大きな画像は一時ファイルにマップして帯ごとに処理
+            if is_large(image.size, max_pixels):
+                image = map_image(image)
+            else:
+                image.load()
+            image = apply_operations(image, operations)
+            save_atomic(image, output_path, format, **params)
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def read_manifest(path):
+    """マニフェストから処理済み（成功）のファイル名を返す"""
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get("status") == "ok":
+                    done.add(record["file"])
+    return done
+
+
+def list_images(directory):
+    """フォルダ内の対応している画像ファイル名を返す"""
+    return sorted(
+        name
+        for name in os.listdir(directory)
+        if os.path.splitext(name)[1].lower() in FORMATS
+    )
+
+
+def save_params(format, quality):
+    """保存形式ごとのパラメータ"""
+    if format == "PNG":
+        return {"compress_level": 6}
+    if format == "JPEG":
+        return {"quality": quality}
+    return {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="フォルダ内の画像にレシピの編集操作をまとめて適用します"
+    )
+    parser.add_argument("input_dir", help="入力フォルダ")
+    parser.add_argument("output_dir", help="出力フォルダ")
+    parser.add_argument("--recipe", required=True, help="レシピ（JSON または CSV）")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="並列に処理するプロセス数"
+    )
+    parser.add_argument(
+        "--manifest", help="マニフェストのパス（既定は 出力フォルダ/manifest.jsonl）"
+    )
+    parser.add_argument(
+        "--format", choices=["png", "jpg", "heic"], help="保存形式（既定は入力と同じ）"
+    )
+    parser.add_argument("--quality", type=int, default=95, help="JPEG品質 (1-100)")
+    parser.add_argument(
+        "--max-pixels",
+        type=int,
+        default=DEFAULT_MAX_PIXELS,
+        help="これを超える画素数の画像は一時ファイル上で帯ごとに処理",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = load_recipe(args.recipe)
+    except (OSError, KeyError, ValueError) as e:
+        print(f"レシピを読み込めません: {e}", file=sys.stderr)
+        return 2
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = args.manifest or os.path.join(args.output_dir, "manifest.jsonl")
+
+    # マニフェストで成功が記録されているファイルは処理しない（再開用）
+    done = read_manifest(manifest_path)
+    names = [name for name in list_images(args.input_dir) if name not in done]
+    print(f"{len(names)} 件を処理します（処理済み {len(done)} 件をスキップ）")
+
+    errors = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool, open(
+        manifest_path, "a", encoding="utf-8"
+    ) as manifest:
+        futures = []
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            ext = f".{args.format}" if args.format else ext.lower()
+            format = FORMATS[ext]
+            futures.append(
+                pool.submit(
+                    process_file,
+                    os.path.join(args.input_dir, name),
+                    os.path.join(args.output_dir, stem + ext),
+                    operations_for(recipe, name),
+                    format,
+                    save_params(format, args.quality),
+                    args.max_pixels,
+                )
+            )
+
+        # 終わったものから順にマニフェストへ書き出す
+        for count, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest.flush()
+            if record["status"] != "ok":
+                errors += 1
+            print(
+                f"[{count}/{len(names)}] {record['file']}: {record['status']}"
+                f" ({record['seconds']:.2f}秒)"
+                + (f" {record['error']}" if "error" in record else "")
+            )
+
+    elapsed = time.perf_counter() - start
+    print(f"完了: {len(names) - errors} 件成功, {errors} 件失敗, {elapsed:.1f}秒")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
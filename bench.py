@@ -0,0 +1,436 @@
+"""編集処理のベンチマーク
+
+ImageEditor の各メソッドが行う処理を、Tk のキャンバスを使わずに同じ関数の
+組み合わせで実行し、処理時間・ピークメモリ・処理速度を計測する。
+画像は指定した画素数（メガピクセル）で合成して作るため、手元に大きな
+画像がなくても実行できる。
+
+    load        decode_image（JPEG / PNG / HEIC）
+    display     update_display_image（ピラミッドの作成とタイルの合成）
+    fill        fill_area（頂点数の異なる多角形の塗りつぶしと履歴への記録）
+    saturation  update_saturation（縮小画像でのプレビューと元の解像度での確定）
+    undo_redo   undo / redo（塗りつぶしの履歴をすべて戻してからやり直す）
+    save        save_image（保存形式ごとの save_atomic）
+
+処理時間は repeat 回の最短時間（setup と teardown は含まない）。ピークメモリは
+別に1回実行し、その間のプロセスのメモリ使用量（RSS）を短い間隔で調べて、
+実行前からの最大の増加分を記録する（Pillow が内部で確保する画像のメモリも
+含む）。RSS は psutil があればそれで、なければ Linux の /proc から調べ、
+どちらもなければ記録しない。
+
+結果は JSON に保存し、--baseline に以前の結果を指定すると、遅くなった
+項目を表示して終了コード 1 を返す。
+
+使い方:
+    uv run bench.py --sizes 1 12 --output bench.json
+    uv run bench.py --baseline bench.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import PIL
+from PIL import Image
+
+from adjust import load_numpy
+from display import ImagePyramid, TileCache, Viewport
+from history import History
+from loader import decode_image, register_heif
+from operations import apply_operations, fill_polygon, polygon_bbox
+from saver import save_atomic
+
+# HEIC の計測には pillow_heif が必要（登録の時間は計測に含めない）
+if register_heif():
+    import pillow_heif
+else:
+    pillow_heif = None
+
+# NumPy の読み込みの時間も計測に含めない
+load_numpy()
+
+# 大きな合成画像も開けるよう、Pillow の画素数の上限を外す
+Image.MAX_IMAGE_PIXELS = None
+
+# 既定で計測する画像の大きさ（メガピクセル）
+DEFAULT_SIZES = (1, 12, 48, 100)
+
+# 表示の計測に使うキャンバスの大きさ
+CANVAS_SIZES = ((800, 600), (1920, 1080), (3840, 2160))
+
+# 塗りつぶしの計測に使う多角形の頂点数
+VERTEX_COUNTS = (3, 16, 64, 256)
+
+# 元に戻す/やり直すの計測で記録する塗りつぶしの回数
+UNDO_STEPS = 20
+
+# 保存形式と保存時のパラメータ（GUIの保存と同じ）
+SAVE_FORMATS = {
+    "JPEG": (".jpg", {"quality": 95}),
+    "PNG": (".png", {"compress_level": 6}),
+    "HEIF": (".heic", {}),
+}
+
+# この倍率より遅くなった項目を性能の低下として扱う
+DEFAULT_THRESHOLD = 1.2
+
+# ピークメモリの計測で RSS を調べる間隔（秒）
+RSS_INTERVAL = 0.001
+
+
+def image_size(megapixels, aspect=4 / 3):
+    """指定した画素数で、縦横比が aspect の画像の大きさ"""
+    height = int(math.sqrt(megapixels * 1_000_000 / aspect))
+    return int(height * aspect), height
+
+
+def synthetic_image(size):
+    """写真に近い圧縮率になるよう、グラデーションとノイズを合成した画像"""
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.radial_gradient("L").resize(size)
+    blue = Image.effect_noise(size, 32)
+    return Image.merge("RGB", (red, green, blue))
+
+
+def regular_polygon(size, vertices):
+    """画像の中央に、画像の半分ほどの大きさの正多角形の頂点を返す"""
+    width, height = size
+    radius = min(width, height) / 4
+    return [
+        (
+            int(width / 2 + radius * math.cos(2 * math.pi * i / vertices)),
+            int(height / 2 + radius * math.sin(2 * math.pi * i / vertices)),
+        )
+        for i in range(vertices)
+    ]
+
+
+def current_rss():
+    """プロセスの現在のメモリ使用量（RSS、バイト）。調べられない場合は None"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def release_free_memory():
+    """解放済みのメモリを OS に返す（glibc のみ。前の項目の分を RSS から除くため）"""
+    try:
+        import ctypes
+
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def peak_rss(run, *args):
+    """run を実行し、実行前からの RSS の最大の増加分（バイト）を返す"""
+    release_free_memory()
+    before = current_rss()
+    if before is None:
+        run(*args)
+        return None
+    peak = [before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_INTERVAL):
+            peak[0] = max(peak[0], current_rss())
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        run(*args)
+    finally:
+        done.set()
+        thread.join()
+    return max(peak[0], current_rss()) - before
+
+
+def measure(run, setup=None, teardown=None, repeat=3):
+    """run の最短時間（秒）とピークメモリ（バイト）を返す
+
+    setup を指定した場合は毎回 setup() の戻り値を run に渡し、teardown を
+    指定した場合は run の後に同じ引数で呼ぶ（setup と teardown は計測しない）。
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        run(*args)
+        best = min(best, time.perf_counter() - start)
+        if teardown:
+            teardown(*args)
+
+    args = setup() if setup else ()
+    try:
+        peak = peak_rss(run, *args)
+    finally:
+        if teardown:
+            teardown(*args)
+    return best, peak
+
+
+def load_cases(image, directory):
+    """読み込み: 保存形式ごとに、元の解像度でのデコード"""
+    for format, (ext, params) in SAVE_FORMATS.items():
+        if format == "HEIF" and pillow_heif is None:
+            continue
+        path = os.path.join(directory, "load" + ext)
+        save_atomic(image, path, format, **params)
+        yield (
+            f"load/{format.lower()}",
+            {},
+            lambda path=path: decode_image(path),
+            None,
+            None,
+        )
+
+
+def display_cases(image):
+    """表示: キャンバスの大きさごとに、ウィンドウに合わせた最初の描画"""
+
+    def run(canvas_size):
+        viewport = Viewport()
+        viewport.update(image.size, canvas_size)
+        TileCache().compose(
+            ImagePyramid(image),
+            viewport.zoom,
+            viewport.scaled_size(),
+            viewport.visible_box(),
+        )
+
+    for canvas_size in CANVAS_SIZES:
+        name = f"display/{canvas_size[0]}x{canvas_size[1]}"
+        yield name, {"canvas": list(canvas_size)}, run, lambda c=canvas_size: (c,), None
+
+
+def fill_cases(image):
+    """塗りつぶし: 頂点数ごとに、塗りつぶしと履歴への記録"""
+
+    def setup():
+        base = image.copy()
+        return base, History(base)
+
+    def run(base, history, points):
+        box = polygon_bbox(points, base.size)
+        before = base.crop(box)
+        fill_polygon(base, points, "white")
+        operation = {"op": "fill", "points": [list(p) for p in points]}
+        history.record_patch(box, before, base.crop(box), operation)
+
+    def teardown(base, history, points):
+        history.close()
+
+    for vertices in VERTEX_COUNTS:
+        points = regular_polygon(image.size, vertices)
+        yield (
+            f"fill/{vertices}",
+            {"vertices": vertices},
+            run,
+            lambda points=points: setup() + (points,),
+            teardown,
+        )
+
+
+def saturation_cases(image, canvas_size=(1920, 1080)):
+    """鮮やかさ: 縮小画像でのプレビューと、元の解像度での確定"""
+    operations = [{"op": "saturation", "value": 1.5}]
+    viewport = Viewport()
+    viewport.update(image.size, canvas_size)
+
+    def preview():
+        proxy = TileCache().compose(
+            ImagePyramid(image),
+            viewport.zoom,
+            viewport.scaled_size(),
+            viewport.visible_box(),
+        )
+        apply_operations(proxy, operations)
+
+    yield "saturation/preview", {"canvas": list(canvas_size)}, preview, None, None
+    yield (
+        "saturation/full",
+        {},
+        lambda: apply_operations(image, operations),
+        None,
+        None,
+    )
+
+
+def undo_redo_cases(image):
+    """元に戻す/やり直す: 塗りつぶしの履歴をすべて戻してからやり直す"""
+
+    def setup():
+        base = image.copy()
+        history = History(base)
+        for i in range(UNDO_STEPS):
+            points = regular_polygon(base.size, 3 + i)
+            box = polygon_bbox(points, base.size)
+            before = base.crop(box)
+            fill_polygon(base, points, (i * 12, 0, 0))
+            history.record_patch(box, before, base.crop(box))
+        return (history,)
+
+    def run(history):
+        while history.can_undo():
+            history.undo()
+        while history.can_redo():
+            history.redo()
+
+    def teardown(history):
+        history.close()
+
+    yield "undo_redo", {"steps": UNDO_STEPS}, run, setup, teardown
+
+
+def save_cases(image, directory):
+    """保存: 保存形式ごとに、一時ファイルへの書き出しと置き換え"""
+    for format, (ext, params) in SAVE_FORMATS.items():
+        if format == "HEIF" and pillow_heif is None:
+            continue
+        path = os.path.join(directory, "save" + ext)
+
+        def run(path=path, format=format, params=params):
+            save_atomic(image, path, format, **params)
+
+        yield f"save/{format.lower()}", {}, run, None, None
+
+
+def run_benchmarks(sizes, repeat=3, cases=None):
+    """画像の大きさごとに全項目を計測し、結果の一覧を返す"""
+    results = []
+    for megapixels in sizes:
+        size = image_size(megapixels)
+        image = synthetic_image(size)
+        pixels = size[0] * size[1]
+        with tempfile.TemporaryDirectory() as directory:
+            groups = [
+                load_cases(image, directory),
+                display_cases(image),
+                fill_cases(image),
+                saturation_cases(image),
+                undo_redo_cases(image),
+                save_cases(image, directory),
+            ]
+            for group in groups:
+                for name, params, run, setup, teardown in group:
+                    if cases and not any(name.startswith(c) for c in cases):
+                        continue
+                    record = {"case": name, "megapixels": megapixels, **params}
+                    try:
+                        seconds, peak = measure(run, setup, teardown, repeat)
+                    except Exception as e:
+                        record["error"] = str(e)
+                    else:
+                        record["seconds"] = round(seconds, 6)
+                        record["peak_bytes"] = peak
+                        record["megapixels_per_second"] = round(
+                            pixels / 1_000_000 / seconds, 2
+                        )
+                    results.append(record)
+                    print(format_record(record))
+    return results
+
+
+def format_record(record):
+    """結果を1行で表示する文字列"""
+    label = f"{record['megapixels']:>4}MP {record['case']}"
+    if "error" in record:
+        return f"{label}: エラー {record['error']}"
+    peak = record["peak_bytes"]
+    return (
+        f"{label}: {record['seconds'] * 1000:.1f}ms, "
+        + (f"ピーク +{peak / 1024 / 1024:.1f}MB, " if peak is not None else "")
+        + f"{record['megapixels_per_second']:.1f}MP/秒"
+    )
+
+
+def environment():
+    """結果を比較する時に参考にする実行環境"""
+    numpy = load_numpy()
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__ if numpy is not None else None,
+        "pillow_heif": pillow_heif.__version__ if pillow_heif is not None else None,
+        "cpu_count": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """以前の結果と比べて threshold 倍より遅くなった項目を返す"""
+    previous = {
+        (r["case"], r["megapixels"]): r["seconds"]
+        for r in baseline["results"]
+        if "seconds" in r
+    }
+    regressions = []
+    for record in results:
+        before = previous.get((record["case"], record["megapixels"]))
+        if before and "seconds" in record and record["seconds"] > before * threshold:
+            regressions.append((record, record["seconds"] / before))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="編集処理の性能を計測します")
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help="計測する画像の大きさ（メガピクセル）",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="各項目を計測する回数")
+    parser.add_argument(
+        "--case", action="append", help="計測する項目（先頭一致、複数指定可）"
+    )
+    parser.add_argument("--output", help="結果を保存する JSON のパス")
+    parser.add_argument("--baseline", help="比較する以前の結果の JSON のパス")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="この倍率より遅くなった項目を性能の低下として扱う",
+    )
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) if s == int(s) else s for s in args.sizes]
+    results = run_benchmarks(sizes, args.repeat, args.case)
+    report = {"environment": environment(), "results": results}
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for record, ratio in regressions:
+            print(f"性能の低下: {record['megapixels']}MP {record['case']} ({ratio:.2f}倍)")
+        if regressions:
+            return 1
+        print("性能の低下はありません")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
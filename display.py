@@ -0,0 +1,328 @@
+"""表示用の画像処理
+
+ウィンドウに合わせた表示画像を、元画像を毎回縮小するのではなく
+あらかじめ縮小しておいた画像（ピラミッド）から作成する。
+拡大・移動した場合は、表示されている範囲のタイルだけを作成してキャッシュする。
+再描画の要求はスケジューラでまとめてから描画する。
+"""
+
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# 拡大率の上限
+MAX_ZOOM = 32.0
+
+# タイルの一辺の画素数
+TILE_SIZE = 256
+
+
+class ImagePyramid:
+    """1/2ずつ縮小した画像を段階的に保持するピラミッド
+
+    levels[0] は元画像そのもので、levels[k] は元画像を 1/2^k に縮小したもの。
+    必要な段だけを遅延して作成する。
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.levels = [source]
+
+    def level_for(self, display_size):
+        """表示サイズ以上の大きさを持つ最も小さい段を返す"""
+        width, height = display_size
+        level = 0
+        while True:
+            next_width = (self.levels[level].width + 1) // 2
+            next_height = (self.levels[level].height + 1) // 2
+            if next_width < width or next_height < height:
+                return self.levels[level]
+            if level + 1 == len(self.levels):
+                self.levels.append(self.levels[level].reduce(2))
+            level += 1
+
+    def replace_source(self, source, box):
+        """box の範囲だけが異なる別の画像に元画像を差し替える"""
+        self.source = source
+        self.levels[0] = source
+        self.invalidate(box)
+
+    def render(self, display_size):
+        """表示サイズの画像を作成"""
+        level = self.level_for(display_size)
+        if level.size == tuple(display_size):
+            return level
+        return level.resize(display_size, Image.Resampling.LANCZOS)
+
+    def render_region(self, display_size, box, resample=Image.Resampling.LANCZOS):
+        """表示サイズの画像のうち box の範囲だけを作成"""
+        level = self.level_for(display_size)
+        if level.size == tuple(display_size):
+            return level.crop(box)
+        scale_x = level.width / display_size[0]
+        scale_y = level.height / display_size[1]
+        source_box = (
+            box[0] * scale_x,
+            box[1] * scale_y,
+            box[2] * scale_x,
+            box[3] * scale_y,
+        )
+        return level.resize(
+            (box[2] - box[0], box[3] - box[1]),
+            resample,
+            box=source_box,
+        )
+
+    def invalidate(self, box):
+        """元画像の box の範囲が変わったので、各段の該当範囲だけを作り直す"""
+        left, top, right, bottom = box
+        for k in range(1, len(self.levels)):
+            upper = self.levels[k - 1]
+            # 2x2 のブロック単位になるよう範囲を広げる
+            left -= left % 2
+            top -= top % 2
+            right = min(right + right % 2, upper.width)
+            bottom = min(bottom + bottom % 2, upper.height)
+            region = upper.crop((left, top, right, bottom)).reduce(2)
+            left, top = left // 2, top // 2
+            self.levels[k].paste(region, (left, top))
+            right, bottom = left + region.width, top + region.height
+
+
+class Viewport:
+    """キャンバスに表示する範囲
+
+    zoom は元画像の1画素を何画素で表示するか、(left, top) はキャンバスの左上に
+    対応する、拡大・縮小した画像上の座標。fit が真の間はウィンドウに合わせて
+    画像全体を表示する（拡大はしない）。
+    """
+
+    def __init__(self):
+        self.zoom = 1.0
+        self.left = 0
+        self.top = 0
+        self.fit = True
+        self.image_size = (1, 1)
+        self.canvas_size = (1, 1)
+
+    def update(self, image_size, canvas_size):
+        """画像とキャンバスの大きさに合わせて拡大率と位置を調整"""
+        self.image_size = tuple(image_size)
+        self.canvas_size = tuple(canvas_size)
+        if self.fit:
+            self.zoom = self.fit_zoom()
+        else:
+            self.zoom = min(max(self.zoom, self.fit_zoom()), MAX_ZOOM)
+        self.clamp()
+
+    def fit_zoom(self):
+        """画像全体がキャンバスに収まる拡大率（1.0 を超えない）"""
+        return min(
+            self.canvas_size[0] / self.image_size[0],
+            self.canvas_size[1] / self.image_size[1],
+            1.0,
+        )
+
+    def scaled_size(self):
+        """拡大・縮小した画像の大きさ"""
+        return (
+            max(int(self.image_size[0] * self.zoom), 1),
+            max(int(self.image_size[1] * self.zoom), 1),
+        )
+
+    def clamp(self):
+        """キャンバスより小さい向きは中央に置き、大きい向きは画像の外が見えないようにする"""
+        scaled_width, scaled_height = self.scaled_size()
+        canvas_width, canvas_height = self.canvas_size
+        if scaled_width <= canvas_width:
+            self.left = -((canvas_width - scaled_width) // 2)
+        else:
+            self.left = min(max(self.left, 0), scaled_width - canvas_width)
+        if scaled_height <= canvas_height:
+            self.top = -((canvas_height - scaled_height) // 2)
+        else:
+            self.top = min(max(self.top, 0), scaled_height - canvas_height)
+
+    def visible_box(self):
+        """拡大・縮小した画像のうち、キャンバスに見えている範囲"""
+        scaled_width, scaled_height = self.scaled_size()
+        return (
+            max(self.left, 0),
+            max(self.top, 0),
+            min(self.left + self.canvas_size[0], scaled_width),
+            min(self.top + self.canvas_size[1], scaled_height),
+        )
+
+    def zoom_at(self, factor, x, y):
+        """キャンバスの (x, y) の位置が動かないように拡大率を factor 倍にする"""
+        image_x, image_y = self.to_image(x, y)
+        self.zoom = min(max(self.zoom * factor, self.fit_zoom()), MAX_ZOOM)
+        self.fit = False
+        self.left = round(image_x * self.zoom - x)
+        self.top = round(image_y * self.zoom - y)
+        self.clamp()
+
+    def set_zoom(self, zoom):
+        """キャンバスの中央を基準に拡大率を zoom にする"""
+        self.zoom_at(zoom / self.zoom, self.canvas_size[0] / 2, self.canvas_size[1] / 2)
+
+    def fit_to_window(self):
+        """ウィンドウに合わせて全体を表示する状態に戻す"""
+        self.fit = True
+        self.zoom = self.fit_zoom()
+        self.clamp()
+
+    def pan(self, dx, dy):
+        """表示範囲をキャンバス上で (dx, dy) だけ動かす"""
+        self.left -= dx
+        self.top -= dy
+        self.clamp()
+
+    def to_image(self, x, y):
+        """キャンバスの座標を元画像の座標に変換"""
+        # 表示画像の各画素は、その中心に対応する元画像の画素を表す
+        scaled_width, scaled_height = self.scaled_size()
+        return (
+            (x + self.left + 0.5) * self.image_size[0] / scaled_width,
+            (y + self.top + 0.5) * self.image_size[1] / scaled_height,
+        )
+
+    def to_canvas(self, x, y):
+        """元画像の座標をキャンバスの座標に変換"""
+        # 拡大時は画素の中心に合わせる
+        if self.zoom > 1:
+            x, y = x + 0.5, y + 0.5
+        scaled_width, scaled_height = self.scaled_size()
+        return (
+            int(x * scaled_width / self.image_size[0]) - self.left,
+            int(y * scaled_height / self.image_size[1]) - self.top,
+        )
+
+
+class TileCache:
+    """拡大・縮小した画像をタイルに分けて作成し、最近使ったものを保持するキャッシュ
+
+    表示されている範囲のタイルだけを作成し、保持する枚数は表示範囲の
+    タイル数の screens 倍までとする。このため作成の手間とメモリは
+    元画像ではなくウィンドウの大きさに比例する。
+    """
+
+    def __init__(self, tile_size=TILE_SIZE, screens=3):
+        self.tile_size = tile_size
+        self.screens = screens
+        self.pyramid = None
+        self.capacity = 0
+        self._tiles = OrderedDict()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def compose(self, pyramid, zoom, scaled_size, box):
+        """拡大・縮小した画像の box の範囲を、タイルを並べて作成"""
+        if pyramid is not self.pyramid:
+            self.clear()
+            self.pyramid = pyramid
+
+        size = self.tile_size
+        columns = range(box[0] // size, (box[2] - 1) // size + 1)
+        rows = range(box[1] // size, (box[3] - 1) // size + 1)
+        output = Image.new(pyramid.source.mode, (box[2] - box[0], box[3] - box[1]))
+        for ty in rows:
+            for tx in columns:
+                tile = self.tile(zoom, scaled_size, tx, ty)
+                output.paste(tile, (tx * size - box[0], ty * size - box[1]))
+
+        # 表示範囲のタイル数の screens 倍を超えた分は古いものから破棄
+        self.capacity = max(self.capacity, self.screens * len(rows) * len(columns))
+        while len(self._tiles) > self.capacity:
+            self._tiles.popitem(last=False)
+        return output
+
+    def tile(self, zoom, scaled_size, tx, ty):
+        """(tx, ty) 番目のタイルを返す（なければ作成）"""
+        key = (zoom, tx, ty)
+        tile = self._tiles.get(key)
+        if tile is not None:
+            self._tiles.move_to_end(key)
+            return tile
+
+        size = self.tile_size
+        box = (
+            tx * size,
+            ty * size,
+            min((tx + 1) * size, scaled_size[0]),
+            min((ty + 1) * size, scaled_size[1]),
+        )
+        # 拡大時は画素の境界がわかるよう、補間せずに拡大する
+        if zoom > 1:
+            resample = Image.Resampling.NEAREST
+        else:
+            resample = Image.Resampling.LANCZOS
+        tile = self.pyramid.render_region(scaled_size, box, resample)
+        self._tiles[key] = tile
+        return tile
+
+    def invalidate(self, box, margin=3):
+        """元画像の box の範囲を含むタイルを破棄
+
+        縮小時のフィルタが参照する周囲の画素（表示上で margin 画素）も含める。
+        """
+        size = self.tile_size
+        for key in list(self._tiles):
+            zoom, tx, ty = key
+            if (
+                box[0] * zoom - margin < (tx + 1) * size
+                and box[2] * zoom + margin > tx * size
+                and box[1] * zoom - margin < (ty + 1) * size
+                and box[3] * zoom + margin > ty * size
+            ):
+                del self._tiles[key]
+
+    def clear(self):
+        self._tiles.clear()
+        self.pyramid = None
+        self.capacity = 0
+
+
+class RenderScheduler:
+    """再描画の要求をまとめて1回の描画にするスケジューラ
+
+    描画は実行時点の最新の状態を使うため、まだ実行されていない要求は
+    1つにまとめ、古い状態を描画する無駄を省く。
+    また、描画の間隔を min_interval ミリ秒以上あけてメインループを空ける。
+    """
+
+    def __init__(self, root, render, min_interval=16):
+        self.root = root
+        self.render = render
+        self.min_interval = min_interval
+        self._after_id = None
+        self._due = 0.0  # 予定している描画の時刻
+        self._last = 0.0  # 最後に描画した時刻
+
+    def request(self, delay=0):
+        """delay ミリ秒後以降の再描画を要求"""
+        now = time.perf_counter()
+        wait = max(delay, self.min_interval - (now - self._last) * 1000)
+        due = now + wait / 1000
+
+        if self._after_id is not None:
+            # すでに予定している描画の方が早ければ、それにまとめる
+            if self._due <= due:
+                return
+            self.root.after_cancel(self._after_id)
+
+        self._due = due
+        self._after_id = self.root.after(max(int(wait), 0), self._run)
+
+    def flush(self):
+        """予定している描画があればすぐに実行"""
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._run()
+
+    def _run(self):
+        self._after_id = None
+        self._last = time.perf_counter()
+        self.render()
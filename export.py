@@ -0,0 +1,203 @@
+"""複数の形式への書き出し
+
+編集した画像を、書き出しプロファイルに指定した複数の形式（可逆圧縮の HEIC、
+品質 85 の JPEG、縮小した Web 用の PNG など）にまとめて書き出す。
+画像の画素は一時ファイルに1回だけ書き出し、各形式へのエンコードは
+ワーカープロセスがその一時ファイルをマップして並列に行う。
+
+プロファイルは次の形式の JSON（targets の各項目が1つの書き出し先）:
+
+    {"targets": [
+        {"name": "full", "format": "heic", "quality": -1, "suffix": ""},
+        {"name": "jpeg", "format": "jpg", "quality": 85, "suffix": "_q85"},
+        {"name": "web", "format": "png", "max_size": 2048, "suffix": "_web",
+         "strip_metadata": true}
+    ]}
+
+format は jpg・png・heic、quality は JPEG/HEIC の品質（HEIC の -1 は可逆圧縮。
+HEIC で省略すると libheif の既定の 50 になる）、max_size は長辺の最大の画素数、
+strip_metadata は EXIF を書き出さないかどうか（既定は true）。
+"""
+
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from outofcore import is_mapped
+from saver import convert_for_format, save_atomic
+
+# 書き出し形式と拡張子
+FORMATS = {"jpg": ("JPEG", ".jpg"), "png": ("PNG", ".png"), "heic": ("HEIF", ".heic")}
+
+# プロファイルがない場合の書き出し先
+DEFAULT_TARGETS = [
+    {"name": "full", "format": "heic", "quality": -1, "suffix": ""},
+    {"name": "jpeg", "format": "jpg", "quality": 85, "suffix": "_q85"},
+    {"name": "web", "format": "png", "max_size": 2048, "suffix": "_web"},
+]
+
+
+def default_profile_path():
+    """ユーザーの設定フォルダにある書き出しプロファイルのパス"""
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME", os.path.expanduser("~/.config"))
+    return os.path.join(base, "PythonPhotoEditor", "export.json")
+
+
+def load_targets(path=None):
+    """プロファイルの書き出し先の一覧を返す（ファイルがなければ既定の一覧）"""
+    path = path or default_profile_path()
+    if not os.path.exists(path):
+        return DEFAULT_TARGETS
+    with open(path, encoding="utf-8") as f:
+        targets = json.load(f)["targets"]
+    for target in targets:
+        if target.get("format") not in FORMATS:
+            raise ValueError(f"未知の書き出し形式です: {target.get('format')}")
+    return targets
+
+
+def target_path(base_path, target):
+    """書き出し先のファイルのパス（base_path の拡張子は無視する）"""
+    stem = os.path.splitext(base_path)[0]
+    return stem + target.get("suffix", "") + FORMATS[target["format"]][1]
+
+
+def existing_targets(base_path, targets):
+    """書き出すと上書きされる、すでにあるファイルのパスの一覧"""
+    paths = [target_path(base_path, target) for target in targets]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def save_params(target, exif=None):
+    """書き出し先の設定から保存時のパラメータを作成"""
+    format = FORMATS[target["format"]][0]
+    params = {}
+    if format == "PNG":
+        params["compress_level"] = target.get("compress_level", 6)
+    elif "quality" in target:
+        params["quality"] = target["quality"]
+    if exif and not target.get("strip_metadata", True):
+        params["exif"] = exif
+    return params
+
+
+def encode_target(image, target, output_path, exif=None):
+    """1つの書き出し先に縮小・変換して保存し、結果の記録を返す"""
+    start = time.perf_counter()
+    max_size = target.get("max_size")
+    if max_size and max(image.size) > max_size:
+        # 縦横比を保って長辺を max_size にする（元の画像は複製しない）
+        scale = max_size / max(image.size)
+        size = (
+            max(round(image.width * scale), 1),
+            max(round(image.height * scale), 1),
+        )
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    format = FORMATS[target["format"]][0]
+    if not is_mapped(image):
+        image = convert_for_format(image, format)
+    save_atomic(image, output_path, format, **save_params(target, exif))
+    return {
+        "name": target.get("name", target["format"]),
+        "path": output_path,
+        "width": image.width,
+        "height": image.height,
+        "bytes": os.path.getsize(output_path),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def encode_from_file(raw_path, mode, size, target, output_path, exif=None):
+    """一時ファイルの画素をマップして書き出す（ワーカープロセスで実行）"""
+    with open(raw_path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as buffer:
+        image = Image.frombuffer(mode, size, buffer, "raw", mode, 0, 1)
+        try:
+            return encode_target(image, target, output_path, exif)
+        finally:
+            # マップを閉じる前に、バッファを参照している画像を解放する
+            del image
+
+
+def export_targets(image, base_path, targets, exif=None, workers=None):
+    """画像をすべての書き出し先に書き出し、書き出し先ごとの記録の一覧を返す
+
+    失敗した書き出し先の記録には "error" が入る。ディスク上の大きな画像は
+    メモリ上に複製しないよう、このプロセスで1つずつ書き出す。
+    """
+    jobs = [(target, target_path(base_path, target)) for target in targets]
+    if is_mapped(image):
+        return [_run(encode_target, image, *job, exif) for job in jobs]
+
+    # 画素を一時ファイルに1回だけ書き出し、各ワーカーはそれをマップして使う
+    # （パレットなどの画像は、画素だけでは復元できないので変換しておく）
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA")
+    # エディタの起動を速くするため、初めて書き出す時に読み込む
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    directory = os.path.dirname(os.path.abspath(base_path))
+    fd, raw_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".raw")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(image.tobytes())
+        # GUI のスレッドから呼ばれても安全なよう、fork ではなく spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        workers = workers or min(len(jobs), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(
+                    _run,
+                    encode_from_file,
+                    raw_path,
+                    image.mode,
+                    image.size,
+                    target,
+                    output_path,
+                    exif,
+                )
+                for target, output_path in jobs
+            ]
+            return [future.result() for future in futures]
+    finally:
+        os.remove(raw_path)
+
+
+def _run(function, *args):
+    """書き出しを実行し、失敗した場合はエラーを記録として返す"""
+    try:
+        return function(*args)
+    except Exception as e:
+        target, output_path = args[-3], args[-2]
+        return {
+            "name": target.get("name", target["format"]),
+            "path": output_path,
+            "error": str(e),
+        }
+
+
+def format_report(records):
+    """書き出し先ごとの時間とサイズを表示する複数行の文字列"""
+    lines = []
+    for record in records:
+        name = f"{record['name']} ({os.path.basename(record['path'])})"
+        if "error" in record:
+            lines.append(f"{name}: エラー {record['error']}")
+        else:
+            lines.append(
+                f"{name}: {record['width']}x{record['height']}, "
+                f"{record['bytes'] / 1024:.0f}KB, {record['seconds']:.2f}秒"
+            )
+    return "\n".join(lines)
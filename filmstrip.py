@@ -0,0 +1,188 @@
+"""フォルダの画像のサムネイルを並べたバー
+
+開いている画像と同じフォルダの画像のサムネイルを横一列に表示し、
+クリックした画像を開く。サムネイルは thumbnails.py の索引から読み込み、
+ない画像や変わった画像の分はバックグラウンドで作成する。
+"""
+
+import io
+import os
+import threading
+import tkinter as tk
+
+from PIL import Image, ImageTk
+
+from thumbnails import THUMBNAIL_SIZE
+
+# サムネイルの周りの余白
+PADDING = 4
+
+# 作成したサムネイルを表示に反映する間隔（ミリ秒）
+POLL_INTERVAL = 100
+
+
+class Filmstrip:
+    """フォルダの画像のサムネイルを並べたバー"""
+
+    def __init__(self, parent, on_select, index_path=None):
+        self.on_select = on_select  # クリックされた画像のパスを受け取る関数
+        self.index_path = index_path
+        self.paths = []
+        self.current = None
+        self.complete = True  # paths がフォルダの画像のすべてか
+        self.photos = {}  # パス -> PhotoImage（キャンバスが参照している間は保持）
+        self.generation = 0  # 読み込み中のフォルダを識別する番号
+
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(
+            self.frame,
+            height=THUMBNAIL_SIZE[1] + PADDING * 2,
+            bg="gray20",
+            highlightthickness=0,
+        )
+        scrollbar = tk.Scrollbar(
+            self.frame, orient=tk.HORIZONTAL, command=self.canvas.xview
+        )
+        self.canvas.configure(xscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.canvas.pack(fill=tk.X)
+
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+
+    def show(self, paths, current, complete=True):
+        """paths のサムネイルを並べ、current を選択状態にする
+
+        paths がフォルダの画像の一部（ドロップした画像など）の場合は complete を
+        False にする（索引からフォルダの他の画像のサムネイルを消さないように）。
+        """
+        if paths != self.paths:
+            self.paths = list(paths)
+            self.complete = complete
+            self.rebuild()
+        self.select(current)
+
+    def slot_x(self, index):
+        """index 番目のサムネイルの左端の位置"""
+        return PADDING + index * (THUMBNAIL_SIZE[0] + PADDING)
+
+    def rebuild(self):
+        """サムネイルの枠を並べ直し、サムネイルの読み込みを始める"""
+        self.generation += 1
+        self.canvas.delete("all")
+        self.photos.clear()
+        width, height = THUMBNAIL_SIZE
+        for i, path in enumerate(self.paths):
+            x = self.slot_x(i)
+            self.canvas.create_rectangle(
+                x, PADDING, x + width, PADDING + height, outline="gray40"
+            )
+            self.canvas.create_text(
+                x + width // 2,
+                PADDING + height // 2,
+                text=os.path.basename(path),
+                fill="gray70",
+                width=width - 4,
+            )
+        self.canvas.configure(
+            scrollregion=(0, 0, self.slot_x(len(self.paths)), height + PADDING * 2)
+        )
+        if self.paths:
+            self.load_thumbnails(self.generation, list(self.paths))
+
+    def load_thumbnails(self, generation, paths):
+        """サムネイルをバックグラウンドで読み込み、できたものから表示"""
+        results = []
+        done = []
+        complete = self.complete
+
+        def work():
+            # 索引（SQLite）とプロセスプールは、エディタの起動を速くするため
+            # 初めてサムネイルを表示する時にバックグラウンドのスレッドで読み込む
+            from thumbnails import ThumbnailIndex
+
+            try:
+                with ThumbnailIndex(self.index_path) as index:
+                    if complete:
+                        index.prune(os.path.dirname(paths[0]), paths)
+                    for item in index.update(paths):
+                        # 別のフォルダに移った場合は打ち切る
+                        if generation != self.generation:
+                            break
+                        results.append(item)
+            except Exception as e:
+                print(f"サムネイルの作成に失敗しました: {e}")
+            finally:
+                done.append(True)
+
+        threading.Thread(target=work, daemon=True).start()
+        self.canvas.after(
+            POLL_INTERVAL, self.poll_thumbnails, generation, results, done
+        )
+
+    def poll_thumbnails(self, generation, results, done):
+        """読み込んだサムネイルを表示に反映"""
+        if generation != self.generation:
+            return
+        while results:
+            path, data = results.pop(0)
+            self.place_thumbnail(path, data)
+        if not done:
+            self.canvas.after(
+                POLL_INTERVAL, self.poll_thumbnails, generation, results, done
+            )
+
+    def place_thumbnail(self, path, data):
+        index = self.paths.index(path)
+        photo = ImageTk.PhotoImage(Image.open(io.BytesIO(data)))
+        self.photos[path] = photo
+        width, height = THUMBNAIL_SIZE
+        self.canvas.create_image(
+            self.slot_x(index) + width // 2,
+            PADDING + height // 2,
+            image=photo,
+        )
+        self.canvas.tag_raise("selection")
+
+    def select(self, path):
+        """path を枠で囲み、見える位置までスクロール"""
+        self.current = path
+        self.canvas.delete("selection")
+        if path not in self.paths:
+            return
+        index = self.paths.index(path)
+        x = self.slot_x(index)
+        width, height = THUMBNAIL_SIZE
+        self.canvas.create_rectangle(
+            x - 2,
+            PADDING - 2,
+            x + width + 2,
+            PADDING + height + 2,
+            outline="orange",
+            width=3,
+            tags="selection",
+        )
+
+        # 選択した画像が中央に来るようにスクロール
+        total = self.slot_x(len(self.paths))
+        visible = self.canvas.winfo_width()
+        if total > visible > 1:
+            left = x + width / 2 - visible / 2
+            self.canvas.xview_moveto(max(left, 0) / total)
+
+    def on_click(self, event):
+        x = self.canvas.canvasx(event.x)
+        index = int((x - PADDING) // (THUMBNAIL_SIZE[0] + PADDING))
+        if 0 <= index < len(self.paths) and self.paths[index] != self.current:
+            self.on_select(self.paths[index])
+
+    def on_mouse_wheel(self, event):
+        # Linux では Button-4/5、それ以外では delta の符号で向きが分かる
+        step = -1 if event.num == 4 or event.delta > 0 else 1
+        self.canvas.xview_scroll(step, "units")
+
+    def close(self):
+        """バックグラウンドの読み込みを打ち切る"""
+        self.generation += 1
@@ -1,11 +1,85 @@
-import tkinter as tk
-from tkinter import filedialog, colorchooser, messagebox, simpledialog, Scale
-from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image, ImageTk, ImageDraw, ImageEnhance
-import pillow_heif
-
-# HEICサポートの初期化
-pillow_heif.register_heif_opener()
+import time
+
+# 起動時間の内訳の基準。ほかのモジュールの読み込み時間も内訳に含めるため、
+# それらを読み込む前に記録する（そのため以降の import には noqa: E402 を付ける）
+STARTED_AT = time.perf_counter()
+
+import argparse  # noqa: E402
+import os  # noqa: E402
+import sys  # noqa: E402
+import threading  # noqa: E402
+import tkinter as tk  # noqa: E402
+from tkinter import (  # noqa: E402
+    filedialog,
+    colorchooser,
+    messagebox,
+    simpledialog,
+    Scale,
+    ttk,
+)
+from tkinterdnd2 import TkinterDnD, DND_FILES  # noqa: E402
+from PIL import Image, ImageTk  # noqa: E402
+
+from display import ImagePyramid, RenderScheduler, TileCache, Viewport  # noqa: E402
+from export import (  # noqa: E402
+    existing_targets,
+    export_targets,
+    format_report,
+    load_targets,
+)
+from filmstrip import Filmstrip  # noqa: E402
+from history import (  # noqa: E402
+    DEFAULT_MEMORY_BUDGET,
+    History,
+    format_bytes,
+    image_nbytes,
+)
+from journal import Journal, find_sessions, read_journal  # noqa: E402
+from loader import (  # noqa: E402
+    DecodedCache,
+    folder_images,
+    image_paths,
+    neighbours,
+    open_preview,
+)
+from operations import (  # noqa: E402
+    apply_operations,
+    crop_image,
+    fill_operation,
+    fill_polygons,
+    operation_polygons,
+    polygons_bbox,
+)
+from outofcore import (  # noqa: E402
+    DEFAULT_MAX_PIXELS,
+    MappedKeyframes,
+    copy_image,
+    is_mapped,
+)
+from pipeline import DEFAULT_CACHE_BYTES, PrefixCache, prefix_keys, render  # noqa: E402
+from profiler import Profiler, format_spans, format_summary, profiled  # noqa: E402
+from saver import save_atomic  # noqa: E402
+
+# モジュールの読み込みが終わった時刻（HEIC と NumPy は初めて使う時に読み込む）
+IMPORTED_AT = time.perf_counter()
+
+# 航空写真のような大きな画像も開けるよう、Pillow の画素数の上限を外す
+Image.MAX_IMAGE_PIXELS = None
+
+# スライダーが止まってから元の解像度で鮮やかさを計算するまでの待ち時間（ミリ秒）
+SATURATION_REFINE_DELAY = 300
+
+# マウスホイールや拡大/縮小のメニューで1回に変える拡大率の倍率
+ZOOM_STEP = 1.25
+
+# 同じフォルダで先読みする前後の画像の枚数
+PREFETCH_RADIUS = 1
+
+# ドロップした画像を順に編集する時に、先読みする次の画像の枚数
+DROP_PREFETCH = 4
+
+# 処理時間の表示を更新する間隔（ミリ秒）
+TIMING_OVERLAY_INTERVAL = 500
 
 
 class ImageEditor:
@@ -13,13 +87,41 @@ class ImageEditor:
         self.root = root
         self.root.title("PythonPhotoEditor")
         self.unsaved_changes = False
-        self.history = []
-        self.history_index = -1
+        self.history = None  # 編集履歴（差分ベース）
+        self.history_memory_budget = DEFAULT_MEMORY_BUDGET  # 履歴のメモリ上限
+        self.journal = Journal()  # 異常終了から復旧するための編集の記録
+        self.max_pixels = DEFAULT_MAX_PIXELS  # これを超える画素数の画像はディスク上で扱う
+        # デコードした画像のキャッシュ（同じフォルダの前後の画像を先読みする）
+        self.decoded_cache = DecodedCache(max_pixels=self.max_pixels)
+        self.file_path = None  # 開いている画像のパス
+        self.folder_paths = []  # 開いている画像と同じフォルダの画像のパス
+        self.drop_paths = []  # まとめてドロップした画像のパス（順に編集する）
         self.fill_color = "white"  # デフォルトの塗りつぶし色
-        self.scale_ratio = 1.0  # 初期値を設定
+        self.viewport = Viewport()  # キャンバスに表示する範囲（拡大率と位置）
+        self.pan_anchor = None  # 表示範囲をドラッグで移動中の直前のマウス位置
         self.image_loaded = False  # 画像が読み込まれたかどうかのフラグ
         self.saturation_value = 1.0  # 彩度の初期値（1.0で元の画像の彩度）
         self.canvas_image_id = None  # キャンバス上の画像ID
+        self.profiler = Profiler(epoch=STARTED_AT)  # 主な処理の処理時間の記録
+        self.timing_overlay = tk.BooleanVar(value=False)  # 処理時間を表示するか
+        self.timing_overlay_id = None  # キャンバス上の処理時間の表示のID
+        self.timing_overlay_after_id = None
+        self.show_filmstrip = tk.BooleanVar(value=True)  # サムネイルを表示するか
+
+        # 鮮やかさのプレビュー関連の変数
+        self.saturation_pending = False  # 元の解像度への適用が保留中か
+        self.saturation_proxy = None  # (表示範囲, 表示範囲の編集中の画像)
+        self.base_pyramid = None  # 鮮やかさのプレビュー用の、編集中の画像のピラミッド
+        self.proxy_tiles = TileCache()  # 鮮やかさのプレビュー用のタイル
+        self.refine_generation = 0  # 保留中の計算を識別する番号
+        self.refine_after_id = None
+
+        # 読み込み関連の変数
+        self.loading = False  # 元の解像度の画像をデコード中か
+        self.load_generation = 0  # 読み込み中の画像を識別する番号
+        self.preview = None  # 読み込み中に表示する (縮小画像, 元のサイズ)
+        self.pending_actions = []  # 読み込み完了まで保留している操作
+        self.save_threads = []  # バックグラウンドで保存中のスレッド
 
         # トリミング関連の変数
         self.trimming_mode = False
@@ -37,9 +139,17 @@ class ImageEditor:
         # ファイルメニュー
         filemenu = tk.Menu(menubar, tearoff=0)
         filemenu.add_command(label="開く", command=self.open_image)
+        filemenu.add_command(
+            label="次の画像", command=self.show_next_image, accelerator="PageDown"
+        )
+        filemenu.add_command(
+            label="前の画像", command=self.show_previous_image, accelerator="PageUp"
+        )
         filemenu.add_command(
             label="保存", command=self.save_image, accelerator="Ctrl+S"
         )
+        filemenu.add_command(label="書き出し...", command=self.export_image)
+        filemenu.add_command(label="トレースを保存...", command=self.save_trace)
         filemenu.add_separator()
         filemenu.add_command(label="終了", command=self.on_closing)
         menubar.add_cascade(label="ファイル", menu=filemenu)
@@ -52,6 +162,29 @@ class ImageEditor:
         )
         menubar.add_cascade(label="編集", menu=editmenu)
 
+        # 表示メニュー
+        viewmenu = tk.Menu(menubar, tearoff=0)
+        viewmenu.add_command(label="拡大", command=self.zoom_in, accelerator="Ctrl++")
+        viewmenu.add_command(label="縮小", command=self.zoom_out, accelerator="Ctrl+-")
+        viewmenu.add_command(
+            label="ウィンドウに合わせる", command=self.fit_view, accelerator="Ctrl+0"
+        )
+        viewmenu.add_command(
+            label="実際のサイズ", command=self.actual_size_view, accelerator="Ctrl+1"
+        )
+        viewmenu.add_separator()
+        viewmenu.add_checkbutton(
+            label="サムネイルを表示",
+            variable=self.show_filmstrip,
+            command=self.toggle_filmstrip,
+        )
+        viewmenu.add_checkbutton(
+            label="処理時間を表示",
+            variable=self.timing_overlay,
+            command=self.toggle_timing_overlay,
+        )
+        menubar.add_cascade(label="表示", menu=viewmenu)
+
         # ヘルプメニュー
         helpmenu = tk.Menu(menubar, tearoff=0)
         helpmenu.add_command(label="バージョン情報", command=self.show_copyright)
@@ -63,6 +196,13 @@ class ImageEditor:
         root.bind_all("<Control-s>", lambda event: self.save_image())
         root.bind_all("<Control-z>", lambda event: self.undo())
         root.bind_all("<Control-Shift-Z>", lambda event: self.redo())
+        root.bind_all("<Control-plus>", lambda event: self.zoom_in())
+        root.bind_all("<Control-equal>", lambda event: self.zoom_in())
+        root.bind_all("<Control-minus>", lambda event: self.zoom_out())
+        root.bind_all("<Control-0>", lambda event: self.fit_view())
+        root.bind_all("<Control-1>", lambda event: self.actual_size_view())
+        root.bind_all("<Next>", lambda event: self.show_next_image())
+        root.bind_all("<Prior>", lambda event: self.show_previous_image())
 
         # ツールバーの作成
         toolbar = tk.Frame(root, bd=1, relief=tk.RAISED)
@@ -86,10 +226,28 @@ class ImageEditor:
         )
         self.trim_button.pack(side=tk.LEFT, padx=2, pady=2)
 
+        # 塗りつぶし待ちの多角形をまとめて塗りつぶすボタン
+        self.fill_button = tk.Button(
+            toolbar, text="まとめて塗りつぶし", command=self.commit_fills
+        )
+        self.fill_button.pack(side=tk.LEFT, padx=2, pady=2)
+
         # 現在のモード表示ラベル
         self.mode_label = tk.Label(toolbar, text="現在のモード: 通常", bg="white")
         self.mode_label.pack(side=tk.LEFT, padx=10, pady=2)
 
+        # 履歴のメモリ使用量表示ラベル
+        self.history_label = tk.Label(toolbar, text="", bg="white")
+        self.history_label.pack(side=tk.LEFT, padx=10, pady=2)
+
+        # 表示の拡大率のラベル
+        self.zoom_label = tk.Label(toolbar, text="表示: 100%", bg="white")
+        self.zoom_label.pack(side=tk.LEFT, padx=10, pady=2)
+
+        # 保存中の表示（保存中のみ表示する）
+        self.save_label = tk.Label(toolbar, text="保存中...", bg="white")
+        self.save_progress = ttk.Progressbar(toolbar, mode="indeterminate", length=80)
+
         # 鮮やかさ（彩度）スライダーの追加
         self.saturation_frame = tk.Frame(toolbar)
         self.saturation_frame.pack(side=tk.RIGHT, padx=10)
@@ -109,6 +267,10 @@ class ImageEditor:
         self.saturation_slider.set(1.0)  # デフォルト値を設定
         self.saturation_slider.pack(side=tk.LEFT)
 
+        # 同じフォルダの画像のサムネイル（キャンバスより先に下端に配置）
+        self.filmstrip = Filmstrip(root, self.open_folder_image)
+        self.filmstrip.frame.pack(side=tk.BOTTOM, fill=tk.X)
+
         # キャンバスフレームの作成（スクロールバー用）
         self.canvas_frame = tk.Frame(root)
         self.canvas_frame.pack(fill=tk.BOTH, expand=True)
@@ -117,19 +279,42 @@ class ImageEditor:
         self.canvas = tk.Canvas(self.canvas_frame, bg="white")
         self.canvas.pack(fill=tk.BOTH, expand=True)
 
+        # 再描画の要求をまとめるスケジューラ
+        self.render_scheduler = RenderScheduler(root, self.update_display_image)
+
         # 画像関連の変数
         self.image = None
         self.tk_image = None
-        self.draw = None
         self.original_image = None
         self.display_image = None
+        self.pyramid = None  # 表示用の縮小画像のピラミッド
+        self.tiles = TileCache()  # 表示されている範囲のタイル
+        self.display_view = None  # 表示画像の (拡大率, 表示範囲)
+        self.dirty_boxes = None  # 次の描画で更新する範囲（None は全体）
+        # 調整操作の途中結果のキャッシュ（元に戻す/やり直すで同じ状態に戻った時に使う）
+        self.render_cache = PrefixCache(max_bytes=DEFAULT_CACHE_BYTES, max_entries=16)
 
         # マウスイベントのバインド
         self.points = []  # 元画像における座標
         self.display_points = []  # 表示用の座標
-        self.dots = []
+        self.dots = []  # 各ポイントの点（キャンバス上のID）
+        self.lines = []  # ポイント間のライン（キャンバス上のID）
+        self.fill_queue = []  # 塗りつぶし待ちの (元画像における頂点の一覧, 色)
+        self.fill_queue_items = []  # 塗りつぶし待ちの多角形（キャンバス上のID）
         self.canvas.bind("<Button-1>", self.add_point)
         self.canvas.bind("<Button-3>", self.fill_area)
+        self.canvas.bind("<Shift-Button-3>", self.stage_fill)
+        # 入力欄やダイアログの Enter/Esc では動かないよう、メインのウィンドウだけにバインド
+        root.bind("<Return>", lambda event: self.commit_fills())
+        root.bind("<Escape>", lambda event: self.clear_fill_queue())
+        self.update_fill_button()
+
+        # 拡大/縮小（マウスホイール）と表示範囲の移動（中ボタンのドラッグ）
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+        self.canvas.bind("<ButtonPress-2>", self.start_pan)
+        self.canvas.bind("<B2-Motion>", self.pan_view)
 
         # ウィンドウリサイズイベントのバインド
         self.root.bind("<Configure>", self.on_window_resize)
@@ -153,6 +338,7 @@ class ImageEditor:
             # トリミングモード中は通常の点追加機能を無効化
             self.canvas.unbind("<Button-1>")
             self.canvas.unbind("<Button-3>")
+            self.canvas.unbind("<Shift-Button-3>")
 
             # トリミング用のマウスイベントをバインド
             self.canvas.bind("<ButtonPress-1>", self.start_trim_selection)
@@ -169,6 +355,7 @@ class ImageEditor:
             # 通常の点追加機能を復活
             self.canvas.bind("<Button-1>", self.add_point)
             self.canvas.bind("<Button-3>", self.fill_area)
+            self.canvas.bind("<Shift-Button-3>", self.stage_fill)
 
             # 選択範囲があれば実際にトリミングを実行
             if self.trim_start and self.trim_end:
@@ -179,6 +366,9 @@ class ImageEditor:
 
     def start_trim_selection(self, event):
         """トリミング選択の開始"""
+        if self.defer_while_loading(self.start_trim_selection, event):
+            return
+
         # 画像が読み込まれていない場合は何もしない
         if not self.image_loaded or not self.image:
             messagebox.showinfo("注意", "先に画像を開いてください。")
@@ -206,6 +396,9 @@ class ImageEditor:
 
     def update_trim_selection(self, event):
         """トリミング選択範囲の更新"""
+        if self.defer_while_loading(self.update_trim_selection, event):
+            return
+
         if not self.trim_start or not self.trim_rectangle:
             return
 
@@ -220,21 +413,17 @@ class ImageEditor:
         self.trim_end = (orig_x, orig_y)
 
         # キャンバス上の表示座標を計算
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        x_offset = (canvas_width - self.display_image.width) // 2
-        y_offset = (canvas_height - self.display_image.height) // 2
-
-        start_x = int(self.trim_start[0] * self.scale_ratio) + x_offset
-        start_y = int(self.trim_start[1] * self.scale_ratio) + y_offset
-        end_x = int(self.trim_end[0] * self.scale_ratio) + x_offset
-        end_y = int(self.trim_end[1] * self.scale_ratio) + y_offset
+        start_x, start_y = self.to_display_coords(*self.trim_start)
+        end_x, end_y = self.to_display_coords(*self.trim_end)
 
         # 矩形を更新
         self.canvas.coords(self.trim_rectangle, start_x, start_y, end_x, end_y)
 
     def end_trim_selection(self, event):
         """トリミング選択の終了"""
+        if self.defer_while_loading(self.end_trim_selection, event):
+            return
+
         # 表示座標を元画像座標に変換
         orig_x, orig_y = self.to_original_coords(event.x, event.y)
 
@@ -270,49 +459,41 @@ class ImageEditor:
         if not self.trim_start or not self.trim_end:
             return
 
+        # 塗りつぶし待ちの多角形は、トリミングの前の座標で塗りつぶしておく
+        self.commit_fills()
+
         # 座標を左上、右下の順に整理
         left = min(self.trim_start[0], self.trim_end[0])
         top = min(self.trim_start[1], self.trim_end[1])
         right = max(self.trim_start[0], self.trim_end[0])
         bottom = max(self.trim_start[1], self.trim_end[1])
 
-        # 現在の画像の状態を履歴に保存
-        self.history = self.history[: self.history_index + 1]
-        self.history.append(self.image.copy())
-        self.history_index += 1
-
-        # トリミング前の画像のサイズ
-        original_width, original_height = self.image.size
-
         try:
-            # 画像をトリミング
-            trimmed_image = self.image.crop((left, top, right, bottom))
-
-            # トリミング後の画像を現在の画像にセット
-            self.image = trimmed_image
-            self.draw = ImageDraw.Draw(self.image)
-
-            # トリミング後の状態も履歴に保存
-            self.history.append(self.image.copy())
-            self.history_index += 1
-
-            # ポイントの座標を調整
-            if self.points:
-                adjusted_points = []
-                for point_x, point_y in self.points:
-                    # トリミング範囲内かチェック
-                    if left <= point_x <= right and top <= point_y <= bottom:
-                        # 新しい座標系に変換
-                        new_x = point_x - left
-                        new_y = point_y - top
-                        adjusted_points.append((new_x, new_y))
-
-                # 調整後のポイントを設定
-                self.points = adjusted_points
-
-            # 表示を更新
-            self.update_display_image()
-            self.unsaved_changes = True
+            # 完了のメッセージを閉じるまでの時間は処理時間に含めない
+            with self.profiler.span("execute_trimming"):
+                # 彩度調整前の画像をトリミングし、切り取り範囲を履歴に記録
+                box = (left, top, right, bottom)
+                trimmed_image = crop_image(self.history.current, box)
+                self.history.record_crop(box, trimmed_image)
+                self.journal.operation({"op": "crop", "box": list(box)}, trimmed_image)
+
+                # ポイントの座標を調整
+                if self.points:
+                    adjusted_points = []
+                    for point_x, point_y in self.points:
+                        # トリミング範囲内かチェック
+                        if left <= point_x <= right and top <= point_y <= bottom:
+                            # 新しい座標系に変換
+                            new_x = point_x - left
+                            new_y = point_y - top
+                            adjusted_points.append((new_x, new_y))
+
+                    # 調整後のポイントを設定
+                    self.points = adjusted_points
+
+                # 表示を更新
+                self.refresh_image()
+                self.unsaved_changes = True
 
             messagebox.showinfo(
                 "トリミング完了",
@@ -325,9 +506,13 @@ class ImageEditor:
             )
 
     def handle_drop(self, event):
-        # ドラッグアンドドロップで渡されたファイルパスを処理
-        file_path = event.data.strip("{}")  # Windows用の{}を除去
-        self.load_image(file_path)
+        """ドロップされたファイルを開く（複数の場合は順に編集する待ち行列にする）"""
+        # 複数のパスは空白区切りで、空白を含むパスは {} で囲まれて渡される
+        paths = image_paths(self.root.tk.splitlist(event.data))
+        if not paths:
+            return
+        self.drop_paths = paths if len(paths) > 1 else []
+        self.load_image(paths[0])
 
     def open_image(self):
         file_path = filedialog.askopenfilename(
@@ -342,11 +527,95 @@ class ImageEditor:
         if file_path:
             self.load_image(file_path)
 
-    def load_image(self, file_path):
+    @profiled
+    def load_image(self, file_path, open_as=None):
+        """file_path の画像を開く
+
+        open_as を指定した場合は、file_path の画像を open_as のパスの画像として
+        開く（復旧でチェックポイントの画像を開く時に、フォルダの一覧やサムネイルに
+        ジャーナルのフォルダを使わないように）。
+        """
+        # 読み込み中の画像があれば破棄
+        self.load_generation += 1
+        generation = self.load_generation
+        self.loading = True
+        self.pending_actions = []
+        self.preview = None
+        self.cancel_saturation_refinement()
+        self.root.title(
+            f"PythonPhotoEditor - 読み込み中: {os.path.basename(open_as or file_path)}"
+        )
+
+        # 点とラインと塗りつぶし待ちの多角形をクリア
+        self.clear_points()
+        self.clear_fill_queue()
+
+        # 同じフォルダの画像の一覧（前後の画像への移動と先読みに使う）
+        # まとめてドロップした画像を開いた場合は、ドロップした画像の一覧を使う
+        self.file_path = os.path.abspath(open_as or file_path)
+        if self.file_path in self.drop_paths:
+            self.folder_paths = self.drop_paths
+        else:
+            self.drop_paths = []
+            try:
+                self.folder_paths = folder_images(self.file_path)
+            except OSError:
+                self.folder_paths = []
+        self.filmstrip.show(
+            self.folder_paths, self.file_path, complete=not self.drop_paths
+        )
+
+        # 先読み済みの画像であれば、デコードを待たずにすぐ差し替える
+        cached = self.decoded_cache.get(file_path)
+        if cached is not None:
+            self.poll_image_loading(generation, [(cached, cached.copy())])
+            return
+
+        # まずは縮小デコードしたプレビューを表示
+        canvas_size = (self.canvas.winfo_width(), self.canvas.winfo_height())
+        if canvas_size[0] > 1 and canvas_size[1] > 1:
+            try:
+                with self.profiler.span("open_preview"):
+                    self.preview = open_preview(file_path, canvas_size)
+            except Exception:
+                # プレビューが作れなくても元の解像度での読み込みは続ける
+                self.preview = None
+            if self.preview:
+                self.update_display_image()
+
+        # 元の解像度の画像はバックグラウンドでデコード
+        result = []
+
+        def work():
+            try:
+                with self.profiler.span("decode_image"):
+                    result.append(self.decoded_cache.decode(file_path))
+            except Exception as e:
+                result.append(e)
+
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(50, self.poll_image_loading, generation, result)
+
+    def poll_image_loading(self, generation, result):
+        """バックグラウンドでの読み込みを待ち、完了したら画像を差し替える"""
+        # 別の画像の読み込みが始まっていれば結果を破棄
+        if generation != self.load_generation:
+            return
+        if not result:
+            self.root.after(50, self.poll_image_loading, generation, result)
+            return
+
+        self.loading = False
+        self.preview = None
+        self.root.title(f"PythonPhotoEditor - {self.folder_position()}")
+        pending_actions, self.pending_actions = self.pending_actions, []
+
         try:
+            if isinstance(result[0], Exception):
+                raise result[0]
+
             # 共通の画像読み込み処理
-            self.original_image = Image.open(file_path)
-            self.image = self.original_image.copy()
+            self.original_image, self.image = result[0]
 
             # 画像のロード完了後に表示を更新
             self.image_loaded = True
@@ -354,30 +623,183 @@ class ImageEditor:
             # 鮮やかさスライダーを1.0にリセット
             self.saturation_slider.set(1.0)
             self.saturation_value = 1.0
+            self.saturation_proxy = None
+            self.base_pyramid = None
+            self.render_cache.clear()
 
-            # 履歴を初期化
-            self.history = [self.image.copy()]
-            self.history_index = 0
+            # 新しい画像はウィンドウに合わせて表示
+            self.viewport.fit = True
 
-            # 点とラインをクリア
-            for dot in self.dots:
-                self.canvas.delete(dot)
-            self.points = []
-            self.display_points = []
-            self.dots = []
-
-            # DrawオブジェクトをImageに関連付け
-            self.draw = ImageDraw.Draw(self.image)
+            # 履歴を初期化
+            if self.history is not None:
+                self.history.close()
+            # ディスク上の大きな画像は、キーフレームもディスク上に置く
+            keyframe_store = MappedKeyframes() if is_mapped(self.image) else None
+            self.history = History(
+                self.image,
+                memory_budget=self.history_memory_budget,
+                keyframe_store=keyframe_store,
+            )
+            self.journal.start(self.file_path)
 
             # 画像表示を更新（ウィンドウサイズに合わせて）
-            self.update_display_image()
+            self.request_render()
+            self.update_history_status()
+
+            # 次に開きそうな画像を先読み
+            self.decoded_cache.prefetch(self.upcoming_paths())
 
         except Exception as e:
             print(f"画像の読み込みに失敗しました: {e}")
             messagebox.showerror("エラー", f"画像の読み込みに失敗しました: {e}")
+            return
+
+        # 読み込み中に行われた操作を、元の解像度の画像に対して実行
+        self.render_scheduler.flush()
+        for action, args in pending_actions:
+            action(*args)
+
+    def recover_session(self):
+        """異常終了したエディタのジャーナルがあれば、編集を復旧するか確認"""
+        session = None
+        for journal_path in find_sessions():
+            try:
+                candidate = read_journal(journal_path)
+            except Exception as e:
+                print(f"ジャーナルを読み込めません: {e}")
+                continue
+            # 最も新しい未保存の編集だけを復旧の対象にし、それ以外は削除する
+            if session is None and candidate.dirty:
+                session = candidate
+            else:
+                candidate.discard()
+        if session is None:
+            return
 
+        checkpoint = not session.source_available()
+        if not checkpoint:
+            file_path, start = session.path, 0
+        elif session.checkpoint is not None:
+            # 元の画像が変わっている場合は、チェックポイントの画像から再適用
+            file_path, start = session.checkpoint
+        else:
+            messagebox.showwarning(
+                "復旧",
+                f"{session.path} が見つからないか変更されているため、"
+                "前回の編集を復旧できません。",
+            )
+            session.discard()
+            return
+
+        if not messagebox.askyesno(
+            "復旧",
+            f"前回は正常に終了しませんでした。\n{session.path} の"
+            f"保存していない編集（{len(session.operations)} 件）を復旧しますか？",
+        ):
+            session.discard()
+            return
+        # チェックポイントの画像も、元の画像のパスの画像として開く
+        self.load_image(file_path, open_as=session.path)
+        if not self.defer_while_loading(
+            self.replay_session, session, start, checkpoint
+        ):
+            self.replay_session(session, start, checkpoint)
+
+    @profiled
+    def replay_session(self, session, start, checkpoint=False):
+        """開き直した画像に、ジャーナルの start 件目以降の編集操作を再適用
+
+        checkpoint はチェックポイントの画像を開いたかどうか。
+        """
+        if checkpoint:
+            # 元の画像からは再適用できないので、開いた画像を最初のチェックポイントにする
+            self.journal.start(self.file_path, self.history.current)
+
+        for operation in session.operations[start:]:
+            if operation["op"] == "crop":
+                box = tuple(operation["box"])
+                image = crop_image(self.history.current, box)
+                self.history.record_crop(box, image)
+                self.journal.operation(operation, image)
+            else:
+                base = self.history.current
+                polygons = operation_polygons(operation)
+                box = polygons_bbox(polygons, base.size)
+                before = base.crop(box)
+                fill_polygons(base, polygons)
+                self.history.record_patch(box, before, base.crop(box), operation)
+                self.journal.operation(operation, base)
+        self.saturation_slider.set(session.saturation)
+        self.saturation_value = session.saturation
+        self.refresh_image()
+        self.unsaved_changes = True
+        session.discard()
+
+    def upcoming_paths(self):
+        """次に開きそうな画像のパス（先読みする画像）を、近いものから順に返す"""
+        if self.file_path not in self.drop_paths:
+            return neighbours(self.folder_paths, self.file_path, PREFETCH_RADIUS)
+        # ドロップした画像は先頭から順に編集するので、次の数枚を先読みする
+        index = self.drop_paths.index(self.file_path)
+        return self.drop_paths[index + 1 : index + 1 + DROP_PREFETCH]
+
+    def folder_position(self):
+        """タイトルに表示する、ファイル名とフォルダ内での位置"""
+        name = os.path.basename(self.file_path)
+        if self.file_path in self.folder_paths:
+            index = self.folder_paths.index(self.file_path)
+            return f"{name} ({index + 1}/{len(self.folder_paths)})"
+        return name
+
+    def show_next_image(self):
+        """同じフォルダの次の画像を開く"""
+        self.show_folder_image(1)
+
+    def show_previous_image(self):
+        """同じフォルダの前の画像を開く"""
+        self.show_folder_image(-1)
+
+    def show_folder_image(self, step):
+        """同じフォルダで step だけ離れた画像を開く（端では何もしない）"""
+        if self.file_path not in self.folder_paths:
+            return
+        index = self.folder_paths.index(self.file_path) + step
+        if 0 <= index < len(self.folder_paths):
+            self.open_folder_image(self.folder_paths[index])
+
+    def open_folder_image(self, file_path):
+        """同じフォルダの画像を開く（未保存の変更があれば確認する）"""
+        if self.unsaved_changes and not messagebox.askokcancel(
+            "確認", "変更が保存されていません。保存せずに移動しますか？", icon="warning"
+        ):
+            return
+        self.load_image(file_path)
+
+    def toggle_filmstrip(self):
+        """サムネイルのバーの表示を切り替える"""
+        if self.show_filmstrip.get():
+            self.filmstrip.frame.pack(
+                side=tk.BOTTOM, fill=tk.X, before=self.canvas_frame
+            )
+        else:
+            self.filmstrip.frame.pack_forget()
+
+    def defer_while_loading(self, action, *args):
+        """読み込み中であれば操作を保留して True を返す"""
+        if not self.loading:
+            return False
+        self.pending_actions.append((action, args))
+        return True
+
+    @profiled
     def update_display_image(self):
         """ウィンドウサイズに基づいて表示画像を更新"""
+        # 読み込み中はプレビュー（なければ何も）を表示
+        if self.loading:
+            if self.preview:
+                self.show_preview()
+            return
+
         if not self.image_loaded or self.image is None:
             return
 
@@ -387,96 +809,241 @@ class ImageEditor:
 
         # キャンバスがまだ正しく描画されていない場合は遅延実行
         if canvas_width <= 1 or canvas_height <= 1:
-            self.root.after(100, self.update_display_image)
+            self.request_render(100)
             return
 
-        # 画像がキャンバスに収まるようにスケーリング
-        image_width, image_height = self.image.size
-
-        # 縮小率を計算
-        width_ratio = canvas_width / image_width
-        height_ratio = canvas_height / image_height
-        self.scale_ratio = min(width_ratio, height_ratio)
-
-        if self.scale_ratio >= 1:
-            # 画像が小さい場合は拡大しない
-            self.scale_ratio = 1.0
-            self.display_image = self.image
+        # 表示する範囲を画像とキャンバスの大きさに合わせる
+        viewport = self.viewport
+        viewport.update(self.image.size, (canvas_width, canvas_height))
+        scaled_size = viewport.scaled_size()
+        visible = viewport.visible_box()
+        self.zoom_label.config(text=f"表示: {viewport.zoom * 100:.0f}%")
+
+        # 前回の表示から変わった範囲（表示画像の座標）。None の場合は全体を作り直す
+        dirty = self.take_dirty_box(visible)
+
+        if self.saturation_pending:
+            # 鮮やかさの確定前は縮小画像に適用した結果を表示
+            proxy = self.get_saturation_proxy(visible)
+            with self.profiler.span("adjust_preview"):
+                self.display_image = apply_operations(
+                    proxy, self.adjustment_operations()
+                )
+            dirty = None
         else:
-            # 画像が大きい場合は縮小
-            display_size = (
-                int(image_width * self.scale_ratio),
-                int(image_height * self.scale_ratio),
-            )
-            self.display_image = self.image.resize(
-                display_size, Image.Resampling.LANCZOS
-            )
+            # 表示されている範囲のタイルだけを、ピラミッドの最も近い段から作成
+            # （表示する画像が差し替わった場合は全体を作り直す。変更された範囲だけが
+            # 異なる画像に差し替えた時は、refresh_image がピラミッドを引き継ぐ）
+            if self.pyramid is None or self.pyramid.source is not self.image:
+                self.pyramid = ImagePyramid(self.image)
+                dirty = None
+            if dirty is None:
+                with self.profiler.span("compose_tiles"):
+                    self.display_image = self.tiles.compose(
+                        self.pyramid, viewport.zoom, scaled_size, visible
+                    )
+            else:
+                # 変わった範囲だけを作成して表示画像に貼り付ける
+                box = (
+                    visible[0] + dirty[0],
+                    visible[1] + dirty[1],
+                    visible[0] + dirty[2],
+                    visible[1] + dirty[3],
+                )
+                with self.profiler.span("compose_tiles"):
+                    region = self.tiles.compose(
+                        self.pyramid, viewport.zoom, scaled_size, box
+                    )
+                self.display_image.paste(region, dirty[:2])
 
-        # 表示画像をキャンバスに配置
-        self.tk_image = ImageTk.PhotoImage(self.display_image)
+        self.display_view = (viewport.zoom, visible)
+        self.place_display_image(
+            visible[0] - viewport.left, visible[1] - viewport.top, dirty
+        )
 
-        # 既存の画像を削除
-        if self.canvas_image_id:
-            self.canvas.delete(self.canvas_image_id)
+    def take_dirty_box(self, visible):
+        """記録された更新範囲をまとめて表示画像の座標の矩形で返し、記録を消去
 
-        # 新しい画像を中央に配置
-        x_pos = (canvas_width - self.display_image.width) // 2
-        y_pos = (canvas_height - self.display_image.height) // 2
-        self.canvas_image_id = self.canvas.create_image(
-            x_pos, y_pos, anchor=tk.NW, image=self.tk_image
+        前回と表示範囲が異なる場合など、全体の更新が必要な場合は None を返す。
+        """
+        boxes, self.dirty_boxes = self.dirty_boxes, []
+        if (
+            not boxes
+            or self.display_image is None
+            or self.display_view != (self.viewport.zoom, visible)
+        ):
+            return None
+
+        # 縮小時のフィルタが参照する周囲の画素も含める
+        margin = 3
+        zoom = self.viewport.zoom
+        left = min(box[0] for box in boxes) * zoom - margin - visible[0]
+        top = min(box[1] for box in boxes) * zoom - margin - visible[1]
+        right = max(box[2] for box in boxes) * zoom + margin - visible[0]
+        bottom = max(box[3] for box in boxes) * zoom + margin - visible[1]
+        dirty = (
+            max(int(left), 0),
+            max(int(top), 0),
+            min(int(right) + 1, self.display_image.width),
+            min(int(bottom) + 1, self.display_image.height),
         )
+        # 変わった範囲が表示範囲の外であれば全体を作り直す（タイルはキャッシュから）
+        if dirty[0] >= dirty[2] or dirty[1] >= dirty[3]:
+            return None
+        return dirty
+
+    def show_preview(self):
+        """読み込み中のプレビュー画像を、元の画像と同じ大きさで表示"""
+        preview, (image_width, image_height) = self.preview
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
 
-        # 表示されている点とラインを更新
-        self.update_display_points()
+        scale_ratio = min(canvas_width / image_width, canvas_height / image_height, 1.0)
+        display_size = (int(image_width * scale_ratio), int(image_height * scale_ratio))
+        self.display_image = preview.resize(display_size, Image.Resampling.LANCZOS)
+        self.display_view = None
+        self.place_display_image(
+            (canvas_width - display_size[0]) // 2,
+            (canvas_height - display_size[1]) // 2,
+        )
 
-    def update_display_points(self):
-        """表示ポイントとラインを更新"""
-        # すべての点とラインを削除
-        for dot in self.dots:
-            self.canvas.delete(dot)
-        self.dots = []
+    @profiled
+    def place_display_image(self, x_pos, y_pos, dirty=None):
+        """表示画像をキャンバスの (x_pos, y_pos) の位置に配置
 
-        # キャンバスサイズを取得
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
+        同じ大きさの PhotoImage があればそれを使い回し、dirty を指定した場合は
+        その範囲だけを書き込む。
+        """
 
-        # 画像の位置を計算
-        x_offset = (canvas_width - self.display_image.width) // 2
-        y_offset = (canvas_height - self.display_image.height) // 2
+        if (
+            self.tk_image is not None
+            and self.canvas_image_id
+            and (self.tk_image.width(), self.tk_image.height())
+            == self.display_image.size
+        ):
+            if dirty is None:
+                # 既存の PhotoImage に画像全体を書き込む
+                self.tk_image.paste(self.display_image)
+            else:
+                # 変わった範囲だけを既存の PhotoImage にコピー
+                region = ImageTk.PhotoImage(self.display_image.crop(dirty))
+                self.canvas.tk.call(
+                    str(self.tk_image), "copy", str(region), "-to", *dirty[:2]
+                )
+            self.canvas.coords(self.canvas_image_id, x_pos, y_pos)
+        else:
+            # 表示画像をキャンバスに配置
+            self.tk_image = ImageTk.PhotoImage(self.display_image)
 
-        # 表示座標リストをクリア
-        self.display_points = []
+            # 既存の画像を削除
+            if self.canvas_image_id:
+                self.canvas.delete(self.canvas_image_id)
 
-        # 各ポイントを再描画
-        for i, (orig_x, orig_y) in enumerate(self.points):
-            # 元画像座標を表示座標に変換
-            display_x = int(orig_x * self.scale_ratio) + x_offset
-            display_y = int(orig_y * self.scale_ratio) + y_offset
-            self.display_points.append((display_x, display_y))
-
-            # 点を描画
-            dot = self.canvas.create_oval(
-                display_x - 3,
-                display_y - 3,
-                display_x + 3,
-                display_y + 3,
-                fill="blue",
-                outline="blue",
+            # 新しい画像を中央に配置
+            self.canvas_image_id = self.canvas.create_image(
+                x_pos, y_pos, anchor=tk.NW, image=self.tk_image
             )
-            self.dots.append(dot)
+            # 点やライン、塗りつぶし待ちの多角形などより下に置く
+            self.canvas.tag_lower(self.canvas_image_id)
 
-            # 2点以上あればラインを描画
+        # 表示されている点とラインを更新
+        self.update_display_points()
+
+    def request_render(self, delay=0, box=None):
+        """表示の更新を要求（連続した要求は1回の描画にまとめる）
+
+        box を指定した場合、元画像のその範囲だけが変わったものとして扱う。
+        """
+        if box is None:
+            self.dirty_boxes = None
+        elif self.dirty_boxes is not None:
+            self.dirty_boxes.append(box)
+        self.render_scheduler.request(delay)
+
+    def update_display_points(self):
+        """表示ポイントとラインの位置を更新（キャンバス上の図形は作り直さない）"""
+        # 元画像座標を表示座標に変換
+        self.display_points = [self.to_display_coords(x, y) for x, y in self.points]
+
+        # ポイントの数が減っていれば余分な点とラインを削除
+        while len(self.dots) > len(self.points):
+            self.canvas.delete(self.dots.pop())
+        while len(self.lines) > max(len(self.points) - 1, 0):
+            self.canvas.delete(self.lines.pop())
+
+        # 既存の点とラインは座標だけを更新し、足りない分は新たに描画
+        for i, (display_x, display_y) in enumerate(self.display_points):
+            if i < len(self.dots):
+                self.canvas.coords(
+                    self.dots[i],
+                    display_x - 3,
+                    display_y - 3,
+                    display_x + 3,
+                    display_y + 3,
+                )
+            else:
+                self.draw_point(i)
+                continue
             if i > 0:
                 prev_display_x, prev_display_y = self.display_points[i - 1]
-                line = self.canvas.create_line(
+                self.canvas.coords(
+                    self.lines[i - 1],
                     prev_display_x,
                     prev_display_y,
                     display_x,
                     display_y,
-                    fill="blue",
-                    width=2,
                 )
-                self.dots.append(line)  # 線もdotsリストに追加して管理
+
+        # 塗りつぶし待ちの多角形も表示範囲に合わせて動かす
+        for (points, _), item in zip(self.fill_queue, self.fill_queue_items):
+            self.canvas.coords(item, *self.polygon_display_coords(points))
+
+        # トリミングの選択範囲も表示範囲に合わせて動かす
+        if self.trim_rectangle and self.trim_start and self.trim_end:
+            start_x, start_y = self.to_display_coords(*self.trim_start)
+            end_x, end_y = self.to_display_coords(*self.trim_end)
+            self.canvas.coords(self.trim_rectangle, start_x, start_y, end_x, end_y)
+
+    def draw_point(self, i):
+        """i 番目のポイントの点と、直前のポイントからのラインを描画"""
+        display_x, display_y = self.display_points[i]
+
+        # 点を描画
+        dot = self.canvas.create_oval(
+            display_x - 3,
+            display_y - 3,
+            display_x + 3,
+            display_y + 3,
+            fill="blue",
+            outline="blue",
+        )
+        self.dots.append(dot)
+
+        # 2点以上あればラインを描画
+        if i > 0:
+            prev_display_x, prev_display_y = self.display_points[i - 1]
+            line = self.canvas.create_line(
+                prev_display_x,
+                prev_display_y,
+                display_x,
+                display_y,
+                fill="blue",
+                width=2,
+            )
+            self.lines.append(line)
+
+    def clear_points(self):
+        """すべてのポイントと、その点とラインを削除"""
+        for item in self.dots + self.lines:
+            self.canvas.delete(item)
+        self.points = []
+        self.display_points = []
+        self.dots = []
+        self.lines = []
+
+    def to_display_coords(self, x, y):
+        """元画像の座標を表示座標に変換"""
+        return self.viewport.to_canvas(x, y)
 
     def on_window_resize(self, event):
         """ウィンドウサイズ変更時のハンドラ"""
@@ -493,9 +1060,70 @@ class ImageEditor:
 
                 # リサイズ後に少し遅延させて表示を更新
                 # (tkinterのレイアウト更新が完了するのを待つ)
-                self.root.after(100, self.update_display_image)
+                self.request_render(50)
+
+    def on_mouse_wheel(self, event):
+        """マウスホイールで、カーソルの位置を中心に拡大/縮小"""
+        # Linux では Button-4/5、Windows/macOS では delta の符号で向きがわかる
+        if event.num == 5 or event.delta < 0:
+            self.zoom_view(1 / ZOOM_STEP, event.x, event.y)
+        else:
+            self.zoom_view(ZOOM_STEP, event.x, event.y)
+
+    def zoom_view(self, factor, x=None, y=None):
+        """キャンバスの (x, y) の位置（省略時は中央）を中心に拡大率を factor 倍にする"""
+        if self.loading or not self.image_loaded:
+            return
+        # 保留中の再描画を済ませ、表示範囲を最新のキャンバスの大きさに合わせる
+        self.render_scheduler.flush()
+        if x is None:
+            x = self.canvas.winfo_width() / 2
+            y = self.canvas.winfo_height() / 2
+        self.viewport.zoom_at(factor, x, y)
+        self.request_render()
+
+    def zoom_in(self):
+        self.zoom_view(ZOOM_STEP)
+
+    def zoom_out(self):
+        self.zoom_view(1 / ZOOM_STEP)
+
+    def fit_view(self):
+        """画像全体をウィンドウに合わせて表示"""
+        self.viewport.fit_to_window()
+        self.request_render()
+
+    def actual_size_view(self):
+        """元画像の1画素を画面の1画素で表示"""
+        if self.loading or not self.image_loaded:
+            return
+        self.render_scheduler.flush()
+        self.viewport.set_zoom(1.0)
+        self.request_render()
 
+    def start_pan(self, event):
+        """中ボタンのドラッグによる表示範囲の移動を開始"""
+        self.pan_anchor = (event.x, event.y)
+
+    def pan_view(self, event):
+        """ドラッグした分だけ表示範囲を移動"""
+        if self.pan_anchor is None or self.loading or not self.image_loaded:
+            return
+        dx = event.x - self.pan_anchor[0]
+        dy = event.y - self.pan_anchor[1]
+        self.pan_anchor = (event.x, event.y)
+        self.viewport.pan(dx, dy)
+        self.request_render()
+
+    @profiled
     def update_saturation(self, value):
+        if self.loading:
+            # 読み込みが終わると鮮やかさは 1.0 に戻るので、1.0 への変更は保留しない
+            # （起動時のスライダーの値などで、復旧した鮮やかさを上書きしないように）
+            if float(value) != 1.0:
+                self.defer_while_loading(self.saturation_slider.set, value)
+            return
+
         # 画像が読み込まれていない場合は何もしない
         if not self.image_loaded or not self.original_image:
             return
@@ -503,53 +1131,125 @@ class ImageEditor:
         # 値を浮動小数点に変換
         self.saturation_value = float(value)
 
-        # 現在の履歴状態を基にして彩度を調整
-        current_image = self.history[self.history_index].copy()
-
-        # 彩度エンハンサーを作成して適用
-        enhancer = ImageEnhance.Color(current_image)
-        enhanced_image = enhancer.enhance(self.saturation_value)
+        # まずは表示サイズの縮小画像だけに鮮やかさを適用して表示
+        self.cancel_saturation_refinement()
+        self.saturation_pending = True
+        self.request_render()
 
-        # 表示用の画像を更新
-        self.image = enhanced_image
-        self.draw = ImageDraw.Draw(self.image)  # Drawオブジェクトを再作成
-
-        # 表示を更新
-        self.update_display_image()
+        # スライダーが止まったら元の解像度で計算し直す
+        self.refine_after_id = self.root.after(
+            SATURATION_REFINE_DELAY, self.start_saturation_refinement
+        )
 
         # 変更があったことをマーク
         self.unsaved_changes = True
 
+    def get_saturation_proxy(self, visible):
+        """鮮やかさのプレビューに使う、表示範囲の編集中の画像を返す"""
+        view = (self.viewport.zoom, visible)
+        if self.saturation_proxy is None or self.saturation_proxy[0] != view:
+            if self.base_pyramid is None:
+                self.base_pyramid = ImagePyramid(self.history.current)
+            proxy = self.proxy_tiles.compose(
+                self.base_pyramid,
+                self.viewport.zoom,
+                self.viewport.scaled_size(),
+                visible,
+            )
+            self.saturation_proxy = (view, proxy)
+        return self.saturation_proxy[1]
+
+    def start_saturation_refinement(self):
+        """元の解像度での鮮やかさの計算をバックグラウンドで開始"""
+        self.refine_after_id = None
+        self.journal.saturation(self.saturation_value)
+
+        # 計算済みの結果があればすぐに確定
+        key = self.adjusted_key()
+        if self.saturation_value == 1.0 or self.render_cache.peek(key) is not None:
+            self.commit_saturation()
+            self.request_render()
+            return
+
+        generation = self.refine_generation
+        base = self.history.current
+        operations = self.adjustment_operations()
+        result = []
+
+        def work():
+            with self.profiler.span("adjust_full"):
+                result.append(apply_operations(base, operations))
+
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(50, self.poll_saturation_refinement, generation, key, result)
+
+    def poll_saturation_refinement(self, generation, key, result):
+        """バックグラウンドの計算結果を待ち、完了したら表示を差し替える"""
+        # 新しい操作があった場合は結果を破棄
+        if generation != self.refine_generation:
+            return
+        if not result:
+            self.root.after(
+                50, self.poll_saturation_refinement, generation, key, result
+            )
+            return
+
+        self.image = result[0]
+        self.render_cache.put(key, self.image)
+        self.saturation_pending = False
+        self.request_render()
+
+    def cancel_saturation_refinement(self):
+        """保留中の鮮やかさの計算を取り消す"""
+        self.refine_generation += 1
+        if self.refine_after_id:
+            self.root.after_cancel(self.refine_after_id)
+            self.refine_after_id = None
+        self.saturation_pending = False
+
+    def commit_saturation(self):
+        """保留中の鮮やかさを元の解像度の画像に確定"""
+        if not self.saturation_pending:
+            return
+        self.cancel_saturation_refinement()
+        self.image = self.render_adjusted()
+
+    def adjustment_operations(self):
+        """履歴の画像の後に適用する調整操作の一覧"""
+        return [{"op": "saturation", "value": self.saturation_value}]
+
+    def adjusted_key(self):
+        """現在の状態にすべての調整操作を適用した結果のキャッシュのキー"""
+        return prefix_keys(self.history.state_key(), self.adjustment_operations())[-1]
+
+    def render_adjusted(self):
+        """履歴の現在の状態に調整操作を適用した画像（途中結果はキャッシュする）"""
+        return render(
+            self.render_cache,
+            self.history.state_key(),
+            self.history.current,
+            self.adjustment_operations(),
+        )
+
     def to_original_coords(self, x, y):
         """表示座標を元画像の座標に変換"""
-        # キャンバスサイズを取得
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
+        # 保留中の再描画があれば先に済ませ、最新の表示を基準にする
+        self.render_scheduler.flush()
 
-        # 画像の位置を計算
-        x_offset = (canvas_width - self.display_image.width) // 2
-        y_offset = (canvas_height - self.display_image.height) // 2
-
-        # オフセットを適用して、画像内の相対位置を計算
-        rel_x = x - x_offset
-        rel_y = y - y_offset
+        # 表示範囲を考慮して元画像の座標に変換
+        image_x, image_y = self.viewport.to_image(x, y)
 
         # 画像外のクリックを処理
-        if (
-            rel_x < 0
-            or rel_x >= self.display_image.width
-            or rel_y < 0
-            or rel_y >= self.display_image.height
-        ):
+        image_width, image_height = self.viewport.image_size
+        if not (0 <= image_x < image_width and 0 <= image_y < image_height):
             return None, None
 
-        # スケール比を使って元画像の座標に変換
-        orig_x = int(rel_x / self.scale_ratio)
-        orig_y = int(rel_y / self.scale_ratio)
-
-        return orig_x, orig_y
+        return int(image_x), int(image_y)
 
     def add_point(self, event):
+        if self.defer_while_loading(self.add_point, event):
+            return
+
         # 画像が読み込まれていない場合は何もしない
         if not self.image_loaded or not self.image:
             messagebox.showinfo("注意", "先に画像を開いてください。")
@@ -565,8 +1265,9 @@ class ImageEditor:
         # 元画像上のポイントを追加
         self.points.append((orig_x, orig_y))
 
-        # 表示用のポイントとラインを更新
-        self.update_display_points()
+        # 追加したポイントの点とラインだけを描画
+        self.display_points.append(self.to_display_coords(orig_x, orig_y))
+        self.draw_point(len(self.points) - 1)
 
     def choose_color(self):
         """カラーピッカーで色を選択"""
@@ -576,7 +1277,11 @@ class ImageEditor:
             self.color_button.config(bg=color)
             self.color_label.config(text=f"現在の色: {color}")
 
+    @profiled
     def fill_area(self, event):
+        if self.defer_while_loading(self.fill_area, event):
+            return
+
         # 画像が読み込まれていない場合は何もしない
         if not self.image_loaded or not self.image:
             messagebox.showinfo("注意", "先に画像を開いてください。")
@@ -589,66 +1294,243 @@ class ImageEditor:
         if orig_x is None or orig_y is None:
             return
 
-        if len(self.points) > 2 and self.draw:
-            # 塗りつぶし前の状態を履歴に保存
-            self.history = self.history[: self.history_index + 1]
-            self.history.append(self.image.copy())
-            self.history_index += 1
+        # 選択中の多角形と塗りつぶし待ちの多角形を、まとめて塗りつぶす
+        self.stage_polygon()
+        self.commit_fills()
 
-            # 多角形を塗りつぶす
-            self.draw.polygon(self.points, fill=self.fill_color)
-            self.unsaved_changes = True
+    def stage_fill(self, event):
+        """選択中の多角形を塗りつぶし待ちにする（Shift+右クリック）"""
+        if self.defer_while_loading(self.stage_fill, event):
+            return
+
+        if not self.image_loaded or not self.image:
+            messagebox.showinfo("注意", "先に画像を開いてください。")
+            return
+
+        self.stage_polygon()
 
-            # 塗りつぶし後の状態も履歴に保存
-            self.history.append(self.image.copy())
-            self.history_index += 1
+    def stage_polygon(self):
+        """選択中の多角形を現在の色で塗りつぶし待ちの一覧に加え、半透明で表示"""
+        if len(self.points) < 3:
+            return
+        points = list(self.points)
+        self.fill_queue.append((points, self.fill_color))
+        item = self.canvas.create_polygon(
+            *self.polygon_display_coords(points),
+            fill=self.fill_color,
+            outline=self.fill_color,
+            stipple="gray50",
+        )
+        self.fill_queue_items.append(item)
+        self.clear_points()
+        self.update_fill_button()
 
-            # 編集結果を表示用に更新
-            self.update_display_image()
+    def commit_fills(self):
+        """塗りつぶし待ちの多角形を1回の合成で塗りつぶし、1つの履歴として記録"""
+        if not self.fill_queue or not self.image_loaded:
+            return
+
+        # すべての多角形を囲む矩形（この範囲だけを履歴に保存し、再描画する）
+        base = self.history.current
+        polygons = self.fill_queue
+        box = polygons_bbox(polygons, base.size)
+
+        # 彩度調整前の画像に塗りつぶし、変更範囲を履歴に保存
+        with self.profiler.span("fill_polygons"):
+            before = base.crop(box)
+            fill_polygons(base, polygons)
+            operation = fill_operation(polygons)
+            self.history.record_patch(box, before, base.crop(box), operation)
+        self.journal.operation(operation, base)
+        self.unsaved_changes = True
+        self.clear_fill_queue()
+
+        # 編集結果を表示用に更新
+        self.refresh_image(box)
+
+    def clear_fill_queue(self):
+        """塗りつぶし待ちの多角形をすべて取り消す"""
+        for item in self.fill_queue_items:
+            self.canvas.delete(item)
+        self.fill_queue = []
+        self.fill_queue_items = []
+        self.update_fill_button()
+
+    def update_fill_button(self):
+        """塗りつぶし待ちの件数をボタンに表示"""
+        count = len(self.fill_queue)
+        self.fill_button.config(
+            text=f"まとめて塗りつぶし ({count})",
+            state=tk.NORMAL if count else tk.DISABLED,
+        )
 
-            # ポイントと線をクリア
-            for dot in self.dots:
-                self.canvas.delete(dot)
-            self.points = []
-            self.display_points = []
-            self.dots = []
+    def polygon_display_coords(self, points):
+        """元画像の頂点の一覧を、キャンバスの座標を並べたリストに変換"""
+        coords = []
+        for x, y in points:
+            coords.extend(self.to_display_coords(x, y))
+        return coords
 
+    @profiled
     def undo(self):
-        if not self.image_loaded:
+        if self.defer_while_loading(self.undo):
             return
 
-        if self.history_index > 0:
-            self.history_index -= 1
-            self.image = self.history[self.history_index].copy()
-
-            # 鮮やかさを適用
-            if self.saturation_value != 1.0:
-                enhancer = ImageEnhance.Color(self.image)
-                self.image = enhancer.enhance(self.saturation_value)
+        if not self.image_loaded:
+            return
 
-            self.draw = ImageDraw.Draw(self.image)  # Drawオブジェクトを再作成
-            self.update_display_image()
+        if self.history.can_undo():
+            box = self.history.undo()
+            self.journal.undo()
+            self.refresh_image(box)
             self.unsaved_changes = True
 
+    @profiled
     def redo(self):
+        if self.defer_while_loading(self.redo):
+            return
+
         if not self.image_loaded:
             return
 
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.image = self.history[self.history_index].copy()
+        if self.history.can_redo():
+            box = self.history.redo()
+            self.journal.redo()
+            self.refresh_image(box)
+            self.unsaved_changes = True
 
-            # 鮮やかさを適用
-            if self.saturation_value != 1.0:
-                enhancer = ImageEnhance.Color(self.image)
-                self.image = enhancer.enhance(self.saturation_value)
+    def refresh_image(self, box=None):
+        """履歴の現在の状態に鮮やかさを適用して表示用の画像を更新
+
+        box を指定した場合はその範囲だけを再計算する。
+        """
+        base = self.history.current
+        self.saturation_proxy = None
+        self.base_pyramid = None
+
+        # 鮮やかさの確定前なら画像全体を計算し直す
+        if self.saturation_pending:
+            self.cancel_saturation_refinement()
+            box = None
+
+        previous = self.image
+        key = self.adjusted_key()
+        cached = None
+        if self.saturation_value != 1.0:
+            cached = self.render_cache.peek(key)
+
+        if self.saturation_value == 1.0:
+            # 彩度調整が不要な場合は履歴の画像をそのまま表示
+            self.image = base
+        elif cached is not None:
+            # 一度計算した状態であれば、キャッシュの画像に差し替えるだけ
+            # （render がキャッシュのヒットとして1回数える）
+            self.image = self.render_adjusted()
+        elif (
+            box is not None and self.image is not base and self.image.size == base.size
+        ):
+            # 変更された範囲だけ調整操作を適用
+            region = apply_operations(base.crop(box), self.adjustment_operations())
+            cache = self.render_cache
+            if (
+                cache.holds(self.image)
+                and cache.nbytes + image_nbytes(self.image) <= cache.max_bytes
+            ):
+                # 元の画像は前の状態の結果としてキャッシュに残すため、複製に貼り付ける
+                self.image = copy_image(self.image)
+            else:
+                # 前の状態の結果を残す余裕がなければ、複製せずにその場で書き換える
+                cache.discard_image(self.image)
+            self.image.paste(region, box[:2])
+            cache.put(key, self.image)
+        else:
+            # 調整操作の途中結果がキャッシュにあれば、その続きから計算
+            self.image = self.render_adjusted()
+            box = None
+
+        # 表示用のピラミッドは変更された範囲だけを作り直す
+        if box is None:
+            self.pyramid = None
+        elif self.pyramid is not None:
+            if self.pyramid.source is self.image:
+                self.pyramid.invalidate(box)
+                self.tiles.invalidate(box)
+            elif self.pyramid.source is previous and self.image.size == previous.size:
+                # 変更された範囲だけが異なる画像に差し替えた場合は、ピラミッドも引き継ぐ
+                self.pyramid.replace_source(self.image, box)
+                self.tiles.invalidate(box)
+            else:
+                self.pyramid = None
+
+        self.request_render(box=box)
+        self.update_history_status()
+
+    def update_history_status(self):
+        """履歴のメモリ/ディスク使用量と、キャッシュの状況を表示"""
+        ram_bytes, disk_bytes = self.history.nbytes()
+        cache = self.render_cache
+        self.history_label.config(
+            text=f"履歴: メモリ {format_bytes(ram_bytes)} / "
+            f"ディスク {format_bytes(disk_bytes)}  "
+            f"キャッシュ: {len(cache)}件 {format_bytes(cache.nbytes)} "
+            f"(ヒット {cache.hits} / ミス {cache.misses})"
+        )
 
-            self.draw = ImageDraw.Draw(self.image)  # Drawオブジェクトを再作成
-            self.update_display_image()
-            self.unsaved_changes = True
+    def toggle_timing_overlay(self):
+        """処理時間の表示を切り替える（表示中はメモリも計測する）"""
+        self.profiler.set_track_memory(self.timing_overlay.get())
+        self.update_timing_overlay()
+
+    def update_timing_overlay(self):
+        """キャンバスの左上に処理時間を表示し、表示中は定期的に更新"""
+        if self.timing_overlay_after_id:
+            self.root.after_cancel(self.timing_overlay_after_id)
+            self.timing_overlay_after_id = None
+        if not self.timing_overlay.get():
+            if self.timing_overlay_id:
+                self.canvas.delete(self.timing_overlay_id)
+                self.timing_overlay_id = None
+            return
+
+        text = format_summary(self.profiler.summary()) or "（記録なし）"
+        if self.timing_overlay_id:
+            self.canvas.itemconfig(self.timing_overlay_id, text=text)
+        else:
+            self.timing_overlay_id = self.canvas.create_text(
+                8, 8, anchor=tk.NW, text=text, fill="red", font=("TkFixedFont", 9)
+            )
+        self.canvas.tag_raise(self.timing_overlay_id)
+        self.timing_overlay_after_id = self.root.after(
+            TIMING_OVERLAY_INTERVAL, self.update_timing_overlay
+        )
+
+    def save_trace(self):
+        """処理時間の記録を Chrome のトレース形式で保存"""
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Trace files", "*.json"), ("All files", "*.*")],
+        )
+        if file_path:
+            try:
+                self.profiler.save_trace(file_path)
+            except Exception as e:
+                messagebox.showerror(
+                    "保存エラー", f"トレースの保存中にエラーが発生しました:\n{str(e)}"
+                )
+
+    def save_image(self, advance=True):
+        """画像を保存する
+
+        まとめてドロップした画像を編集中で advance の場合は、保存が成功したら
+        次の画像に進む（次の画像は先読みしてあるので、すぐに編集を始められる）。
+        """
+        if self.defer_while_loading(self.save_image, advance):
+            return
 
-    def save_image(self):
         if self.image and self.image_loaded:
+            # 保存前に塗りつぶし待ちの多角形と、鮮やかさを元の解像度で確定
+            self.commit_fills()
+            self.commit_saturation()
             file_path = filedialog.asksaveasfilename(
                 defaultextension=".png",
                 filetypes=[
@@ -659,48 +1541,177 @@ class ImageEditor:
                 ],
             )
             if file_path:
-                try:
-                    # ファイル形式に応じた保存処理
-                    if file_path.lower().endswith(".png"):
-                        self.image.save(file_path, format="PNG", compress_level=6)
-                    elif file_path.lower().endswith(
-                        ".jpg"
-                    ) or file_path.lower().endswith(".jpeg"):
-                        # JPEG品質設定ダイアログ
-                        quality = simpledialog.askinteger(
-                            "JPEG品質設定",
-                            "JPEG品質を指定してください (1-100)",
-                            minvalue=1,
-                            maxvalue=100,
-                            initialvalue=95,
-                        )
-                        if quality is not None:  # キャンセルされた場合は保存しない
-                            # RGBA画像をRGBに変換
-                            if self.image.mode == "RGBA":
-                                rgb_image = self.image.convert("RGB")
-                                rgb_image.save(
-                                    file_path, format="JPEG", quality=quality
-                                )
-                            else:
-                                self.image.save(
-                                    file_path, format="JPEG", quality=quality
-                                )
-                    elif file_path.lower().endswith(".heic"):
-                        self.image.save(file_path, format="HEIC")
-                    else:
-                        # 未知の形式の場合、デフォルトでPNGとして保存
-                        self.image.save(file_path + ".png", format="PNG")
-
-                    self.unsaved_changes = False
-                except Exception as e:
-                    messagebox.showerror(
-                        "保存エラー", f"画像の保存中にエラーが発生しました:\n{str(e)}"
+                # ファイル形式に応じた保存処理
+                params = {}
+                if file_path.lower().endswith(".png"):
+                    format = "PNG"
+                    params["compress_level"] = 6
+                elif file_path.lower().endswith(".jpg") or file_path.lower().endswith(
+                    ".jpeg"
+                ):
+                    format = "JPEG"
+                    # JPEG品質設定ダイアログ
+                    quality = simpledialog.askinteger(
+                        "JPEG品質設定",
+                        "JPEG品質を指定してください (1-100)",
+                        minvalue=1,
+                        maxvalue=100,
+                        initialvalue=95,
                     )
+                    if quality is None:  # キャンセルされた場合は保存しない
+                        return
+                    params["quality"] = quality
+                elif file_path.lower().endswith(".heic"):
+                    # pillow_heif は HEIC を HEIF 形式として保存する
+                    format = "HEIF"
+                else:
+                    # 未知の形式の場合、デフォルトでPNGとして保存
+                    format = "PNG"
+                    file_path += ".png"
+
+                # 現在の画像の複製をバックグラウンドで保存（保存中も編集を続けられる）
+                advance = (
+                    advance
+                    and self.file_path in self.drop_paths
+                    and self.file_path != self.drop_paths[-1]
+                )
+                self.start_save(
+                    copy_image(self.image), file_path, format, params, advance
+                )
         else:
             messagebox.showinfo(
                 "注意", "保存する画像がありません。まずは画像を開いてください。"
             )
 
+    def start_save(self, image, file_path, format, params, advance=False):
+        """画像の保存をバックグラウンドのスレッドで開始
+
+        advance の場合は、保存が成功したら次の画像に進む。
+        """
+        # 保存中に編集があれば、再び未保存の状態になる
+        self.unsaved_changes = False
+        self.journal.saved()
+        result = []
+
+        def work():
+            try:
+                with self.profiler.span("save_atomic"):
+                    save_atomic(image, file_path, format, **params)
+                result.append(None)
+            except Exception as e:
+                result.append(e)
+
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        self.save_threads.append(thread)
+        self.update_save_status()
+        self.root.after(50, self.poll_save, thread, result, self.file_path, advance)
+
+    def poll_save(self, thread, result, source_path, advance=False):
+        """バックグラウンドでの保存を待ち、完了したら結果を通知
+
+        source_path は保存を始めた時に編集していた画像のパス。
+        """
+        if not result:
+            self.root.after(50, self.poll_save, thread, result, source_path, advance)
+            return
+
+        self.save_threads.remove(thread)
+        self.update_save_status()
+        if result[0] is not None:
+            # 編集中の画像が保存した画像のままであれば、未保存の状態に戻す
+            if self.file_path == source_path:
+                self.unsaved_changes = True
+                self.journal.save_failed()
+            messagebox.showerror(
+                "保存エラー", f"画像の保存中にエラーが発生しました:\n{str(result[0])}"
+            )
+        elif advance and self.file_path == source_path:
+            # 保存が成功してから次の画像に進む（失敗した場合は編集を残す）
+            self.show_next_image()
+
+    def export_image(self):
+        """書き出しプロファイルのすべての形式にまとめて書き出す"""
+        if self.defer_while_loading(self.export_image):
+            return
+
+        if not (self.image and self.image_loaded):
+            messagebox.showinfo(
+                "注意", "書き出す画像がありません。まずは画像を開いてください。"
+            )
+            return
+        try:
+            targets = load_targets()
+        except Exception as e:
+            messagebox.showerror(
+                "書き出しエラー", f"書き出しプロファイルを読み込めません:\n{str(e)}"
+            )
+            return
+
+        self.commit_fills()
+        self.commit_saturation()
+        # 拡張子は書き出し先ごとに付け替える
+        base_path = filedialog.asksaveasfilename(
+            title="書き出し先のファイル名", filetypes=[("All files", "*.*")]
+        )
+        if not base_path:
+            return
+        # ダイアログが確認するのは選んだ名前だけなので、ほかの書き出し先の
+        # ファイルを上書きする場合はまとめて確認する
+        existing = [
+            path
+            for path in existing_targets(base_path, targets)
+            if os.path.abspath(path) != os.path.abspath(base_path)
+        ]
+        if existing and not messagebox.askokcancel(
+            "上書きの確認",
+            "次のファイルはすでにあります。上書きしますか？\n"
+            + "\n".join(os.path.basename(path) for path in existing),
+            icon="warning",
+        ):
+            return
+
+        image = copy_image(self.image)
+        exif = self.original_image.info.get("exif") if self.original_image else None
+        result = []
+
+        def work():
+            with self.profiler.span("export_targets"):
+                result.append(export_targets(image, base_path, targets, exif))
+
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        self.save_threads.append(thread)
+        self.update_save_status()
+        self.root.after(50, self.poll_export, thread, result)
+
+    def poll_export(self, thread, result):
+        """バックグラウンドでの書き出しを待ち、完了したら結果を表示"""
+        if thread.is_alive():
+            self.root.after(50, self.poll_export, thread, result)
+            return
+
+        self.save_threads.remove(thread)
+        self.update_save_status()
+        if not result:
+            messagebox.showerror("書き出しエラー", "書き出し中にエラーが発生しました")
+        elif any("error" in record for record in result[0]):
+            messagebox.showerror("書き出しエラー", format_report(result[0]))
+        else:
+            messagebox.showinfo("書き出し完了", format_report(result[0]))
+
+    def update_save_status(self):
+        """保存中であれば進行状況を表示"""
+        if self.save_threads:
+            if not self.save_label.winfo_ismapped():
+                self.save_label.pack(side=tk.LEFT, padx=2, pady=2)
+                self.save_progress.pack(side=tk.LEFT, padx=2, pady=2)
+                self.save_progress.start(10)
+        else:
+            self.save_progress.stop()
+            self.save_label.pack_forget()
+            self.save_progress.pack_forget()
+
     def show_copyright(self):
         """著作権情報を表示"""
         messagebox.showinfo(
@@ -716,14 +1727,55 @@ class ImageEditor:
             if result is None:  # キャンセル
                 return
             elif result:  # はい
-                self.save_image()
+                self.save_image(advance=False)
+
+        # 保存中のファイルは書き終わるまで待つ
+        for thread in list(self.save_threads):
+            thread.join()
+        self.decoded_cache.close()
+        self.filmstrip.close()
+        self.journal.close()
         self.root.destroy()
 
 
-if __name__ == "__main__":
+def report_startup(root, app, marks, show):
+    """最初の描画までの時間を記録し、show の場合は内訳を表示"""
+    # 保留中の描画を済ませてから最初の描画の時刻とする
+    root.update_idletasks()
+    marks.append(("first_paint", time.perf_counter()))
+
+    start = STARTED_AT
+    for name, end in marks:
+        app.profiler.record(f"startup/{name}", start, end)
+        start = end
+    if show:
+        spans = [s for s in app.profiler.spans if s.name.startswith("startup/")]
+        print(format_spans(spans), file=sys.stderr)
+        print(f"合計 {(start - STARTED_AT) * 1000:.1f}ms", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="画像編集ツール")
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="起動してから最初の描画までの時間の内訳を表示",
+    )
+    args = parser.parse_args(argv)
+
+    marks = [("imports", IMPORTED_AT)]
     root = TkinterDnD.Tk()
+    marks.append(("create_root", time.perf_counter()))
     app = ImageEditor(root)
     # 初期ウィンドウサイズを設定
     root.geometry("1024x768")
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
+    marks.append(("build_ui", time.perf_counter()))
+    root.after_idle(report_startup, root, app, marks, args.startup_report)
+    # 前回が異常終了していれば、最初の描画の後に編集の復旧を確認する
+    root.after_idle(app.recover_session)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    main()
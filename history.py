@@ -0,0 +1,365 @@
+"""差分ベースの編集履歴
+
+編集ごとに画像全体をコピーする代わりに、変更された矩形領域のパッチと
+トリミング範囲だけを記録する。一定間隔で画像全体のキーフレームを保持し、
+任意の状態はキーフレームから差分を再適用して復元する。
+
+各エントリは元になった編集操作（operations.py の辞書）も保持するため、
+履歴は操作の記録としても使える。
+
+履歴データは ImageStore に預け、メモリ予算を超えた古いデータから順に
+メモリ上で圧縮し、さらに一時ファイルへ書き出す。キーフレームは
+keyframe_store を指定すると、そちらに預ける（大きな画像をディスク上に
+複製する outofcore.MappedKeyframes など）。
+"""
+
+import itertools
+import mmap
+import tempfile
+import zlib
+from collections import OrderedDict
+
+from PIL import Image
+
+from operations import crop_image
+
+# 履歴が使うメモリの既定の上限（バイト）
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# 履歴の状態を一意に識別する番号
+_serials = itertools.count(1)
+
+
+def image_nbytes(image):
+    """画像データのおおよそのバイト数を返す"""
+    width, height = image.size
+    return width * height * len(image.getbands())
+
+
+def format_bytes(nbytes):
+    """バイト数を読みやすい文字列に変換"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if nbytes < 1024 or unit == "GB":
+            return f"{nbytes:.1f}{unit}"
+        nbytes /= 1024
+
+
+class StoredImage:
+    """ImageStore に預けた画像（非圧縮・圧縮・ディスクのいずれかで保持）"""
+
+    def __init__(self, image):
+        self.mode = image.mode
+        self.size = image.size
+        self.palette = image.getpalette() if image.mode == "P" else None
+        self.raw_nbytes = image_nbytes(image)
+        self.image = image  # 非圧縮の画像
+        self.data = None  # 圧縮済みのバイト列
+        self.offset = None  # ディスク上の位置
+        self.length = 0  # ディスク上の長さ
+
+    def ram_nbytes(self):
+        if self.image is not None:
+            return self.raw_nbytes
+        if self.data is not None:
+            return len(self.data)
+        return 0
+
+    def decode(self, data):
+        """圧縮データから画像を復元"""
+        image = Image.frombytes(self.mode, self.size, zlib.decompress(data))
+        if self.palette is not None:
+            image.putpalette(self.palette)
+        return image
+
+
+class ImageStore:
+    """履歴データをメモリ予算内に保つ階層型のストア
+
+    予算を超えると、最も長く使われていないデータから圧縮し、
+    それでも足りなければ一時ファイルへ書き出す。
+    ディスク上のデータは必要になった時にメモリマップして読み込む。
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.ram_bytes = 0
+        self.disk_bytes = 0
+        self._lru = OrderedDict()  # メモリ上にあるデータ（古い順）
+        self._file = None
+        self._file_size = 0
+        self._mmap = None
+
+    def put(self, image):
+        """画像を預けてハンドルを返す"""
+        stored = StoredImage(image)
+        self._lru[stored] = None
+        self.ram_bytes += stored.ram_nbytes()
+        self._enforce_budget()
+        return stored
+
+    def get(self, stored):
+        """預けた画像を取り出す（呼び出し側で書き換えないこと）"""
+        if stored.image is not None:
+            self._lru.move_to_end(stored)
+            return stored.image
+        if stored.data is not None:
+            self._lru.move_to_end(stored)
+            return stored.decode(stored.data)
+        return stored.decode(self._read(stored.offset, stored.length))
+
+    def discard(self, stored):
+        """不要になった画像を破棄"""
+        if stored in self._lru:
+            del self._lru[stored]
+            self.ram_bytes -= stored.ram_nbytes()
+        elif stored.offset is not None:
+            self.disk_bytes -= stored.length
+            # ディスク上のデータがすべて不要になったらファイルを空にする
+            if self.disk_bytes == 0:
+                self._truncate()
+        stored.image = stored.data = None
+        stored.offset = None
+
+    def close(self):
+        """一時ファイルを閉じる"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _enforce_budget(self):
+        # まずは古いものから圧縮
+        for stored in list(self._lru):
+            if self.ram_bytes <= self.memory_budget:
+                return
+            if stored.image is not None:
+                before = stored.ram_nbytes()
+                stored.data = zlib.compress(stored.image.tobytes(), 1)
+                stored.image = None
+                self.ram_bytes += stored.ram_nbytes() - before
+
+        # それでも超える場合は古いものからディスクへ書き出す
+        for stored in list(self._lru):
+            if self.ram_bytes <= self.memory_budget:
+                return
+            stored.offset, stored.length = self._write(stored.data)
+            self.ram_bytes -= stored.ram_nbytes()
+            self.disk_bytes += stored.length
+            stored.data = None
+            del self._lru[stored]
+
+    def _write(self, data):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="photoeditor-history-")
+        offset = self._file_size
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+        self._file_size += len(data)
+        return offset, len(data)
+
+    def _read(self, offset, length):
+        # ファイルが伸びていればマップし直す
+        if self._mmap is None or len(self._mmap) < offset + length:
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(
+                self._file.fileno(), self._file_size, access=mmap.ACCESS_READ
+            )
+        return self._mmap[offset : offset + length]
+
+    def _truncate(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.truncate(0)
+        self._file_size = 0
+
+
+class PatchEntry:
+    """矩形領域の変更（塗りつぶしなど）を表す履歴エントリ"""
+
+    def __init__(self, store, box, before, after, operation=None):
+        self.store = store
+        self.box = box
+        self.operation = operation  # 元になった編集操作
+        self.serial = next(_serials)
+        self.before = store.put(before)  # 変更前の領域
+        self.after = store.put(after)  # 変更後の領域
+
+    def nbytes(self):
+        return self.before.raw_nbytes + self.after.raw_nbytes
+
+    def apply(self, image):
+        """変更を適用した画像を返す（画像はその場で書き換える）"""
+        image.paste(self.store.get(self.after), self.box[:2])
+        return image
+
+    def revert(self, image):
+        """変更を取り消した画像を返す（画像はその場で書き換える）"""
+        image.paste(self.store.get(self.before), self.box[:2])
+        return image
+
+    def discard(self):
+        self.store.discard(self.before)
+        self.store.discard(self.after)
+
+
+class CropEntry:
+    """トリミングを表す履歴エントリ（切り取り範囲のみを保持）"""
+
+    def __init__(self, box):
+        self.box = box
+        self.operation = {"op": "crop", "box": list(box)}
+        self.serial = next(_serials)
+
+    def nbytes(self):
+        return 0
+
+    def apply(self, image):
+        return crop_image(image, self.box)
+
+    def discard(self):
+        pass
+
+
+class History:
+    """パッチとキーフレームによる元に戻す/やり直す履歴"""
+
+    def __init__(
+        self,
+        image,
+        keyframe_interval=32,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+        keyframe_store=None,
+    ):
+        self.store = ImageStore(memory_budget)
+        self.keyframe_store = keyframe_store
+        # entries[i] は状態 i-1 から状態 i への変化（entries[0] は初期状態）
+        self.entries = [None]
+        self.initial_serial = next(_serials)
+        self.keyframes = {0: self._put_keyframe(image)}
+        self.index = 0
+        self.keyframe_interval = keyframe_interval
+        # 現在の状態の画像（呼び出し側が編集し、その差分を記録する）
+        self.current = image
+
+    def __len__(self):
+        return len(self.entries)
+
+    def can_undo(self):
+        return self.index > 0
+
+    def can_redo(self):
+        return self.index < len(self.entries) - 1
+
+    def record_patch(self, box, before, after, operation=None):
+        """current に加えた矩形領域の変更を、元になった操作と共に記録"""
+        self._push(PatchEntry(self.store, box, before, after, operation))
+
+    def record_crop(self, box, image):
+        """トリミングを記録し、トリミング後の画像を現在の状態にする"""
+        self.current = image
+        self._push(CropEntry(box))
+
+    def undo(self):
+        """1つ前の状態に戻す。変更された領域（全体の場合は None）を返す"""
+        if not self.can_undo():
+            return None
+        entry = self.entries[self.index]
+        self.index -= 1
+        if isinstance(entry, PatchEntry):
+            entry.revert(self.current)
+            return entry.box
+
+        # トリミングは逆適用できないのでキーフレームから復元
+        self.current = self.rebuild(self.index)
+        return None
+
+    def redo(self):
+        """1つ先の状態に進める。変更された領域（全体の場合は None）を返す"""
+        if not self.can_redo():
+            return None
+        self.index += 1
+        entry = self.entries[self.index]
+        self.current = entry.apply(self.current)
+        if isinstance(entry, PatchEntry):
+            return entry.box
+        return None
+
+    def state_key(self):
+        """現在の状態を一意に識別する値（同じ内容の状態には同じ値を返す）"""
+        if self.index == 0:
+            return self.initial_serial
+        return self.entries[self.index].serial
+
+    def operations(self):
+        """初期状態から現在の状態までに適用した操作の一覧"""
+        return [
+            entry.operation
+            for entry in self.entries[1 : self.index + 1]
+            if entry.operation is not None
+        ]
+
+    def rebuild(self, index):
+        """最寄りのキーフレームから指定した状態の画像を新たに作成"""
+        start = max(k for k in self.keyframes if k <= index)
+        image = self._get_keyframe(self.keyframes[start])
+        for entry in self.entries[start + 1 : index + 1]:
+            image = entry.apply(image)
+        return image
+
+    def nbytes(self):
+        """履歴が保持しているデータの (メモリ上, ディスク上) のバイト数"""
+        disk_bytes = self.store.disk_bytes
+        if self.keyframe_store is not None:
+            disk_bytes += self.keyframe_store.disk_bytes
+        return self.store.ram_bytes, disk_bytes
+
+    def close(self):
+        """履歴を破棄して一時ファイルを片付ける"""
+        self.store.close()
+
+    def _push(self, entry):
+        # 現在位置より先の履歴（やり直し分）を破棄
+        for discarded in self.entries[self.index + 1 :]:
+            discarded.discard()
+        del self.entries[self.index + 1 :]
+        for key in [k for k in self.keyframes if k > self.index]:
+            self._discard_keyframe(self.keyframes.pop(key))
+
+        self.entries.append(entry)
+        self.index += 1
+
+        if self._needs_keyframe():
+            self.keyframes[self.index] = self._put_keyframe(self.current)
+
+    def _put_keyframe(self, image):
+        """画像の複製をキーフレームとして預ける"""
+        if self.keyframe_store is not None:
+            return self.keyframe_store.put(image)
+        return self.store.put(image.copy())
+
+    def _get_keyframe(self, stored):
+        """キーフレームの書き換え可能な複製を返す"""
+        if self.keyframe_store is not None:
+            return self.keyframe_store.get(stored)
+        return self.store.get(stored).copy()
+
+    def _discard_keyframe(self, stored):
+        if self.keyframe_store is not None:
+            self.keyframe_store.discard(stored)
+        else:
+            self.store.discard(stored)
+
+    def _needs_keyframe(self):
+        """直前のキーフレームからの差分が十分に溜まったかを判定"""
+        last = max(self.keyframes)
+        pending = self.entries[last + 1 : self.index + 1]
+        if len(pending) >= self.keyframe_interval:
+            return True
+        # 差分の量が画像1枚分を超えたらキーフレームを置いた方が安い
+        return sum(entry.nbytes() for entry in pending) >= image_nbytes(self.current)
@@ -0,0 +1,383 @@
+"""フォルダの監視による常駐処理
+
+入力フォルダを一定間隔で調べ、新しく置かれた画像にレシピの編集操作
+（batch.py と同じ形式）を適用して出力フォルダに保存し続ける。
+書き込み中のファイルを処理しないよう、サイズと更新日時が1回の間隔の間
+変わらなかったファイルだけを待ち行列に入れる。待ち行列が一杯の間は
+新しいファイルを入れず、次の確認の時に改めて見つける。
+
+ワーカープロセスは起動時に1回だけ作成し、HEIC の登録・NumPy・ImageDraw を
+読み込んでおくため、ファイルごとの処理にはこれらの読み込み時間がかからない。
+レシピのファイルが更新されると読み込み直す。
+
+待ち行列の長さ・処理数・スループット・待ち時間を含めた処理時間（p50/p99）は、
+統計ファイル（JSON）に一定間隔で書き出す。
+
+使い方:
+    uv run hotfolder.py 入力フォルダ 出力フォルダ --recipe recipe.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from adjust import load_numpy
+from batch import (
+    FORMATS,
+    list_images,
+    load_recipe,
+    operations_for,
+    process_file,
+    read_manifest,
+    save_params,
+)
+from loader import register_heif
+from outofcore import DEFAULT_MAX_PIXELS
+from saver import file_mode
+
+# フォルダを調べる間隔（秒）
+POLL_INTERVAL = 1.0
+
+# 統計ファイルを書き出す間隔（秒）
+STATS_INTERVAL = 5.0
+
+# スループットを計算する期間（秒）
+THROUGHPUT_WINDOW = 60.0
+
+# 処理時間の分位数の計算に使う直近の件数
+LATENCY_WINDOW = 1000
+
+
+def _warm_worker():
+    """ワーカープロセスの起動時に、初めて使う時に読み込むものを読み込んでおく"""
+    # Ctrl+C はメインのプロセスだけが受け取り、プールを終了させる
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    register_heif()
+    load_numpy()
+    from PIL import ImageDraw  # noqa: F401
+
+
+class FolderWatcher:
+    """フォルダを調べ、書き込みが終わった新しい画像のファイル名を返す"""
+
+    def __init__(self, directory, known=()):
+        self.directory = directory
+        self.known = set(known)  # 待ち行列に入れた（または処理済みの）ファイル名
+        self.candidates = {}  # ファイル名 -> 前回調べた時の (サイズ, 更新日時)
+
+    def poll(self, limit=None):
+        """サイズと更新日時が前回から変わっていない新しい画像を最大 limit 件返す"""
+        ready = []
+        candidates = {}
+        for name in list_images(self.directory):
+            if name in self.known:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if self.candidates.get(name) == signature and (
+                limit is None or len(ready) < limit
+            ):
+                ready.append(name)
+                self.known.add(name)
+            else:
+                # 書き込み中か、待ち行列が一杯なので次回に回す
+                candidates[name] = signature
+        self.candidates = candidates
+        return ready
+
+
+def percentile(values, fraction):
+    """values の fraction の分位数（最も近い順位の値）"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(max(round(fraction * len(ordered)) - 1, 0), len(ordered) - 1)
+    return ordered[index]
+
+
+class Stats:
+    """処理数・スループット・処理時間の分位数を集計する"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.processed = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.completed = deque()  # 直近の完了時刻（time.monotonic() の値）
+
+    def add(self, record):
+        self.processed += 1
+        if record["status"] != "ok":
+            self.errors += 1
+        self.latencies.append(record["latency"])
+        now = time.monotonic()
+        self.completed.append(now)
+        while self.completed and self.completed[0] < now - THROUGHPUT_WINDOW:
+            self.completed.popleft()
+
+    def snapshot(self, queued, running):
+        now = time.monotonic()
+        recent = [t for t in self.completed if t >= now - THROUGHPUT_WINDOW]
+        latencies = list(self.latencies)
+        return {
+            "time": time.time(),
+            "uptime": round(time.time() - self.started, 1),
+            "queue_depth": queued + running,
+            "queued": queued,
+            "running": running,
+            "processed": self.processed,
+            "errors": self.errors,
+            "throughput": round(len(recent) / THROUGHPUT_WINDOW, 3),
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p99": percentile(latencies, 0.99),
+        }
+
+
+def write_stats(path, stats):
+    """統計を一時ファイルに書いてから置き換える（読む側が途中の内容を見ないように）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+        os.chmod(temp_path, file_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class HotFolder:
+    """入力フォルダの新しい画像を、常駐するプロセスプールで処理し続ける"""
+
+    def __init__(
+        self,
+        input_dir,
+        output_dir,
+        recipe_path,
+        workers=None,
+        max_queue=256,
+        format=None,
+        quality=95,
+        max_pixels=DEFAULT_MAX_PIXELS,
+        manifest_path=None,
+        stats_path=None,
+    ):
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.recipe_path = recipe_path
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.format = format
+        self.quality = quality
+        self.max_pixels = max_pixels
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest_path = manifest_path or os.path.join(
+            output_dir, "manifest.jsonl"
+        )
+        self.stats_path = stats_path or os.path.join(output_dir, "stats.json")
+
+        self.recipe = load_recipe(recipe_path)
+        self.recipe_mtime = os.path.getmtime(recipe_path)
+        # マニフェストで成功が記録されているファイルは処理しない
+        self.watcher = FolderWatcher(input_dir, read_manifest(self.manifest_path))
+        self.queue = deque()  # (ファイル名, 見つけた時刻)
+        self.running = {}  # Future -> (ファイル名, 見つけた時刻)
+        self.stats = Stats()
+
+    def reload_recipe(self):
+        """レシピのファイルが更新されていれば読み込み直す"""
+        try:
+            mtime = os.path.getmtime(self.recipe_path)
+        except OSError as e:
+            print(f"レシピを読み込めません（以前のレシピを使います）: {e}")
+            return
+        if mtime == self.recipe_mtime:
+            return
+        # 読み込めなかった場合も、次にファイルが更新されるまでは読み込み直さない
+        self.recipe_mtime = mtime
+        try:
+            self.recipe = load_recipe(self.recipe_path)
+            print(f"レシピを読み込み直しました: {self.recipe_path}")
+        except Exception as e:
+            print(f"レシピを読み込めません（以前のレシピを使います）: {e}")
+
+    def submit(self, pool, name, found, manifest):
+        """ファイルの処理をプールに渡す（渡せない場合はエラーとして記録）"""
+        stem, ext = os.path.splitext(name)
+        ext = f".{self.format}" if self.format else ext.lower()
+        try:
+            format = FORMATS[ext]
+            future = pool.submit(
+                process_file,
+                os.path.join(self.input_dir, name),
+                os.path.join(self.output_dir, stem + ext),
+                operations_for(self.recipe, name),
+                format,
+                save_params(format, self.quality),
+                self.max_pixels,
+            )
+        except Exception as e:
+            record = {"file": name, "status": "error", "error": str(e)}
+            self.record(record, found, manifest)
+            return
+        self.running[future] = (name, found)
+
+    def collect(self, done, manifest):
+        """完了した処理の結果をマニフェストと統計に記録"""
+        for future in done:
+            name, found = self.running.pop(future)
+            try:
+                record = future.result()
+            except Exception as e:
+                # ワーカープロセスが異常終了した場合など
+                record = {"file": name, "status": "error", "error": str(e)}
+            self.record(record, found, manifest)
+
+    def record(self, record, found, manifest):
+        """1ファイルの結果をマニフェストと統計に記録"""
+        record["latency"] = round(time.monotonic() - found, 3)
+        manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+        manifest.flush()
+        self.stats.add(record)
+        print(
+            f"{record['file']}: {record['status']} ({record['latency']:.2f}秒)"
+            + (f" {record['error']}" if "error" in record else "")
+        )
+
+    def write_stats(self):
+        try:
+            write_stats(
+                self.stats_path,
+                self.stats.snapshot(len(self.queue), len(self.running)),
+            )
+        except OSError as e:
+            print(f"統計を書き出せません: {e}")
+
+    def run(self, once=False):
+        """フォルダの監視と処理を続ける（once の場合は今ある画像を処理して終了）"""
+        # 常駐するため、GUI と同様に fork ではなく spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context, initializer=_warm_worker
+        )
+        next_poll = 0.0
+        next_stats = 0.0
+        # once の場合は、書き込みの完了を確かめるために最低2回は調べる
+        polls = 0
+        try:
+            with open(self.manifest_path, "a", encoding="utf-8") as manifest:
+                while True:
+                    now = time.monotonic()
+                    if now >= next_poll:
+                        self.reload_recipe()
+                        space = self.max_queue - len(self.queue)
+                        for name in self.watcher.poll(space):
+                            self.queue.append((name, now))
+                        next_poll = now + POLL_INTERVAL
+                        polls += 1
+
+                    # プールに渡すのはワーカー数の2倍まで（残りは待ち行列で待つ）
+                    while self.queue and len(self.running) < self.workers * 2:
+                        self.submit(pool, *self.queue.popleft(), manifest)
+
+                    if now >= next_stats:
+                        self.write_stats()
+                        next_stats = now + STATS_INTERVAL
+
+                    if (
+                        once
+                        and polls >= 2
+                        and not self.queue
+                        and not self.running
+                        and not self.watcher.candidates
+                    ):
+                        break
+
+                    timeout = max(next_poll - time.monotonic(), 0)
+                    if self.running:
+                        done, _ = wait(
+                            self.running, timeout=timeout, return_when=FIRST_COMPLETED
+                        )
+                        self.collect(done, manifest)
+                    else:
+                        time.sleep(timeout)
+        finally:
+            for future in self.running:
+                future.cancel()
+            pool.shutdown()
+            self.write_stats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="フォルダを監視し、新しい画像にレシピの編集操作を適用し続けます"
+    )
+    parser.add_argument("input_dir", help="監視する入力フォルダ")
+    parser.add_argument("output_dir", help="出力フォルダ")
+    parser.add_argument("--recipe", required=True, help="レシピ（JSON または CSV）")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="並列に処理するプロセス数"
+    )
+    parser.add_argument(
+        "--max-queue", type=int, default=256, help="待ち行列に入れるファイル数の上限"
+    )
+    parser.add_argument(
+        "--manifest", help="マニフェストのパス（既定は 出力フォルダ/manifest.jsonl）"
+    )
+    parser.add_argument(
+        "--stats", help="統計ファイルのパス（既定は 出力フォルダ/stats.json）"
+    )
+    parser.add_argument(
+        "--format", choices=["png", "jpg", "heic"], help="保存形式（既定は入力と同じ）"
+    )
+    parser.add_argument("--quality", type=int, default=95, help="JPEG品質 (1-100)")
+    parser.add_argument(
+        "--max-pixels",
+        type=int,
+        default=DEFAULT_MAX_PIXELS,
+        help="これを超える画素数の画像は一時ファイル上で帯ごとに処理",
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="今ある画像を処理したら終了する"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        hot_folder = HotFolder(
+            args.input_dir,
+            args.output_dir,
+            args.recipe,
+            workers=args.workers,
+            max_queue=args.max_queue,
+            format=args.format,
+            quality=args.quality,
+            max_pixels=args.max_pixels,
+            manifest_path=args.manifest,
+            stats_path=args.stats,
+        )
+    except (OSError, KeyError, ValueError) as e:
+        print(f"開始できません: {e}", file=sys.stderr)
+        return 2
+    print(f"{args.input_dir} を監視しています（Ctrl+C で終了）")
+    try:
+        hot_folder.run(once=args.once)
+    except KeyboardInterrupt:
+        print("終了します")
+    stats = hot_folder.stats
+    print(f"処理: {stats.processed} 件, 失敗: {stats.errors} 件")
+    return 1 if args.once and stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
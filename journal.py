@@ -0,0 +1,348 @@
+"""編集のジャーナル（異常終了からの復旧用）
+
+編集操作（塗りつぶしの多角形と色・トリミング範囲・鮮やかさの値）と
+元に戻す/やり直すを、1行1件の JSON としてジャーナルのファイルに追記する。
+一定の件数の操作ごとに、履歴の現在の画像を圧縮率の低い PNG で
+チェックポイントとして保存する。書き込みはバックグラウンドのスレッドで
+行うため、編集の操作を待たせない。
+
+ジャーナルはエディタのプロセスごとに作成し、正常に終了した時に削除する。
+起動時に残っているジャーナルは異常終了したものなので、元の画像を開き直して
+操作を再適用する。元の画像が変わっていたりなくなっていたりする場合は、
+チェックポイントの画像から再適用する。
+"""
+
+import json
+import os
+import queue
+import sys
+import threading
+
+from outofcore import is_mapped
+from saver import save_atomic
+
+# チェックポイントを保存する操作の件数の間隔
+CHECKPOINT_INTERVAL = 20
+
+
+def default_journal_dir():
+    """ユーザーのキャッシュフォルダにあるジャーナルのフォルダ"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "PythonPhotoEditor", "sessions")
+
+
+def file_signature(file_path):
+    """ファイルが変わっていないかを確かめるための [更新日時, サイズ]"""
+    stat = os.stat(file_path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def remove_session_files(directory, prefix):
+    """prefix のセッションのジャーナルとチェックポイントを削除"""
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.startswith(prefix + ".") or name.startswith(prefix + "-"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def _process_alive(pid):
+    """pid のプロセスが実行中かどうか"""
+    if sys.platform == "win32":
+        # Windows の os.kill はプロセスを終了させてしまうので、API で確かめる
+        return _windows_process_alive(pid)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _windows_process_alive(pid):
+    """Windows で pid のプロセスが実行中かどうか"""
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    ERROR_ACCESS_DENIED = 5
+    STILL_ACTIVE = 259
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, wintypes.LPDWORD)
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # 別のユーザーのプロセスは開けないが、実行中ではある
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(code)):
+            return True
+        return code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+class Journal:
+    """編集の記録をバックグラウンドのスレッドでファイルに追記する"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or default_journal_dir()
+        self.prefix = f"session-{os.getpid()}"
+        self.path = os.path.join(self.directory, self.prefix + ".jsonl")
+        self.checkpoints = 0  # 保存したチェックポイントの数（ファイル名に使う）
+        self.serial = 0  # 操作の通し番号
+        self.stack = []  # 記録した操作の通し番号（やり直しの分も含む）
+        self.index = 0  # 現在の状態までの操作の数
+        self.since_checkpoint = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self, file_path, image=None):
+        """file_path を開いた新しいセッションの記録を始める
+
+        image を指定した場合は、元の画像の代わりに image を最初の
+        チェックポイントとして保存する（元の画像から再適用できない場合に使う）。
+        """
+        self._put("reset", None)
+        self.serial = 0
+        self.stack = []
+        self.index = 0
+        self.since_checkpoint = 0
+        try:
+            signature = file_signature(file_path)
+        except OSError:
+            signature = None
+        self.append({"type": "open", "path": file_path, "signature": signature})
+        if image is not None:
+            self.checkpoint(image)
+
+    def append(self, record):
+        self._put("record", record)
+
+    def operation(self, operation, image):
+        """編集操作を記録し、一定の件数ごとに image をチェックポイントとして保存"""
+        self.serial += 1
+        del self.stack[self.index :]
+        self.stack.append(self.serial)
+        self.index += 1
+        self.append({"type": "op", "operation": operation})
+        self.since_checkpoint += 1
+        if self.since_checkpoint >= CHECKPOINT_INTERVAL:
+            self.checkpoint(image)
+
+    def undo(self):
+        if self.index > 0:
+            self.index -= 1
+            self.append({"type": "undo"})
+
+    def redo(self):
+        if self.index < len(self.stack):
+            self.index += 1
+            self.append({"type": "redo"})
+
+    def saturation(self, value):
+        self.append({"type": "saturation", "value": value})
+
+    def saved(self):
+        """画像を保存したことを記録（以降の編集がなければ復旧の対象にしない）"""
+        self.append({"type": "saved"})
+
+    def save_failed(self):
+        self.append({"type": "save_failed"})
+
+    def checkpoint(self, image):
+        """image（現在の状態の画像）をチェックポイントとして保存"""
+        self.since_checkpoint = 0
+        # ディスク上の大きな画像は複製に時間がかかるので保存しない
+        if is_mapped(image):
+            return
+        self.checkpoints += 1
+        file_name = f"{self.prefix}-{self.checkpoints}.png"
+        record = {
+            "type": "checkpoint",
+            "file": file_name,
+            "index": self.index,
+            "serial": self.stack[self.index - 1] if self.index else 0,
+        }
+        # 画像はこの後の編集で書き換えられるため、ここで複製する
+        self._put("checkpoint", (image.copy(), file_name, record))
+
+    def flush(self):
+        """書き込み待ちの記録をすべて書き終えるまで待つ"""
+        self._queue.join()
+
+    def close(self, remove=True):
+        """記録を終了し、remove の場合はジャーナルとチェックポイントを削除"""
+        if self._thread is None:
+            if remove:
+                remove_session_files(self.directory, self.prefix)
+            return
+        self._queue.put(("close", remove))
+        self._thread.join()
+        self._thread = None
+
+    def _put(self, kind, value):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._write, name="journal", daemon=True
+            )
+            self._thread.start()
+        self._queue.put((kind, value))
+
+    def _write(self):
+        """キューの記録を順にファイルに書き出す（バックグラウンドのスレッド）"""
+        f = None
+        try:
+            while True:
+                kind, value = self._queue.get()
+                try:
+                    if kind == "close":
+                        if f is not None:
+                            f.close()
+                            f = None
+                        if value:
+                            remove_session_files(self.directory, self.prefix)
+                        return
+                    if kind == "reset":
+                        if f is not None:
+                            f.close()
+                        remove_session_files(self.directory, self.prefix)
+                        os.makedirs(self.directory, exist_ok=True)
+                        f = open(self.path, "w", encoding="utf-8")
+                        continue
+                    if f is None:
+                        os.makedirs(self.directory, exist_ok=True)
+                        f = open(self.path, "a", encoding="utf-8")
+                    if kind == "checkpoint":
+                        # 画像を書き終えてからチェックポイントを記録する
+                        image, file_name, value = value
+                        save_atomic(
+                            image,
+                            os.path.join(self.directory, file_name),
+                            "PNG",
+                            compress_level=1,
+                        )
+                    # プロセスが異常終了しても残るよう、1件ごとに書き出す
+                    f.write(json.dumps(value, ensure_ascii=False) + "\n")
+                    f.flush()
+                except Exception as e:
+                    print(f"ジャーナルの書き込みに失敗しました: {e}")
+                finally:
+                    self._queue.task_done()
+        finally:
+            if f is not None:
+                f.close()
+
+
+class Session:
+    """ジャーナルから読み込んだ、復旧するセッションの状態"""
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.path = None  # 開いていた画像のパス
+        self.signature = None  # 開いた時の元の画像の [更新日時, サイズ]
+        self.operations = []  # 現在の状態までの編集操作
+        self.saturation = 1.0
+        self.checkpoint = None  # (チェックポイントの画像のパス, 含まれる操作の数)
+        self.dirty = False  # 保存していない編集があるか
+
+    def source_available(self):
+        """元の画像が開いた時から変わっていないか"""
+        try:
+            return self.signature == file_signature(self.path)
+        except (OSError, TypeError):
+            return False
+
+    def discard(self):
+        """ジャーナルとチェックポイントを削除"""
+        directory, name = os.path.split(self.journal_path)
+        remove_session_files(directory, os.path.splitext(name)[0])
+
+
+def read_journal(journal_path):
+    """ジャーナルを読み込んで Session を返す"""
+    session = Session(journal_path)
+    stack = []  # (通し番号, 操作)
+    index = 0
+    serial = 0
+    checkpoints = []
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 異常終了で途中までしか書かれていない行
+                break
+            kind = record["type"]
+            if kind == "open":
+                session.path = record["path"]
+                session.signature = record["signature"]
+            elif kind == "op":
+                serial += 1
+                del stack[index:]
+                stack.append((serial, record["operation"]))
+                index += 1
+                session.dirty = True
+            elif kind == "undo":
+                index = max(index - 1, 0)
+                session.dirty = True
+            elif kind == "redo":
+                index = min(index + 1, len(stack))
+                session.dirty = True
+            elif kind == "saturation":
+                session.saturation = record["value"]
+                session.dirty = True
+            elif kind == "saved":
+                session.dirty = False
+            elif kind == "save_failed":
+                session.dirty = True
+            elif kind == "checkpoint":
+                checkpoints.append(record)
+    session.operations = [operation for _, operation in stack[:index]]
+
+    # 現在の状態までの操作の途中の状態を保存した、最も新しいチェックポイント
+    directory = os.path.dirname(journal_path)
+    for record in reversed(checkpoints):
+        count = record["index"]
+        if count > index or (count and stack[count - 1][0] != record["serial"]):
+            continue
+        file_path = os.path.join(directory, record["file"])
+        if os.path.exists(file_path):
+            session.checkpoint = (file_path, count)
+            break
+    return session
+
+
+def find_sessions(directory=None):
+    """異常終了したエディタのジャーナルのパスを、新しいものから順に返す"""
+    directory = directory or default_journal_dir()
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if not (stem.startswith("session-") and ext == ".jsonl"):
+            continue
+        try:
+            pid = int(stem[len("session-") :])
+        except ValueError:
+            continue
+        # 実行中の別のエディタのジャーナルは除く
+        if pid == os.getpid() or _process_alive(pid):
+            continue
+        paths.append(os.path.join(directory, name))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
@@ -0,0 +1,282 @@
+"""画像の読み込み処理
+
+画面にすぐ表示するための縮小プレビューと、編集に使う元の解像度の画像を
+別々に読み込む。元の解像度のデコードはバックグラウンドのスレッドで行う。
+HEIC/HEIF の読み書き（pillow_heif）は、起動を速くするため初めて使う時に登録する。
+
+同じフォルダの前後の画像は DecodedCache がバックグラウンドで先読みし、
+デコードした画像をメモリの上限の範囲で保持する。
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, UnidentifiedImageError
+
+from history import image_nbytes
+from outofcore import is_large, is_mapped, map_image
+
+# pillow_heif で開く拡張子
+HEIF_EXTENSIONS = (".heic", ".heif", ".hif")
+
+# フォルダ内で画像として扱う拡張子
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png") + HEIF_EXTENSIONS
+
+# デコードした画像のキャッシュの既定の上限（バイト）
+DEFAULT_DECODED_CACHE_BYTES = 512 * 1024 * 1024
+
+_heif_lock = threading.Lock()
+_heif_registered = False
+
+
+def register_heif():
+    """pillow_heif を読み込んで HEIC/HEIF を扱えるようにする
+
+    登録できた（すでに登録済みの場合も含む）かどうかを返す。
+    """
+    global _heif_registered
+    with _heif_lock:
+        if not _heif_registered:
+            try:
+                import pillow_heif
+            except ImportError:
+                return False
+            pillow_heif.register_heif_opener()
+            _heif_registered = True
+    return True
+
+
+def open_image(file_path):
+    """画像を開く（HEIC/HEIF の場合は先に pillow_heif を登録する）"""
+    if os.path.splitext(file_path)[1].lower() in HEIF_EXTENSIONS:
+        register_heif()
+    try:
+        return Image.open(file_path)
+    except UnidentifiedImageError:
+        # 拡張子が違っていても HEIC/HEIF の可能性があるので、登録してから開き直す
+        if _heif_registered or not register_heif():
+            raise
+        return Image.open(file_path)
+
+
+def open_preview(file_path, size):
+    """縮小デコードしたプレビュー画像と元の画像サイズを返す
+
+    JPEG は draft() で DCT の段階で縮小しながらデコードできるため、
+    元の画像をすべてデコードするより大幅に速い。
+    縮小デコードできない形式の場合は None を返す。
+    """
+    with open_image(file_path) as image:
+        if image.format != "JPEG":
+            return None
+        full_size = image.size
+        image.draft("RGB", size)
+        if image.size == full_size:
+            return None
+        image.load()
+        return image.copy(), full_size
+
+
+def decode_image(file_path, max_pixels=None):
+    """元の解像度で画像をデコードし、(元画像, 編集用のコピー) を返す
+
+    画素数が max_pixels を超える場合は一時ファイルにマップした画像に
+    デコードし、複製は作らずに同じ画像を2つ返す（デコード中は一時的に
+    メモリ上にも画像全体を置く）。
+    """
+    original = open_image(file_path)
+    if max_pixels is not None and is_large(original.size, max_pixels):
+        with original:
+            mapped = map_image(original)
+        return mapped, mapped
+    original.load()
+    return original, original.copy()
+
+
+def folder_images(file_path):
+    """file_path と同じフォルダにある画像のパスを名前順に返す"""
+    return directory_images(os.path.dirname(os.path.abspath(file_path)))
+
+
+def directory_images(directory):
+    """フォルダにある画像のパスを名前順に返す"""
+    directory = os.path.abspath(directory)
+    names = sorted(os.listdir(directory), key=str.lower)
+    return [
+        os.path.join(directory, name)
+        for name in names
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+    ]
+
+
+def image_paths(paths):
+    """ファイルとフォルダのパスの一覧を、画像のパスの一覧にする
+
+    フォルダはその中の画像に展開し、画像でないファイルと重複は除く。
+    """
+    result = []
+    seen = set()
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            candidates = directory_images(path)
+        elif os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS:
+            candidates = [path]
+        else:
+            candidates = []
+        for candidate in candidates:
+            if candidate not in seen:
+                seen.add(candidate)
+                result.append(candidate)
+    return result
+
+
+def neighbours(paths, file_path, radius=1):
+    """paths の中の file_path の前後 radius 枚のパスを、近いものから順に返す"""
+    file_path = os.path.abspath(file_path)
+    if file_path not in paths:
+        return []
+    index = paths.index(file_path)
+    result = []
+    for distance in range(1, radius + 1):
+        for i in (index + distance, index - distance):
+            if 0 <= i < len(paths):
+                result.append(paths[i])
+    return result
+
+
+class DecodedCache:
+    """デコードした元の解像度の画像のLRUキャッシュ
+
+    合計バイト数が max_bytes を超えると、最も長く使われていない画像から破棄する。
+    prefetch() で指定した画像はバックグラウンドのスレッドでデコードしておく。
+    ファイルの更新日時が変わっていればデコードし直し、ディスク上で扱う
+    大きな画像はキャッシュしない。
+    """
+
+    def __init__(
+        self, max_bytes=DEFAULT_DECODED_CACHE_BYTES, max_pixels=None, workers=2
+    ):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.nbytes = 0
+        self._entries = OrderedDict()  # パス -> (更新日時, 元画像)
+        self._pending = {}  # 先読み中のパス -> Future
+        self._lock = threading.Lock()
+        self.workers = workers
+        self._executor = None  # 初めて先読みする時に作成する
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, file_path):
+        """キャッシュにある元画像を返す（ない場合は None）"""
+        file_path = os.path.abspath(file_path)
+        try:
+            mtime = os.path.getmtime(file_path)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is None or entry[0] != mtime:
+                return None
+            self._entries.move_to_end(file_path)
+            return entry[1]
+
+    def decode(self, file_path):
+        """(元画像, 編集用のコピー) を返す
+
+        キャッシュにあればその複製を返し、先読み中であれば完了を待つ。
+        """
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            future = self._pending.get(file_path)
+            # まだ始まっていない先読みは取り消して、このスレッドでデコードする
+            if future is not None and future.cancel():
+                del self._pending[file_path]
+                future = None
+        if future is not None:
+            # 先読みに失敗した場合は、下で改めてデコードしてエラーを伝える
+            future.exception()
+
+        image = self.get(file_path)
+        if image is not None:
+            return image, image.copy()
+
+        mtime = os.path.getmtime(file_path)
+        original, image = decode_image(file_path, self.max_pixels)
+        self.put(file_path, original, mtime)
+        return original, image
+
+    def put(self, file_path, image, mtime):
+        """元画像をキャッシュに追加（編集で書き換えない画像を渡すこと）"""
+        nbytes = image_nbytes(image)
+        if is_mapped(image) or nbytes > self.max_bytes:
+            return
+        file_path = os.path.abspath(file_path)
+        with self._lock:
+            if file_path in self._entries:
+                self.nbytes -= image_nbytes(self._entries.pop(file_path)[1])
+            self._entries[file_path] = (mtime, image)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+
+    def prefetch(self, file_paths):
+        """file_paths の画像をバックグラウンドで順にデコードしておく
+
+        以前に指定してまだ始まっていない先読みのうち、file_paths にないものは取り消す。
+        """
+        file_paths = [os.path.abspath(path) for path in file_paths]
+        with self._lock:
+            for path, future in list(self._pending.items()):
+                if path not in file_paths and future.cancel():
+                    del self._pending[path]
+        for path in file_paths:
+            if self.get(path) is not None:
+                continue
+            with self._lock:
+                if path not in self._pending:
+                    self._pending[path] = self._get_executor().submit(
+                        self._prefetch, path
+                    )
+
+    def _get_executor(self):
+        """先読みのスレッドプール（エディタの起動を速くするため、初めて使う時に作成）"""
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="prefetch"
+            )
+        return self._executor
+
+    def _prefetch(self, file_path):
+        try:
+            mtime = os.path.getmtime(file_path)
+            image = open_image(file_path)
+            if self.max_pixels is not None and is_large(image.size, self.max_pixels):
+                # ディスク上で扱う大きな画像は先読みしない
+                image.close()
+                return
+            image.load()
+            self.put(file_path, image, mtime)
+        finally:
+            with self._lock:
+                self._pending.pop(file_path, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def close(self):
+        """先読みを取り消してスレッドを終了させる"""
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
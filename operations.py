@@ -0,0 +1,165 @@
+"""画像の編集操作
+
+GUIとバッチ処理の両方から使う、Tkに依存しない編集操作。
+操作は {"op": "fill", "points": [[x, y], ...], "color": "white"}、
+{"op": "crop", "box": [left, top, right, bottom]}、
+{"op": "saturation", "value": 1.2} の形式の辞書でも表す。
+複数の多角形をまとめた塗りつぶしは
+{"op": "fill", "polygons": [{"points": [[x, y], ...], "color": "white"}, ...]} で表す。
+色調整は saturation のほかに brightness・contrast・gamma があり、
+連続する色調整は adjust.py でまとめて1回の走査で適用する。
+ディスク上の大きな画像（outofcore.py）は、複製や色調整の結果もディスク上に作る。
+"""
+
+from PIL import Image
+
+from adjust import apply_adjustments, is_adjustment
+from outofcore import adjust_mapped, is_mapped, map_image
+
+
+def polygon_bbox(points, size):
+    """多角形を囲む矩形を、画像の範囲内に収めて返す"""
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    width, height = size
+    return (
+        max(min(xs), 0),
+        max(min(ys), 0),
+        min(max(xs) + 1, width),
+        min(max(ys) + 1, height),
+    )
+
+
+def polygons_bbox(polygons, size):
+    """(頂点の一覧, 色) の一覧のすべての多角形を囲む矩形を返す"""
+    boxes = [polygon_bbox(points, size) for points, _ in polygons]
+    return (
+        min(box[0] for box in boxes),
+        min(box[1] for box in boxes),
+        max(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+
+
+def fill_polygon(image, points, color):
+    """多角形を塗りつぶし（画像はその場で書き換える）、変更された範囲を返す"""
+    # ImageDraw はフォント関連のモジュールも読み込むため、初めて塗りつぶす時に読み込む
+    from PIL import ImageDraw
+
+    box = polygon_bbox(points, image.size)
+    ImageDraw.Draw(image).polygon(points, fill=color)
+    return box
+
+
+def fill_polygons(image, polygons):
+    """(頂点の一覧, 色) の一覧の多角形を順に塗りつぶし（画像はその場で書き換える）、
+    変更された範囲を返す
+
+    多角形はすべてを囲む矩形の大きさのレイヤーとマスクに描き、
+    画像には1回の貼り付けで合成する（1つずつ塗りつぶした場合と同じ結果になる）。
+    多角形が1つの場合と、ディスク上の画像（メモリ上にレイヤーを作らない）と、
+    パレットの画像（色名の色をレイヤーではなく画像のパレットに加える）には
+    直接描く。
+    """
+    from PIL import ImageDraw
+
+    box = polygons_bbox(polygons, image.size)
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return box
+    if len(polygons) == 1 or is_mapped(image) or image.mode in ("P", "PA"):
+        draw = ImageDraw.Draw(image)
+        for points, color in polygons:
+            draw.polygon(points, fill=color)
+        return box
+    size = (box[2] - box[0], box[3] - box[1])
+    layer = Image.new(image.mode, size)
+    mask = Image.new("L", size)
+    layer_draw = ImageDraw.Draw(layer)
+    mask_draw = ImageDraw.Draw(mask)
+    for points, color in polygons:
+        shifted = [(x - box[0], y - box[1]) for x, y in points]
+        layer_draw.polygon(shifted, fill=color)
+        mask_draw.polygon(shifted, fill=255)
+    image.paste(layer, box[:2], mask)
+    return box
+
+
+def fill_operation(polygons):
+    """(頂点の一覧, 色) の一覧を塗りつぶしの操作の辞書にする"""
+    if len(polygons) == 1:
+        points, color = polygons[0]
+        return {"op": "fill", "points": [list(p) for p in points], "color": color}
+    return {
+        "op": "fill",
+        "polygons": [
+            {"points": [list(p) for p in points], "color": color}
+            for points, color in polygons
+        ],
+    }
+
+
+def operation_polygons(operation):
+    """塗りつぶしの操作の辞書を (頂点の一覧, 色) の一覧にする"""
+    if "polygons" in operation:
+        return [
+            ([tuple(p) for p in polygon["points"]], polygon.get("color", "white"))
+            for polygon in operation["polygons"]
+        ]
+    return [([tuple(p) for p in operation["points"]], operation.get("color", "white"))]
+
+
+def crop_image(image, box):
+    """画像をトリミング"""
+    if is_mapped(image):
+        return map_image(image, box)
+    return image.crop(box)
+
+
+def adjust_saturation(image, value):
+    """彩度を調整した画像を返す（1.0の場合は元の画像をそのまま返す）"""
+    return adjust_image(image, [{"op": "saturation", "value": value}])
+
+
+def adjust_image(image, operations):
+    """色調整の操作の列をまとめて適用した画像を返す"""
+    if is_mapped(image):
+        return adjust_mapped(image, operations)
+    return apply_adjustments(image, operations)
+
+
+def apply_operation(image, operation):
+    """辞書で表した操作を適用した画像を返す"""
+    op = operation["op"]
+    if op == "fill":
+        if "polygons" in operation:
+            fill_polygons(image, operation_polygons(operation))
+            return image
+        points = [tuple(point) for point in operation["points"]]
+        fill_polygon(image, points, operation.get("color", "white"))
+        return image
+    if op == "crop":
+        return crop_image(image, tuple(operation["box"]))
+    if is_adjustment(operation):
+        return adjust_image(image, [operation])
+    raise ValueError(f"未知の操作です: {op}")
+
+
+def apply_operations(image, operations):
+    """操作の一覧を順に適用した画像を返す（連続する色調整はまとめて適用）"""
+    for group in group_operations(operations):
+        if is_adjustment(group[0]):
+            image = adjust_image(image, group)
+        else:
+            image = apply_operation(image, group[0])
+    return image
+
+
+def group_operations(operations):
+    """連続する色調整を1つのグループにまとめた、操作のリストのリストを返す"""
+    groups = []
+    for operation in operations:
+        if groups and is_adjustment(operation) and is_adjustment(groups[-1][-1]):
+            groups[-1].append(operation)
+        else:
+            groups.append([operation])
+    return groups
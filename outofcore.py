@@ -0,0 +1,205 @@
+"""大きな画像のディスク上での処理（アウトオブコア）
+
+画素数が DEFAULT_MAX_PIXELS を超える画像は、元画像・編集中の画像・履歴の
+キーフレームなどの複製をメモリ上に持つとメモリが足りなくなるため、
+一時ファイルにマップした生の画素データ（RGBA）として扱う。
+
+map_image() が返す画像は Pillow の Image として普通に使え、塗りつぶしや
+貼り付けは一時ファイル上の画素を直接書き換える。メモリには OS が必要な
+部分だけを読み込む。複製・色調整・保存のように画像全体に及ぶ処理は
+STRIP_ROWS 行ずつの帯に分けて行い、メモリ上には帯1つ分だけを置く。
+"""
+
+import mmap
+import struct
+import tempfile
+import weakref
+import zlib
+
+from PIL import Image, ImageStat
+
+from adjust import apply_adjustments, channel_lut
+
+# この画素数を超える画像はディスク上で扱う
+DEFAULT_MAX_PIXELS = 100_000_000
+
+# 一度に処理する行数
+STRIP_ROWS = 256
+
+# ディスク上の画像の id と、その画素データをマップしたバッファ
+# （Image はハッシュできないため id をキーにし、画像が破棄されたら取り除く）
+_buffers = {}
+
+
+def is_large(size, max_pixels=DEFAULT_MAX_PIXELS):
+    """ディスク上で扱うべき大きさの画像かどうか"""
+    return size[0] * size[1] > max_pixels
+
+
+def is_mapped(image):
+    """一時ファイルにマップした画像かどうか"""
+    return _buffers.get(id(image)) is not None
+
+
+def new_mapped(size, directory=None):
+    """一時ファイルにマップした、書き換え可能な RGBA の空の画像を返す"""
+    width, height = size
+    with tempfile.TemporaryFile(dir=directory) as f:
+        f.truncate(width * height * 4)
+        # マップした後はファイルを閉じても、マップが解放されるまで残る
+        buffer = mmap.mmap(f.fileno(), width * height * 4)
+    image = Image.frombuffer("RGBA", size, buffer, "raw", "RGBA", 0, 1)
+    # frombuffer() の画像は読み取り専用なので、書き込みも直接バッファに反映させる
+    image.readonly = 0
+    _buffers[id(image)] = buffer
+    weakref.finalize(image, _buffers.pop, id(image), None)
+    return image
+
+
+def iter_strips(image, box=None):
+    """画像の box の範囲を上から STRIP_ROWS 行ずつ (上端の行, 帯の画像) で返す"""
+    left, top, right, bottom = box or (0, 0) + image.size
+    for strip_top in range(top, bottom, STRIP_ROWS):
+        strip_bottom = min(strip_top + STRIP_ROWS, bottom)
+        yield strip_top - top, image.crop((left, strip_top, right, strip_bottom))
+
+
+def map_image(image, box=None, directory=None):
+    """画像（の box の範囲）を一時ファイルにマップした画像に複製"""
+    box = box or (0, 0) + image.size
+    mapped = new_mapped((box[2] - box[0], box[3] - box[1]), directory)
+    for top, strip in iter_strips(image, box):
+        mapped.paste(strip.convert("RGBA"), (0, top))
+    return mapped
+
+
+def copy_image(image):
+    """画像の複製（ディスク上の画像はディスク上に複製する）"""
+    if is_mapped(image):
+        return map_image(image)
+    return image.copy()
+
+
+def luminance_mean(image):
+    """画像の輝度の平均（ImageEnhance.Contrast の基準値）を帯ごとに計算"""
+    total = 0
+    for _, strip in iter_strips(image):
+        total += ImageStat.Stat(strip.convert("L")).sum[0]
+    return int(total / (image.width * image.height) + 0.5)
+
+
+def adjust_mapped(image, operations):
+    """ディスク上の画像に色調整をまとめて適用し、新たなディスク上の画像を返す
+
+    コントラストの基準値は画像全体の輝度から求めるため、コントラストの
+    手前で区切り、区間ごとに画像全体を1回ずつ走査する。
+    何も変わらない場合は image をそのまま返す。
+    """
+    if all(float(operation["value"]) == 1.0 for operation in operations):
+        return image
+
+    segments = []
+    for operation in operations:
+        if not segments or operation["op"] == "contrast":
+            segments.append([])
+        segments[-1].append(operation)
+
+    output = None
+    for segment in segments:
+        source = image if output is None else output
+        lut = None
+        if segment[0]["op"] == "contrast":
+            value = float(segment.pop(0)["value"])
+            mean = luminance_mean(source)
+            lut = channel_lut("contrast", value, mean) * 3 + list(range(256))
+
+        if output is None:
+            output = new_mapped(image.size)
+        for top, strip in iter_strips(source):
+            if lut is not None:
+                strip = strip.point(lut)
+            output.paste(apply_adjustments(strip, segment), (0, top))
+    return output
+
+
+def is_opaque(image):
+    """アルファチャンネルがすべて不透明かどうか"""
+    for _, strip in iter_strips(image):
+        if strip.getchannel("A").getextrema()[0] < 255:
+            return False
+    return True
+
+
+def write_image(image, f, format, **params):
+    """ディスク上の画像を、帯ごとに読み出しながら f に書き出す
+
+    元の画像に透明な部分がなければ RGB として保存する。HEIF のエンコーダは
+    画像全体を必要とするため、HEIF の場合だけはメモリ上に変換した画像を作る。
+    """
+    if format == "PNG":
+        write_png(image, f, params.get("compress_level", 6), not is_opaque(image))
+    elif format == "JPEG":
+        # 同じバッファを RGBX として読めば、複製せずに RGB として保存できる
+        view = Image.frombuffer(
+            "RGBX", image.size, _buffers[id(image)], "raw", "RGBX", 0, 1
+        )
+        view.save(f, format=format, **params)
+    else:
+        mode = "RGB" if is_opaque(image) else "RGBA"
+        image.convert(mode).save(f, format=format, **params)
+
+
+def write_png(image, f, compress_level=6, alpha=True):
+    """画像を帯ごとに圧縮しながら PNG として書き出す"""
+    width, height = image.size
+    mode, color_type = ("RGBA", 6) if alpha else ("RGB", 2)
+    stride = width * len(mode)
+
+    f.write(b"\x89PNG\r\n\x1a\n")
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    write_chunk(f, b"IHDR", header)
+
+    compressor = zlib.compressobj(compress_level)
+    for _, strip in iter_strips(image):
+        data = strip.convert(mode).tobytes()
+        # 各行の先頭にフィルタの種類（0: フィルタなし）を付ける
+        rows = b"".join(
+            b"\x00" + data[i : i + stride] for i in range(0, len(data), stride)
+        )
+        compressed = compressor.compress(rows)
+        if compressed:
+            write_chunk(f, b"IDAT", compressed)
+    write_chunk(f, b"IDAT", compressor.flush())
+    write_chunk(f, b"IEND", b"")
+
+
+def write_chunk(f, chunk_type, data):
+    """PNG のチャンクを書き出す"""
+    f.write(struct.pack(">I", len(data)))
+    f.write(chunk_type)
+    f.write(data)
+    f.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
+class MappedKeyframes:
+    """履歴のキーフレームを一時ファイルに置くストア
+
+    History の keyframe_store に指定すると、キーフレームをメモリ上で
+    圧縮する代わりに、ディスク上の画像として複製する。
+    """
+
+    def __init__(self):
+        self.disk_bytes = 0
+
+    def put(self, image):
+        stored = map_image(image)
+        self.disk_bytes += stored.width * stored.height * 4
+        return stored
+
+    def get(self, stored):
+        """キーフレームの書き換え可能な複製を返す"""
+        return map_image(stored)
+
+    def discard(self, stored):
+        # マップは参照がなくなった時点で解放される
+        self.disk_bytes -= stored.width * stored.height * 4
@@ -0,0 +1,134 @@
+"""編集結果の描画パイプライン
+
+編集は操作（operations.py の辞書）の列として扱う。塗りつぶしやトリミングの
+ように画素を書き換える操作は History が差分として保持し、その後に続く
+鮮やかさなどの調整操作は元の画像を変更せずに、描画のたびに適用する。
+調整操作の途中結果は「履歴の状態 + そこまでの操作の列」をキーとして
+キャッシュするため、後ろの操作を変えた場合はそれ以降だけを計算し直す。
+連続する色調整はまとめて適用し、その最後の結果だけをキャッシュする。
+"""
+
+import json
+from collections import OrderedDict
+
+from history import image_nbytes
+from adjust import is_adjustment
+from operations import adjust_image, apply_operation, group_operations
+from outofcore import copy_image
+
+# 途中結果のキャッシュの既定の上限（バイト）
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+
+def operation_key(operation):
+    """操作を辞書のキーとして使える文字列に変換"""
+    return json.dumps(operation, sort_keys=True)
+
+
+class PrefixCache:
+    """操作の途中結果を保持するLRUキャッシュ
+
+    合計バイト数（max_bytes）と件数（max_entries）で上限を設け、
+    get で取り出した時のヒット/ミスの回数を数える。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        image = self._entries.get(key)
+        if image is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return image
+
+    def peek(self, key):
+        """ヒット/ミスを数えずに取り出す（計算し直すかどうかの判断に使う）"""
+        image = self._entries.get(key)
+        if image is not None:
+            self._entries.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if key in self._entries:
+            self.nbytes -= image_nbytes(self._entries.pop(key))
+        self._entries[key] = image
+        self.nbytes += image_nbytes(image)
+
+        # 上限を超えたら最も長く使われていないものから破棄（最新の1件は残す）
+        while len(self._entries) > 1 and (
+            self.nbytes > self.max_bytes
+            or (self.max_entries is not None and len(self._entries) > self.max_entries)
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= image_nbytes(evicted)
+
+    def holds(self, image):
+        """指定した画像を値に持つ項目があるか"""
+        return any(value is image for value in self._entries.values())
+
+    def discard_image(self, image):
+        """指定した画像を値に持つ項目を破棄（画像をその場で書き換える前に使う）"""
+        for key in [k for k, v in self._entries.items() if v is image]:
+            del self._entries[key]
+            self.nbytes -= image_nbytes(image)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+def prefix_keys(state_key, operations):
+    """各操作までの途中結果のキーを返す"""
+    keys = []
+    prefix = (state_key,)
+    for operation in operations:
+        prefix += (operation_key(operation),)
+        keys.append(prefix)
+    return keys
+
+
+def render(cache, state_key, base, operations):
+    """base に operations を順に適用した結果を返す
+
+    キャッシュにある最も長い途中結果から計算を再開し、
+    新たに計算した途中結果はキャッシュに追加する。
+    """
+    keys = prefix_keys(state_key, operations)
+
+    # キャッシュにある最も長い途中結果を探す
+    # （ヒット/ミスは1回の描画につき1回、最終結果のキーで数える）
+    image = base
+    start = 0
+    for i in range(len(keys) - 1, -1, -1):
+        cached = cache.get(keys[i]) if i == len(keys) - 1 else cache.peek(keys[i])
+        if cached is not None:
+            image, start = cached, i + 1
+            break
+
+    for group in group_operations(operations[start:]):
+        start += len(group)
+        previous = image
+        if is_adjustment(group[0]):
+            image = adjust_image(image, group)
+        else:
+            # その場で書き換える操作は、元の画像やキャッシュを壊さないよう複製に適用
+            if group[0]["op"] == "fill":
+                image = copy_image(image)
+            image = apply_operation(image, group[0])
+        # 何も変わらない操作（鮮やかさ 1.0 など）の結果は保存しない
+        if image is not previous:
+            cache.put(keys[start - 1], image)
+    return image
@@ -0,0 +1,181 @@
+"""処理時間の計測
+
+エディタの主な処理（読み込み・表示・鮮やかさ・塗りつぶし・トリミング・
+元に戻す/やり直す・保存）の1回ごとの処理時間を、一定件数のリングバッファに
+記録する。処理の中のデコード・縮小・PhotoImage への変換・色調整・
+エンコードも別の区間として記録するため、どこに時間がかかっているかが分かる。
+
+記録は Chrome のトレース形式（JSON）で保存でき、chrome://tracing や
+speedscope で開ける。
+
+メモリの計測を有効にすると、tracemalloc で各区間の前後で増えたメモリを
+記録する。Python と NumPy が確保したメモリは含むが、Pillow が内部で
+確保する画像のメモリは含まない。
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# 記録する区間の既定の件数
+DEFAULT_CAPACITY = 4096
+
+
+class Span:
+    """計測した1つの区間"""
+
+    __slots__ = ("name", "start", "duration", "thread", "allocated")
+
+    def __init__(self, name, start, duration, thread, allocated=None):
+        self.name = name
+        self.start = start  # time.perf_counter() の値
+        self.duration = duration  # 秒
+        self.thread = thread  # (スレッドID, スレッド名)
+        self.allocated = allocated  # 区間の前後で増えたバイト数（計測しない場合は None）
+
+
+class Profiler:
+    """区間ごとの処理時間をリングバッファに記録する
+
+    記録はバックグラウンドのスレッドからも行える。
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, epoch=None):
+        self.spans = deque(maxlen=capacity)
+        # トレースの時刻の基準（time.perf_counter() の値）
+        self.epoch = time.perf_counter() if epoch is None else epoch
+        self.track_memory = False
+
+    def set_track_memory(self, enabled):
+        """tracemalloc によるメモリの計測を切り替える"""
+        self.track_memory = enabled
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not enabled and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def span(self, name):
+        """with 文の中の処理時間を name として記録するコンテキストマネージャ"""
+        return _SpanContext(self, name)
+
+    def record(self, name, start, end, allocated=None):
+        thread = threading.current_thread()
+        self.spans.append(
+            Span(
+                name,
+                start,
+                end - start,
+                (thread.ident, thread.name),
+                allocated,
+            )
+        )
+
+    def summary(self):
+        """区間の名前ごとの (回数, 直近の秒数, 平均の秒数, 直近の増えたバイト数)"""
+        result = {}
+        for span in list(self.spans):
+            count, _, total, _ = result.get(span.name, (0, 0, 0, None))
+            result[span.name] = (
+                count + 1,
+                span.duration,
+                total + span.duration,
+                span.allocated,
+            )
+        return {
+            name: (count, last, total / count, allocated)
+            for name, (count, last, total, allocated) in result.items()
+        }
+
+    def chrome_trace(self):
+        """記録を Chrome のトレース形式の辞書に変換"""
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in list(self.spans):
+            tid, thread_name = span.thread
+            threads[tid] = thread_name
+            event = {
+                "name": span.name,
+                "ph": "X",
+                "ts": (span.start - self.epoch) * 1_000_000,
+                "dur": span.duration * 1_000_000,
+                "pid": pid,
+                "tid": tid,
+            }
+            if span.allocated is not None:
+                event["args"] = {"allocated": span.allocated}
+            events.append(event)
+        for tid, thread_name in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_trace(self, path):
+        """記録を Chrome のトレース形式で保存"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def clear(self):
+        self.spans.clear()
+
+
+class _SpanContext:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.memory = self.profiler.track_memory and tracemalloc.is_tracing()
+        if self.memory:
+            self.before = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        allocated = None
+        if self.memory and tracemalloc.is_tracing():
+            allocated = tracemalloc.get_traced_memory()[0] - self.before
+        self.profiler.record(self.name, self.start, end, allocated)
+        return False
+
+
+def profiled(method):
+    """メソッドの処理時間を self.profiler にメソッド名で記録するデコレータ"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.profiler.span(method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def format_spans(spans):
+    """区間の一覧を、名前と処理時間の複数行の文字列にする"""
+    width = max((len(span.name) for span in spans), default=0)
+    return "\n".join(
+        f"{span.name:<{width}} {span.duration * 1000:8.1f}ms" for span in spans
+    )
+
+
+def format_summary(summary):
+    """summary() を、処理時間の表示に使う複数行の文字列にする"""
+    lines = []
+    for name, (count, last, average, allocated) in sorted(summary.items()):
+        line = f"{name}: {last * 1000:.1f}ms (平均 {average * 1000:.1f}ms, {count}回)"
+        if allocated is not None:
+            line += f" {allocated / 1024 / 1024:+.1f}MB"
+        lines.append(line)
+    return "\n".join(lines)
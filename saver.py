@@ -0,0 +1,68 @@
+"""画像の保存処理
+
+保存はバックグラウンドのスレッドから呼ばれることを前提とし、
+同じフォルダの一時ファイルに書き出してから置き換えることで、
+保存中に異常終了しても既存のファイルを壊さないようにする。
+ディスク上の大きな画像（outofcore.py）は、帯ごとに読み出しながら書き出す。
+"""
+
+import os
+import stat
+import tempfile
+
+from loader import register_heif
+from outofcore import is_mapped, write_image
+
+
+def _read_umask():
+    # umask はプロセス全体の設定で、読むには一度変更する必要があるため、
+    # 保存のスレッドが動き出す前（読み込み時）に1回だけ読む
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+_UMASK = _read_umask()
+
+
+def file_mode(file_path):
+    """置き換えるファイルに付けるパーミッション
+
+    既存のファイルがあればそのパーミッションを引き継ぎ、なければ
+    通常のファイルの作成と同じ 0o666 から umask を除いたものにする
+    （mkstemp の一時ファイルは 0o600 で作成されるため）。
+    """
+    try:
+        return stat.S_IMODE(os.stat(file_path).st_mode)
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+def convert_for_format(image, format):
+    """保存形式が扱えるモードに画像を変換"""
+    # JPEGは透明度を扱えないのでRGBに変換
+    if format == "JPEG" and image.mode == "RGBA":
+        return image.convert("RGB")
+    return image
+
+
+def save_atomic(image, file_path, format, **params):
+    """一時ファイルに書き出してから file_path に置き換える"""
+    if format == "HEIF":
+        register_heif()
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if is_mapped(image):
+                write_image(image, f, format, **params)
+            else:
+                convert_for_format(image, format).save(f, format=format, **params)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, file_mode(file_path))
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
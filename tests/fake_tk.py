@@ -0,0 +1,228 @@
+"""画面を表示せずにエディタを動かすための、tkinter と tkinterdnd2 の代役
+
+root.after で予約した処理は仮想の時計で順に実行する（pump）。ダイアログは
+dialogs に設定した値を返し、呼び出しを calls に記録する。
+"""
+
+import heapq
+import itertools
+import re
+import sys
+import time
+import types
+
+# 代役のモジュールを読み込ませるため、テストの後で読み込み直すモジュール
+GUI_MODULES = ["hello", "filmstrip"]
+
+_ids = itertools.count(1)
+
+
+class Loop:
+    """root.after で予約した処理を仮想の時計で実行するイベントループ"""
+
+    def __init__(self):
+        self.events = []  # (予定の時刻, 順番, ID, 処理, 引数)
+        self.cancelled = set()
+        self.clock = 0.0
+        self.order = itertools.count()
+        self.dialogs = {}  # ダイアログの名前: 返す値
+        self.calls = []  # 呼び出されたダイアログの名前
+
+    def after(self, ms, func, *args):
+        after_id = f"after#{next(_ids)}"
+        due = self.clock + ms / 1000
+        heapq.heappush(self.events, (due, next(self.order), after_id, func, args))
+        return after_id
+
+    def pump(self, seconds=1.0, until=None):
+        """seconds 秒分の予約した処理を実行する（until が真になったら止める）
+
+        バックグラウンドのスレッドが進むよう、待ち時間は実際にも少し待つ。
+        """
+        end = self.clock + seconds
+        while self.events:
+            if until is not None and until():
+                return True
+            due, _, after_id, func, args = self.events[0]
+            if due > end:
+                break
+            heapq.heappop(self.events)
+            if after_id in self.cancelled:
+                continue
+            if due > self.clock:
+                time.sleep(min(due - self.clock, 0.05))
+                self.clock = due
+            func(*args)
+        self.clock = max(self.clock, end)
+        return until() if until else False
+
+    def dialog(self, name):
+        def show(*args, **kwargs):
+            self.calls.append(name)
+            return self.dialogs.get(name)
+
+        return show
+
+
+class TkProxy:
+    def splitlist(self, data):
+        return [a or b for a, b in re.findall(r"\{([^}]*)\}|(\S+)", data)]
+
+    def call(self, *args):
+        return ""
+
+
+def widget_class(name, loop):
+    def __init__(self, *args, **kwargs):
+        self.options = dict(kwargs)
+        self.tk = TkProxy()
+        self.bindings = {}
+        self.mapped = False
+
+    def __getattr__(self, attr):
+        return lambda *args, **kwargs: None
+
+    def config(self, **kwargs):
+        self.options.update(kwargs)
+
+    def bind(self, sequence, func=None, add=None):
+        self.bindings[sequence] = func
+
+    def unbind(self, sequence, funcid=None):
+        self.bindings.pop(sequence, None)
+
+    def create_item(self, *args, **kwargs):
+        return next(_ids)
+
+    def after(self, ms, func=None, *args):
+        return loop.after(ms, func, *args) if func is not None else None
+
+    def title(self, text=None):
+        if text is not None:
+            self.options["title"] = text
+        return self.options.get("title")
+
+    def pack(self, *args, **kwargs):
+        self.mapped = True
+
+    def pack_forget(self):
+        self.mapped = False
+
+    namespace = {
+        "__init__": __init__,
+        "__getattr__": __getattr__,
+        "config": config,
+        "configure": config,
+        "cget": lambda self, key: self.options.get(key),
+        "bind": bind,
+        "unbind": unbind,
+        "after": after,
+        "after_idle": lambda self, func, *args: loop.after(0, func, *args),
+        "after_cancel": lambda self, after_id: loop.cancelled.add(after_id),
+        "title": title,
+        "pack": pack,
+        "pack_forget": pack_forget,
+        "winfo_ismapped": lambda self: self.mapped,
+        "winfo_width": lambda self: 800,
+        "winfo_height": lambda self: 600,
+        "canvasx": lambda self, x: x,
+        "canvasy": lambda self, y: y,
+    }
+    for kind in ["image", "line", "oval", "polygon", "rectangle", "text"]:
+        namespace[f"create_{kind}"] = create_item
+    return type(name, (), namespace)
+
+
+class Variable:
+    def __init__(self, master=None, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class PhotoImage:
+    def __init__(self, image=None, **kwargs):
+        self.size = image.size if image is not None else (0, 0)
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def paste(self, image, box=None):
+        pass
+
+
+def scale_class(loop):
+    base = widget_class("Scale", loop)
+
+    def set(self, value):
+        changed = value != self.value
+        self.value = value
+        command = self.options.get("command")
+        # Tk も set() の -command はイベントループから呼び出す
+        if changed and command:
+            loop.after(0, command, str(value))
+
+    return type("Scale", (base,), {"value": 0.0, "set": set, "get": lambda s: s.value})
+
+
+def install(monkeypatch):
+    """tkinter・tkinterdnd2・PIL.ImageTk を代役に差し替え、Loop を返す"""
+    import PIL
+
+    loop = Loop()
+    tk = types.ModuleType("tkinter")
+    for name in ["Frame", "Canvas", "Button", "Label", "Menu", "Scrollbar", "Toplevel"]:
+        setattr(tk, name, widget_class(name, loop))
+    tk.Scale = scale_class(loop)
+    tk.BooleanVar = tk.StringVar = tk.IntVar = tk.DoubleVar = Variable
+    tk.TclError = type("TclError", (Exception,), {})
+    for const in [
+        "BOTH", "BOTTOM", "TOP", "LEFT", "RIGHT", "X", "Y", "NW", "RAISED",
+        "HORIZONTAL", "VERTICAL", "NORMAL", "DISABLED", "END",
+    ]:  # fmt: skip
+        setattr(tk, const, const.lower())
+
+    submodules = {
+        "filedialog": ["askopenfilename", "asksaveasfilename"],
+        "colorchooser": ["askcolor"],
+        "messagebox": [
+            "showinfo", "showerror", "showwarning",
+            "askyesno", "askokcancel", "askyesnocancel",
+        ],  # fmt: skip
+        "simpledialog": ["askinteger"],
+    }
+    for name, dialogs in submodules.items():
+        module = types.ModuleType(f"tkinter.{name}")
+        for dialog in dialogs:
+            setattr(module, dialog, loop.dialog(dialog))
+        setattr(tk, name, module)
+        monkeypatch.setitem(sys.modules, f"tkinter.{name}", module)
+    tk.ttk = types.ModuleType("tkinter.ttk")
+    tk.ttk.Progressbar = widget_class("Progressbar", loop)
+    monkeypatch.setitem(sys.modules, "tkinter.ttk", tk.ttk)
+    monkeypatch.setitem(sys.modules, "tkinter", tk)
+
+    dnd = types.ModuleType("tkinterdnd2")
+    dnd.TkinterDnD = types.SimpleNamespace(Tk=widget_class("Tk", loop))
+    dnd.DND_FILES = "DND_Files"
+    monkeypatch.setitem(sys.modules, "tkinterdnd2", dnd)
+    imagetk = types.ModuleType("PIL.ImageTk")
+    imagetk.PhotoImage = PhotoImage
+    monkeypatch.setitem(sys.modules, "PIL.ImageTk", imagetk)
+    monkeypatch.setattr(PIL, "ImageTk", imagetk, raising=False)
+
+    for name in GUI_MODULES:
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    return loop
+
+
+class Event:
+    def __init__(self, **kwargs):
+        self.__dict__.update(dict(x=0, y=0, delta=0, num=0, data=""), **kwargs)
@@ -0,0 +1,68 @@
+"""batch.py のテスト"""
+
+import json
+import os
+
+from PIL import Image
+
+import batch
+
+RECIPE = {
+    "*": [{"op": "fill", "points": [[0, 0], [20, 0], [0, 20]], "color": "red"}],
+    "b.png": [{"op": "crop", "box": [0, 0, 16, 16]}],
+}
+
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def setup_folders(tmp_path):
+    input_dir = os.path.join(tmp_path, "in")
+    output_dir = os.path.join(tmp_path, "out")
+    os.makedirs(input_dir)
+    for name in ["a.png", "b.png"]:
+        Image.new("RGB", (32, 24), "gray").save(os.path.join(input_dir, name))
+    # 読み込めない画像（1回目は失敗する）
+    with open(os.path.join(input_dir, "c.png"), "wb") as f:
+        f.write(b"not an image")
+    recipe = os.path.join(tmp_path, "recipe.json")
+    with open(recipe, "w", encoding="utf-8") as f:
+        json.dump(RECIPE, f)
+    return input_dir, output_dir, recipe
+
+
+def test_resume_skips_files_done_in_manifest(tmp_path):
+    input_dir, output_dir, recipe = setup_folders(tmp_path)
+    argv = [input_dir, output_dir, "--recipe", recipe, "--workers", "1"]
+
+    assert batch.main(argv) == 1
+    manifest = os.path.join(output_dir, "manifest.jsonl")
+    first = {record["file"]: record["status"] for record in read_records(manifest)}
+    assert first == {"a.png": "ok", "b.png": "ok", "c.png": "error"}
+    with Image.open(os.path.join(output_dir, "a.png")) as image:
+        assert image.getpixel((1, 1)) == (255, 0, 0)
+    with Image.open(os.path.join(output_dir, "b.png")) as image:
+        assert image.size == (16, 16)
+
+    # 失敗した画像を直して再実行すると、その画像だけを処理する
+    Image.new("RGB", (32, 24), "gray").save(os.path.join(input_dir, "c.png"))
+    mtime = os.path.getmtime(os.path.join(output_dir, "a.png"))
+    assert batch.main(argv) == 0
+
+    records = read_records(manifest)
+    assert [record["file"] for record in records[3:]] == ["c.png"]
+    assert records[3]["status"] == "ok"
+    assert os.path.getmtime(os.path.join(output_dir, "a.png")) == mtime
+    assert batch.read_manifest(manifest) == {"a.png", "b.png", "c.png"}
+
+
+def test_unreadable_recipe_exits_with_message(tmp_path, capsys):
+    input_dir, output_dir, recipe = setup_folders(tmp_path)
+    with open(recipe, "w", encoding="utf-8") as f:
+        json.dump([{"op": "fill"}], f)
+
+    assert batch.main([input_dir, output_dir, "--recipe", recipe]) == 2
+    assert "レシピを読み込めません" in capsys.readouterr().err
+    assert not os.path.exists(output_dir)
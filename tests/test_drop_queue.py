@@ -0,0 +1,72 @@
+"""ドロップした画像を順に編集して保存する流れのテスト（画面は表示しない）"""
+
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+import fake_tk
+from fake_tk import Event
+
+
+@pytest.fixture
+def editor(tmp_path, monkeypatch):
+    """代役の tkinter で作ったエディタと、そのイベントループ"""
+    monkeypatch.setenv("XDG_CACHE_HOME", os.path.join(tmp_path, "cache"))
+    monkeypatch.setenv("XDG_CONFIG_HOME", os.path.join(tmp_path, "config"))
+    loop = fake_tk.install(monkeypatch)
+    import hello
+
+    app = hello.ImageEditor(hello.TkinterDnD.Tk())
+    yield app, loop
+    app.journal.close()
+    for name in fake_tk.GUI_MODULES:
+        sys.modules.pop(name, None)
+
+
+def drop_images(app, loop, tmp_path):
+    paths = []
+    for name in ["a.jpg", "b.jpg", "c.jpg"]:
+        path = os.path.join(tmp_path, name)
+        Image.new("RGB", (320, 240), "blue").save(path)
+        paths.append(path)
+    app.handle_drop(Event(data=" ".join(paths)))
+    assert loop.pump(5, lambda: app.image_loaded and not app.loading)
+    return paths
+
+
+def fill_triangle(app):
+    for x, y in [(10, 10), (100, 10), (50, 90)]:
+        x, y = app.to_display_coords(x, y)
+        app.add_point(Event(x=x, y=y))
+    app.fill_area(Event(x=x, y=y))
+
+
+def save(app, loop, path):
+    loop.dialogs["asksaveasfilename"] = path
+    app.save_image()
+    loop.pump(5, lambda: not app.save_threads)
+    loop.pump(5, lambda: not app.loading)
+
+
+def test_failed_save_keeps_edits_and_stays_on_image(editor, tmp_path):
+    app, loop = editor
+    paths = drop_images(app, loop, tmp_path)
+    fill_triangle(app)
+    assert app.history.can_undo()
+
+    save(app, loop, os.path.join(tmp_path, "missing", "a.png"))
+
+    assert "showerror" in loop.calls
+    assert app.file_path == paths[0]
+    assert app.history.can_undo()
+    assert app.unsaved_changes
+    assert app.history.current.getpixel((50, 30)) == (255, 255, 255)
+
+    # 保存できたら次の画像に進む
+    save(app, loop, os.path.join(tmp_path, "a.png"))
+
+    assert os.path.exists(os.path.join(tmp_path, "a.png"))
+    assert app.file_path == paths[1]
+    assert not app.unsaved_changes
@@ -0,0 +1,84 @@
+"""history.py のテスト"""
+
+from PIL import Image
+
+from history import History
+from operations import crop_image, fill_operation, fill_polygons, polygons_bbox
+
+EDITS = [
+    ("fill", [([(10, 10), (120, 20), (40, 90)], "white")]),
+    ("fill", [([(60, 40), (150, 50), (100, 110)], "red")]),
+    ("crop", (8, 6, 150, 112)),
+    (
+        "fill",
+        [
+            ([(5, 5), (60, 30), (20, 80)], "blue"),
+            ([(70, 70), (130, 60), (90, 100)], "green"),
+        ],
+    ),
+    ("crop", (4, 4, 120, 96)),
+    ("fill", [([(0, 0), (115, 10), (50, 90)], "yellow")]),
+]
+
+
+def noise_image():
+    """圧縮しても小さくならない画像（メモリ予算を確実に超えさせる）"""
+    bands = [Image.effect_noise((160, 120), 64) for _ in range(3)]
+    return Image.merge("RGB", bands)
+
+
+def apply_edit(history, edit):
+    kind, value = edit
+    if kind == "crop":
+        history.record_crop(value, crop_image(history.current, value))
+        return
+    base = history.current
+    box = polygons_bbox(value, base.size)
+    before = base.crop(box)
+    fill_polygons(base, value)
+    history.record_patch(box, before, base.crop(box), fill_operation(value))
+
+
+def test_undo_redo_rebuild_round_trip_spilled_to_disk():
+    history = History(noise_image(), keyframe_interval=2, memory_budget=1)
+    states = [history.current.tobytes()]
+    sizes = [history.current.size]
+    for edit in EDITS:
+        apply_edit(history, edit)
+        states.append(history.current.tobytes())
+        sizes.append(history.current.size)
+
+    try:
+        assert history.nbytes()[1] > 0
+
+        for index in range(len(EDITS) - 1, -1, -1):
+            history.undo()
+            assert history.current.size == sizes[index]
+            assert history.current.tobytes() == states[index]
+        assert not history.can_undo()
+
+        for index in range(1, len(EDITS) + 1):
+            history.redo()
+            assert history.current.size == sizes[index]
+            assert history.current.tobytes() == states[index]
+        assert not history.can_redo()
+
+        for index, state in enumerate(states):
+            assert history.rebuild(index).tobytes() == state
+    finally:
+        history.close()
+
+
+def test_new_edit_after_undo_discards_redo():
+    history = History(noise_image(), memory_budget=1)
+    try:
+        apply_edit(history, EDITS[0])
+        apply_edit(history, EDITS[2])
+        history.undo()
+        apply_edit(history, EDITS[1])
+
+        assert not history.can_redo()
+        assert len(history) == 3
+        assert [op["color"] for op in history.operations()] == ["white", "red"]
+    finally:
+        history.close()
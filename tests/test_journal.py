@@ -0,0 +1,111 @@
+"""journal.py のテスト"""
+
+import os
+
+from PIL import Image
+
+import journal
+from history import History
+from journal import Journal, find_sessions, read_journal
+from operations import (
+    apply_operations,
+    crop_image,
+    fill_operation,
+    fill_polygons,
+    polygons_bbox,
+)
+
+
+def edit_fill(history, log, polygons):
+    base = history.current
+    box = polygons_bbox(polygons, base.size)
+    before = base.crop(box)
+    fill_polygons(base, polygons)
+    operation = fill_operation(polygons)
+    history.record_patch(box, before, base.crop(box), operation)
+    log.operation(operation, base)
+
+
+def edit_crop(history, log, box):
+    image = crop_image(history.current, box)
+    history.record_crop(box, image)
+    log.operation({"op": "crop", "box": list(box)}, image)
+
+
+def record_session(tmp_path):
+    """元の画像を編集しながらジャーナルに記録し、(元の画像のパス, 履歴) を返す"""
+    source = os.path.join(tmp_path, "photo.png")
+    Image.linear_gradient("L").resize((160, 120)).convert("RGB").save(source)
+
+    log = Journal(os.path.join(tmp_path, "journal"))
+    history = History(Image.open(source).convert("RGB"))
+    log.start(source)
+    edit_fill(history, log, [([(10, 10), (120, 20), (40, 90)], "white")])
+    edit_crop(history, log, (8, 6, 150, 112))
+    edit_fill(
+        history,
+        log,
+        [
+            ([(5, 5), (60, 30), (20, 80)], "red"),
+            ([(70, 70), (130, 60), (90, 100)], "blue"),
+        ],
+    )
+    # 元に戻した後の編集で、やり直しの分は捨てられる
+    history.undo()
+    log.undo()
+    edit_fill(history, log, [([(0, 0), (100, 10), (50, 90)], "green")])
+    history.undo()
+    log.undo()
+    history.redo()
+    log.redo()
+    edit_crop(history, log, (4, 4, 120, 96))
+    log.saturation(1.5)
+    log.flush()
+    # 異常終了したものとしてファイルを残す
+    log.close(remove=False)
+    return source, log, history
+
+
+def test_replaying_journal_reproduces_edits(tmp_path):
+    source, log, history = record_session(tmp_path)
+
+    session = read_journal(log.path)
+
+    assert session.path == source
+    assert session.source_available()
+    assert session.dirty
+    assert session.saturation == 1.5
+    assert session.operations == history.operations()
+    replayed = apply_operations(Image.open(source).convert("RGB"), session.operations)
+    assert replayed.size == history.current.size
+    assert replayed.tobytes() == history.current.tobytes()
+
+
+def test_replaying_from_checkpoint_when_source_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "CHECKPOINT_INTERVAL", 2)
+    source, log, history = record_session(tmp_path)
+    Image.new("RGB", (10, 10)).save(source)
+
+    session = read_journal(log.path)
+
+    assert not session.source_available()
+    assert session.checkpoint is not None
+    file_path, start = session.checkpoint
+    assert start > 0
+    with Image.open(file_path) as checkpoint:
+        image = checkpoint.convert("RGB")
+    replayed = apply_operations(image, session.operations[start:])
+    assert replayed.tobytes() == history.current.tobytes()
+
+
+def test_saved_session_is_not_dirty(tmp_path):
+    log = Journal(os.path.join(tmp_path, "journal"))
+    log.start(os.path.join(tmp_path, "missing.png"))
+    log.operation({"op": "crop", "box": [0, 0, 4, 4]}, Image.new("RGB", (8, 8)))
+    log.saved()
+    log.flush()
+    log.close(remove=False)
+
+    assert not read_journal(log.path).dirty
+    # 実行中のプロセスのジャーナルは復旧の対象にしない
+    assert find_sessions(log.directory) == []
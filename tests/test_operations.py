@@ -0,0 +1,79 @@
+"""operations.py のテスト"""
+
+import pytest
+from PIL import Image, ImageChops
+
+from operations import fill_polygon, fill_polygons, polygons_bbox
+from outofcore import map_image
+
+POLYGONS = [
+    ([(10, 10), (120, 20), (40, 90)], "white"),
+    ([(60, 40), (150, 50), (100, 110)], "red"),
+    ([(5, 100), (30, 70), (70, 118)], "blue"),
+]
+
+
+def sample_image(mode):
+    """塗りつぶす前の画像（P はパレットに使う色を含めておく）"""
+    image = Image.linear_gradient("L").resize((160, 120))
+    if mode == "P":
+        return image.convert("RGB").convert("P", palette=Image.Palette.ADAPTIVE)
+    return image.convert(mode)
+
+
+def colors_for(mode, polygons):
+    """L と P の画像には、色名の代わりにその画像での色の値を使う"""
+    if mode not in ("L", "P"):
+        return polygons
+    return [(points, index) for index, (points, _) in enumerate(polygons, 1)]
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P"])
+@pytest.mark.parametrize("count", [1, 2, 3])
+def test_fill_polygons_matches_filling_one_by_one(mode, count):
+    polygons = colors_for(mode, POLYGONS[:count])
+    merged = sample_image(mode)
+    one_by_one = merged.copy()
+
+    box = fill_polygons(merged, polygons)
+    for points, color in polygons:
+        fill_polygon(one_by_one, points, color)
+
+    assert box == polygons_bbox(polygons, merged.size)
+    assert merged.tobytes() == one_by_one.tobytes()
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "P"])
+def test_fill_polygons_with_color_names(mode):
+    merged = sample_image(mode)
+    one_by_one = merged.copy()
+
+    fill_polygons(merged, POLYGONS)
+    for points, color in POLYGONS:
+        fill_polygon(one_by_one, points, color)
+
+    assert merged.tobytes() == one_by_one.tobytes()
+    if mode == "P":
+        assert merged.getpalette() == one_by_one.getpalette()
+
+
+def test_fill_polygons_on_mapped_image():
+    image = sample_image("RGB")
+    mapped = map_image(image)
+    expected = image.copy()
+
+    fill_polygons(mapped, POLYGONS)
+    for points, color in POLYGONS:
+        fill_polygon(expected, points, color)
+
+    assert ImageChops.difference(mapped.convert("RGB"), expected).getbbox() is None
+
+
+def test_fill_polygons_outside_image_changes_nothing():
+    image = sample_image("RGB")
+    before = image.copy()
+
+    box = fill_polygons(image, [([(200, 200), (220, 200), (210, 230)], "red")])
+
+    assert box[0] >= box[2] or box[1] >= box[3]
+    assert ImageChops.difference(image, before).getbbox() is None
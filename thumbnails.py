@@ -0,0 +1,202 @@
+"""フォルダの画像のサムネイルの索引
+
+サムネイルは1つの SQLite のファイルにまとめて保存し、次回以降の起動でも
+使い回す。各項目はファイルのパス・更新日時・サイズで管理し、ファイルが
+変わった画像だけを作り直す。作成はプロセスプールで並列に行う。
+
+フォルダのサムネイルを前もって作成する:
+    uv run thumbnails.py フォルダ
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image
+
+from loader import directory_images, open_image
+
+# サムネイルの最大の大きさ
+THUMBNAIL_SIZE = (128, 96)
+
+# まとめて書き込む件数
+COMMIT_INTERVAL = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    thumbnail_size TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS thumbnails_directory ON thumbnails (directory);
+"""
+
+
+def default_index_path():
+    """ユーザーのキャッシュフォルダにある索引のパス"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "PythonPhotoEditor", "thumbnails.sqlite")
+
+
+def make_thumbnail(file_path, size=THUMBNAIL_SIZE):
+    """サムネイルを作成して JPEG のバイト列で返す（ワーカープロセスで実行）"""
+    with open_image(file_path) as image:
+        # JPEG は縮小しながらデコードする
+        image.draft("RGB", size)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ThumbnailIndex:
+    """パス・更新日時・サイズをキーにしたサムネイルの索引
+
+    接続は作成したスレッドでのみ使える（SQLite の制約）。
+    """
+
+    def __init__(self, path=None, size=THUMBNAIL_SIZE):
+        self.path = path or default_index_path()
+        self.size = size
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # エディタの起動を速くするため、初めて索引を開く時に読み込む
+        import sqlite3
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _size_key(self):
+        return f"{self.size[0]}x{self.size[1]}"
+
+    def lookup(self, file_path, stat=None):
+        """ファイルが変わっていなければ保存してあるサムネイルを返す（ない場合は None）"""
+        file_path = os.path.abspath(file_path)
+        stat = stat or os.stat(file_path)
+        row = self.connection.execute(
+            "SELECT data FROM thumbnails"
+            " WHERE path = ? AND mtime_ns = ? AND size = ? AND thumbnail_size = ?",
+            (file_path, stat.st_mtime_ns, stat.st_size, self._size_key()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def store(self, file_path, stat, data):
+        file_path = os.path.abspath(file_path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                file_path,
+                os.path.dirname(file_path),
+                stat.st_mtime_ns,
+                stat.st_size,
+                self._size_key(),
+                data,
+            ),
+        )
+
+    def prune(self, directory, file_paths):
+        """directory の項目のうち、file_paths にないもの（削除されたファイル）を消す"""
+        directory = os.path.abspath(directory)
+        existing = {os.path.abspath(path) for path in file_paths}
+        stale = [
+            (path,)
+            for (path,) in self.connection.execute(
+                "SELECT path FROM thumbnails WHERE directory = ?", (directory,)
+            )
+            if path not in existing
+        ]
+        self.connection.executemany("DELETE FROM thumbnails WHERE path = ?", stale)
+        self.connection.commit()
+
+    def update(self, file_paths, workers=None):
+        """file_paths のサムネイルを (パス, JPEG のバイト列) として順に返す
+
+        保存してあるものを先に返し、新しいファイルや変わったファイルの
+        サムネイルはプロセスプールで作成して、できたものから返す。
+        作成できなかったファイルは返さない。
+        """
+        missing = []
+        for file_path in file_paths:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            data = self.lookup(file_path, stat)
+            if data is None:
+                missing.append((file_path, stat))
+            else:
+                yield file_path, data
+        if not missing:
+            return
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        # GUI のスレッドから呼ばれても安全なよう、fork ではなく spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = {
+                pool.submit(make_thumbnail, file_path, self.size): (file_path, stat)
+                for file_path, stat in missing
+            }
+            try:
+                for count, future in enumerate(as_completed(futures), 1):
+                    file_path, stat = futures[future]
+                    try:
+                        data = future.result()
+                    except Exception:
+                        continue
+                    self.store(file_path, stat, data)
+                    if count % COMMIT_INTERVAL == 0:
+                        self.connection.commit()
+                    yield file_path, data
+            finally:
+                # 途中で打ち切られた場合は、始まっていない作成を取り消す
+                for future in futures:
+                    future.cancel()
+                self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="フォルダの画像のサムネイルを前もって作成します"
+    )
+    parser.add_argument("directory", help="画像のフォルダ")
+    parser.add_argument("--index", help="索引のパス（既定はユーザーのキャッシュ）")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="並列に処理するプロセス数"
+    )
+    args = parser.parse_args(argv)
+
+    paths = directory_images(args.directory)
+    start = time.perf_counter()
+    with ThumbnailIndex(args.index) as index:
+        index.prune(args.directory, paths)
+        count = sum(1 for _ in index.update(paths, args.workers))
+    elapsed = time.perf_counter() - start
+    print(f"{count}/{len(paths)} 件のサムネイル ({elapsed:.1f}秒): {index.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())